@@ -0,0 +1,331 @@
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import importlib
+import platform
+import subprocess
+import contextlib
+import multiprocessing
+from datetime import datetime, timezone
+from src.Benchmarks.SyntheticRedditGenerator import SyntheticRedditGenerator, SCALES
+from src.Instrumentation import reset_peak_rss, peak_rss, cpu_time
+
+
+# --- Stages ---
+# Each stage has a prepare function, whose time and memory are not measured, and a run function that
+# returns the number of records it processed. Both get the context dictionary built by BenchmarkSuite.
+
+def _comments_texts(ctx):
+    from src.PreProcessing.JsonPreprocessor import JsonPreprocessor
+    return [text for _, text in JsonPreprocessor(ctx['comments'], ctx['time']).iter_reddit_comments()]
+
+
+def run_json_preprocessor(ctx, prepared):
+    from src.PreProcessing.JsonPreprocessor import JsonPreprocessor
+    output_path = os.path.join(ctx['workdir'], 'raw_comments.txt')
+    return JsonPreprocessor(ctx['comments'], ctx['time'], workers=ctx['workers']).write_plain_text(output_path, False)
+
+
+def run_natural_language_processor(ctx, texts):
+    from src.PreProcessing.NaturalLanguageProcessor import normalize_many
+    return len(normalize_many(texts, workers=ctx['workers']))
+
+
+def run_preprocess(ctx, prepared):
+    from src.PreProcessing.JsonPreprocessor import JsonPreprocessor
+    from src.PreProcessing.NaturalLanguageProcessor import NaturalLanguageProcessor
+    count = 0
+    for path, posts in ((ctx['posts'], True), (ctx['comments'], False)):
+        output_path = os.path.splitext(path)[0] + '.txt'
+        count += JsonPreprocessor(path, ctx['time']).write_plain_text(
+            output_path, posts, normalize=lambda text: NaturalLanguageProcessor(text).text)
+    return count
+
+
+def run_posts_comments_linker(ctx, prepared):
+    from src.PreProcessing.PostsCommentsLinker import PostsCommentsLinker
+    linker = PostsCommentsLinker(ctx['posts'], ctx['comments'], workers=ctx['workers'])
+    linker.link_comments_to_posts()
+    linker.save_linked_data(os.path.join(ctx['workdir'], 'linked_data.json'))
+    return len(linker.linked_data)
+
+
+def prepare_tfidf(ctx):
+    from src.PreProcessing.NaturalLanguageProcessor import normalize_many
+    from src.PreProcessing.PostsCommentsLinker import PostsCommentsLinker
+    linker = PostsCommentsLinker(ctx['posts'], ctx['comments'])
+    linker.link_comments_to_posts()
+    return normalize_many(linker.linked_data, workers=ctx['workers'])
+
+
+def run_tfidf(ctx, linked_data):
+    from src.TextAnalytics.TfIdf import OverallTfidfComputer
+    OverallTfidfComputer(top_n=20).compute_overall_tfidf(linked_data)
+    return len(linked_data)
+
+
+def _normalized_text(ctx, path):
+    """
+    :return:
+    The path of the normalized text of a JSONL file, written by the preprocess stage or here.
+    """
+    output_path = os.path.splitext(path)[0] + '.txt'
+    if not os.path.exists(output_path):
+        from src.main import preprocess_text
+        preprocess_text(path, path == ctx['posts'], ctx['time'])
+    return output_path
+
+
+def _count_tokens(text_path):
+    """
+    Counted when the stage is prepared, so that this extra read is not timed as part of the stage.
+    """
+    with open(text_path, 'r', encoding='utf-8') as text_file:
+        return sum(len(line.split()) for line in text_file)
+
+def prepare_collocations(ctx):
+    text_path = _normalized_text(ctx, ctx['comments'])
+    return text_path, _count_tokens(text_path)
+
+
+def run_collocations(ctx, prepared):
+    from src.main import wordCollolcations
+    text_path, n_tokens = prepared
+    wordCollolcations(os.path.dirname(text_path), os.path.splitext(os.path.basename(text_path))[0])
+    return n_tokens
+
+
+def prepare_kernel_density(ctx):
+    text_path = _normalized_text(ctx, ctx['posts'])
+    return text_path, _count_tokens(text_path)
+
+
+def run_kernel_density(ctx, prepared):
+    from src.TextAnalytics.KernelDensity import KernelDensity
+    text_path, n_tokens = prepared
+    kernel_density = KernelDensity(text_path, backend=ctx['kde_backend'], workers=ctx['workers'])
+    kernel_density.build_graph()
+    kernel_density.save_graph('benchmark_kde')
+    return n_tokens
+
+
+# Imported before a stage is prepared, so that import time is not measured as part of a stage
+MODULES = ('src.PreProcessing.JsonPreprocessor', 'src.PreProcessing.NaturalLanguageProcessor',
+           'src.PreProcessing.PostsCommentsLinker', 'src.TextAnalytics.TfIdf', 'src.TextAnalytics.KernelDensity',
+           'src.main')
+
+# name: (prepare, run, unit)
+STAGES = {
+    'json_preprocessor': (None, run_json_preprocessor, 'records'),
+    'natural_language_processor': (_comments_texts, run_natural_language_processor, 'records'),
+    'preprocess': (None, run_preprocess, 'records'),
+    'posts_comments_linker': (None, run_posts_comments_linker, 'posts'),
+    'tfidf': (prepare_tfidf, run_tfidf, 'documents'),
+    'collocations': (prepare_collocations, run_collocations, 'tokens'),
+    'kernel_density': (prepare_kernel_density, run_kernel_density, 'tokens'),
+}
+
+
+def _stage_process(name, ctx, queue):
+    """
+    Runs one stage in a fresh process, so that its peak memory is not shared with other stages.
+    """
+    prepare, run, unit = STAGES[name]
+    result = {'unit': unit}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()) if ctx['quiet'] else contextlib.nullcontext():
+            for module in MODULES:
+                importlib.import_module(module)
+            if name == 'kernel_density' and ctx['kde_backend'] == 'native':
+                importlib.import_module('src.TextAnalytics.KdeGraphBuilder')
+            prepared = prepare(ctx) if prepare else None
+            reset_peak_rss()
+            start_wall, start_cpu = time.perf_counter(), cpu_time()
+            records = run(ctx, prepared)
+            seconds, cpu_seconds = time.perf_counter() - start_wall, cpu_time() - start_cpu
+        result.update({
+            'records': records,
+            'seconds': seconds,
+            'cpu_seconds': cpu_seconds,
+            'records_per_second': records / seconds if seconds > 0 else None,
+            'peak_rss_bytes': peak_rss(),
+        })
+    except Exception as error:
+        result['error'] = f'{type(error).__name__}: {error}'
+    queue.put(result)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class BenchmarkSuite:
+    def __init__(self, workdir, scale='small', factor=1.0, seed=0, workers=1, kde_backend='native', quiet=True):
+        """
+        Times the pipeline stages on a synthetic Reddit dump, each stage in its own process.
+        :param workdir: Directory of the synthetic files and the stage outputs.
+        :param scale: A key of SyntheticRedditGenerator.SCALES, e.g. 'lgbt' for the largest subreddit.
+        :param factor: Multiplies the number of posts and comments of the scale.
+        :param seed: Seed of the synthetic data, runs are only comparable with the same seed and scale.
+        :param workers: Number of worker processes of the stages that support them.
+        :param kde_backend: Backend of KernelDensity, 'native' or 'textplot'.
+        :param quiet: Hide the printed output of the stages.
+        """
+        self.workdir = workdir
+        self.scale = scale
+        self.factor = factor
+        self.seed = seed
+        self.workers = workers
+        self.kde_backend = kde_backend
+        self.quiet = quiet
+
+    def generate(self):
+        """
+        Writes the synthetic dump, unless the files of this scale, factor and seed already exist.
+        :return:
+        (posts_path, comments_path) of the period used by the stages.
+        """
+        data_dir = os.path.join(self.workdir, f'{self.scale}_x{self.factor:g}_seed{self.seed}')
+        marker = os.path.join(data_dir, 'complete')
+        if not os.path.exists(marker):
+            generator = SyntheticRedditGenerator(seed=self.seed)
+            n_posts, n_comments = SCALES[self.scale]
+            paths = generator.write(data_dir, 'Synthetic', 'beforeElection', int(n_posts * self.factor), int(n_comments * self.factor))
+            open(marker, 'w').close()
+            return paths
+        return (os.path.join(data_dir, 'r_Synthetic_posts(beforeElection).jsonl'),
+                os.path.join(data_dir, 'r_Synthetic_comments(beforeElection).jsonl'))
+
+    def run(self, stages=None):
+        """
+        :param stages: Names of STAGES to run, all of them if None.
+        :return:
+        The results dictionary, see save.
+        """
+        posts_path, comments_path = self.generate()
+        ctx = {
+            'workdir': os.path.dirname(posts_path),
+            'posts': posts_path,
+            'comments': comments_path,
+            'time': 'beforeTheElection',
+            'workers': self.workers,
+            'kde_backend': self.kde_backend,
+            'quiet': self.quiet,
+        }
+        results = {
+            'meta': {
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'scale': self.scale,
+                'factor': self.factor,
+                'seed': self.seed,
+                'workers': self.workers,
+                'kde_backend': self.kde_backend,
+                'input_bytes': os.path.getsize(posts_path) + os.path.getsize(comments_path),
+            },
+            'stages': {},
+        }
+
+        context = multiprocessing.get_context('spawn')
+        for name in stages or STAGES:
+            print(f"Running stage: {name}")
+            queue = context.Queue()
+            process = context.Process(target=_stage_process, args=(name, ctx, queue))
+            process.start()
+            result = queue.get()
+            process.join()
+            results['stages'][name] = result
+            if 'error' in result:
+                print(f"  failed: {result['error']}")
+            else:
+                print(f"  {result['seconds']:.2f} s, {format_rate(result['records_per_second'], result['unit'])}, "
+                      f"peak RSS {format_bytes(result['peak_rss_bytes'])}")
+        return results
+
+
+def format_bytes(value):
+    return 'n/a' if value is None else f'{value / (1 << 20):.1f} MiB'
+
+
+def format_rate(value, unit):
+    # None when the stage finished too fast to be timed
+    return f'n/a {unit}/s' if value is None else f'{value:.0f} {unit}/s'
+
+
+def save(results, output_path):
+    with open(output_path, 'w', encoding='utf8') as output_file:
+        json.dump(results, output_file, indent=4)
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Flags stages that got slower or use more memory than in the baseline run.
+    :param tolerance: Allowed relative change, e.g. 0.1 for 10%.
+    :return:
+    List of regression messages, empty if there is none.
+    """
+    regressions = []
+    for meta_key in ('scale', 'factor', 'seed'):
+        if results['meta'].get(meta_key) != baseline['meta'].get(meta_key):
+            regressions.append(f"Runs are not comparable: {meta_key} differs "
+                               f"({results['meta'].get(meta_key)} vs {baseline['meta'].get(meta_key)})")
+    for name, result in results['stages'].items():
+        base = baseline['stages'].get(name)
+        if base is None or 'error' in base:
+            continue
+        if 'error' in result:
+            regressions.append(f"{name}: failed ({result['error']})")
+            continue
+        if result['records_per_second'] is not None and base['records_per_second'] is not None \
+                and result['records_per_second'] < base['records_per_second'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {result['records_per_second']:.0f} {result['unit']}/s, "
+                               f"baseline {base['records_per_second']:.0f}")
+        if result['peak_rss_bytes'] and base['peak_rss_bytes'] and result['peak_rss_bytes'] > base['peak_rss_bytes'] * (1 + tolerance):
+            regressions.append(f"{name}: peak RSS {format_bytes(result['peak_rss_bytes'])}, "
+                               f"baseline {format_bytes(base['peak_rss_bytes'])}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic Reddit data.")
+    parser.add_argument('--workdir', default='benchmark_data', help="Directory of the synthetic data")
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--factor', type=float, default=1.0, help="Multiplies the size of the scale")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=None)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--kde-backend', choices=('native', 'textplot'), default='native')
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file of the results")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    parser.add_argument('--verbose', action='store_true', help="Show the output of the stages")
+    args = parser.parse_args(argv)
+
+    suite = BenchmarkSuite(args.workdir, args.scale, args.factor, args.seed, args.workers, args.kde_backend, not args.verbose)
+    results = suite.run(args.stages)
+    save(results, args.output)
+    print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf8') as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    # Example usage:
+    # python -m src.Benchmarks.BenchmarkSuite --scale MensRights --output results.json --baseline baseline.json
+    main()
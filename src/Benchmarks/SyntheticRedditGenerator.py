@@ -0,0 +1,159 @@
+import os
+import json
+import zlib
+import string
+import numpy as np
+from tqdm import tqdm
+
+# Number of (posts, comments) per subreddit before the election, from src/Readme.md
+SCALES = {
+    'tiny': (200, 2000),
+    'small': (2000, 25000),
+    'MensRights': (5822, 125560),
+    'Feminism': (5940, 63675),
+    'lgbt': (37892, 1687656),
+}
+
+# Period name, first and last day (UTC timestamps) of the before and after election dumps
+PERIODS = {
+    'beforeElection': (1716854400, 1730764799),
+    'afterElection': (1730764800, 1744675199),
+}
+
+NOISE = ['http://www.reddit.com/r/example', 'https://x.com/status/123', '😉', '🙄', '❤️', '**bold**', '*italic*',
+         '&amp;', '...', '!', '?', ',', '—', "don't", "I'm", 'über', 'naïve', '#tag', '@user', '123']
+REMOVED = ['[removed]', '[deleted]', '']
+
+
+class SyntheticRedditGenerator:
+    def __init__(self, seed=0, vocabulary_size=30000, zipf_exponent=1.1, noise_rate=0.05, removed_rate=0.1):
+        """
+        Writes Pushshift-shaped posts and comments JSONL files with the fields of the structures in
+        src/Readme.md. Words are drawn from a Zipf distribution over generated pseudo-words, mixed with links,
+        emojis, markup and punctuation, so that the preprocessing has the same kind of work to do as on the
+        real dumps. Comments form reply trees below the posts of the same file.
+        :param seed: Seed of the random generator, the same seed writes the same files.
+        :param vocabulary_size: Number of distinct words.
+        :param zipf_exponent: Exponent of the word frequency distribution.
+        :param noise_rate: Share of tokens replaced by noise.
+        :param removed_rate: Share of texts that are '[removed]', '[deleted]' or empty.
+        """
+        self.rng = np.random.default_rng(seed)
+        self.noise_rate = noise_rate
+        self.removed_rate = removed_rate
+        self.vocabulary = self._pseudo_words(vocabulary_size)
+        ranks = np.arange(1, vocabulary_size + 1, dtype=np.float64)
+        weights = ranks ** -zipf_exponent
+        self.cumulative = np.cumsum(weights / weights.sum())
+
+    def _pseudo_words(self, size):
+        letters = np.array(list(string.ascii_lowercase))
+        words, seen = [], set()
+        while len(words) < size:
+            word = ''.join(self.rng.choice(letters, self.rng.integers(2, 10)))
+            if word not in seen:
+                seen.add(word)
+                words.append(word)
+        return words
+
+    def texts(self, count, mean_words):
+        """
+        :return:
+        A list of count texts with a geometric number of words around mean_words.
+        """
+        lengths = self.rng.geometric(1 / (mean_words + 1), count) - 1
+        ids = np.minimum(np.searchsorted(self.cumulative, self.rng.random(lengths.sum())), len(self.vocabulary) - 1)
+        noise = self.rng.random(lengths.sum()) < self.noise_rate
+        noise_ids = self.rng.integers(0, len(NOISE), lengths.sum())
+        tokens = [NOISE[n] if is_noise else self.vocabulary[i] for i, is_noise, n in zip(ids.tolist(), noise.tolist(), noise_ids.tolist())]
+
+        removed = self.rng.random(count) < self.removed_rate
+        removed_ids = self.rng.integers(0, len(REMOVED), count)
+        texts, start = [], 0
+        for length, is_removed, removed_id in zip(lengths.tolist(), removed.tolist(), removed_ids.tolist()):
+            texts.append(REMOVED[removed_id] if is_removed else ' '.join(tokens[start:start + length]))
+            start += length
+        return texts
+
+    def write(self, directory, subreddit, period, n_posts, n_comments, batch_size=10000):
+        """
+        Writes r_<subreddit>_posts(<period>).jsonl and r_<subreddit>_comments(<period>).jsonl.
+        :param period: A key of PERIODS, it sets the range of the created_utc timestamps.
+        :return:
+        (posts_path, comments_path)
+        """
+        os.makedirs(directory, exist_ok=True)
+        start, end = PERIODS[period]
+        subreddit_id = 't5_' + np.base_repr(zlib.crc32(subreddit.encode('utf8')) % 36 ** 5, 36).lower()
+        posts_path = os.path.join(directory, f'r_{subreddit}_posts({period}).jsonl')
+        comments_path = os.path.join(directory, f'r_{subreddit}_comments({period}).jsonl')
+
+        post_times = np.sort(self.rng.integers(start, end, n_posts))
+        post_ids = [np.base_repr(start + i, 36).lower() for i in range(n_posts)]
+        with open(posts_path, 'w', encoding='utf8') as posts_file:
+            for offset in tqdm(range(0, n_posts, batch_size), desc="Writing posts", unit="batch"):
+                count = min(batch_size, n_posts - offset)
+                titles = self.texts(count, 10)
+                selftexts = self.texts(count, 120)
+                for i in range(count):
+                    post_id = post_ids[offset + i]
+                    posts_file.write(json.dumps({
+                        'author': f'user{self.rng.integers(0, 50000)}',
+                        'created_utc': int(post_times[offset + i]),
+                        'id': post_id,
+                        'name': f't3_{post_id}',
+                        'num_comments': 0,
+                        'permalink': f'/r/{subreddit}/comments/{post_id}/',
+                        'score': int(self.rng.integers(0, 500)),
+                        'selftext': selftexts[i],
+                        'subreddit': subreddit,
+                        'subreddit_id': subreddit_id,
+                        'title': titles[i] or 'Title',
+                    }, ensure_ascii=False) + '\n')
+
+        # Each comment replies to a post or to an earlier comment of the same post
+        comment_posts = self.rng.integers(0, max(n_posts, 1), n_comments)
+        reply_to_comment = self.rng.random(n_comments) < 0.6
+        last_comment = {}
+        comment_times = np.sort(self.rng.integers(start, end, n_comments))
+        with open(comments_path, 'w', encoding='utf8') as comments_file:
+            for offset in tqdm(range(0, n_comments, batch_size), desc="Writing comments", unit="batch"):
+                count = min(batch_size, n_comments - offset)
+                bodies = self.texts(count, 35)
+                for i in range(count):
+                    index = offset + i
+                    comment_id = np.base_repr(end + index, 36).lower()
+                    post = int(comment_posts[index])
+                    post_id = post_ids[post] if n_posts else 'missing'
+                    parent = last_comment.get(post) if reply_to_comment[index] else None
+                    comments_file.write(json.dumps({
+                        'author': f'user{self.rng.integers(0, 50000)}',
+                        'body': bodies[i],
+                        'created_utc': int(comment_times[index]),
+                        'id': comment_id,
+                        'link_id': f't3_{post_id}',
+                        'name': f't1_{comment_id}',
+                        'parent_id': f't1_{parent}' if parent else f't3_{post_id}',
+                        'score': int(self.rng.integers(-20, 200)),
+                        'subreddit': subreddit,
+                        'subreddit_id': subreddit_id,
+                    }, ensure_ascii=False) + '\n')
+                    last_comment[post] = comment_id
+        return posts_path, comments_path
+
+    def write_scale(self, directory, scale='small', factor=1.0, subreddit='Synthetic', periods=('beforeElection', 'afterElection')):
+        """
+        Writes the files of every period at one of the SCALES, multiplied by factor.
+        :return:
+        {period: (posts_path, comments_path)}
+        """
+        n_posts, n_comments = SCALES[scale]
+        return {period: self.write(directory, subreddit, period, int(n_posts * factor), int(n_comments * factor))
+                for period in periods}
+
+
+if __name__ == "__main__":
+    # Example usage
+    generator = SyntheticRedditGenerator(seed=0)
+    paths = generator.write_scale('C:/Users/marti/documents/Text-Analytics-in-the-Digital-Humanities/data/synthetic', 'MensRights')
+    print(paths)
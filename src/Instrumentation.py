@@ -0,0 +1,261 @@
+import os
+import sys
+import csv
+import json
+import time
+import atexit
+import cProfile
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Set by enable() so that worker processes of pools and the pipeline runner record into the same output
+ENVIRONMENT_VARIABLE = 'TEXT_ANALYTICS_INSTRUMENTATION'
+FIELDS = ('stage', 'pid', 'start', 'wall_seconds', 'cpu_seconds', 'items', 'bytes_read', 'bytes_written',
+          'peak_rss_bytes', 'profile', 'error')
+
+
+def reset_peak_rss():
+    """
+    Resets the peak resident set size of this process where the OS allows it (Linux).
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss():
+    """
+    :return:
+    The peak resident set size of this process in bytes, None if it cannot be measured.
+    """
+    try:
+        with open('/proc/self/status', 'r') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+    except (ImportError, AttributeError):
+        return None
+
+
+def cpu_time():
+    """
+    :return:
+    CPU seconds of this process and of its finished child processes, e.g. pool workers.
+    """
+    if resource is None:
+        return time.process_time()
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class _NullStage:
+    """
+    Returned by stage() while instrumentation is disabled, every method does nothing.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def add(self, items=0, bytes_read=0, bytes_written=0):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Stage:
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+        self.items = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.profiler = None
+
+    def add(self, items=0, bytes_read=0, bytes_written=0):
+        """
+        Counts the work done by the stage, can be called any number of times.
+        """
+        self.items += items
+        self.bytes_read += bytes_read
+        self.bytes_written += bytes_written
+
+    def __enter__(self):
+        # The peak is only reset by outermost stages, a nested stage reports the peak since its outermost stage began
+        if not self.recorder.depth:
+            reset_peak_rss()
+        self.recorder.depth += 1
+        if self.name in self.recorder.profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.start = time.time()
+        self.start_wall, self.start_cpu = time.perf_counter(), cpu_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall, cpu = time.perf_counter() - self.start_wall, cpu_time() - self.start_cpu
+        profile_path = None
+        if self.profiler is not None:
+            self.profiler.disable()
+            profile_path = os.path.join(self.recorder.profile_dir, f'{self.name}.{os.getpid()}.{int(self.start)}.prof')
+            self.profiler.dump_stats(profile_path)
+        self.recorder.depth -= 1
+        self.recorder.record({
+            'stage': self.name,
+            'pid': os.getpid(),
+            'start': self.start,
+            'wall_seconds': wall,
+            'cpu_seconds': cpu,
+            'items': self.items,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'peak_rss_bytes': peak_rss(),
+            'profile': profile_path,
+            'error': exc_type.__name__ if exc_type is not None else None,
+        })
+        return False
+
+
+class Recorder:
+    def __init__(self, output_path=None, profile=(), profile_dir=None):
+        """
+        Collects one record per finished stage. Records are kept in memory and, with an output_path,
+        appended to that JSONL file as soon as the stage ends, one line each, so processes can share it.
+        :param output_path: JSONL file the records are appended to.
+        :param profile: Names of the stages that run under cProfile.
+        :param profile_dir: Directory of the .prof files, defaults to the directory of output_path.
+        """
+        self.output_path = output_path
+        self.profile = frozenset(profile)
+        self.profile_dir = profile_dir or os.path.dirname(os.path.abspath(output_path or 'profile'))
+        self.records = []
+        self.depth = 0
+        self._fd = None
+        if output_path:
+            self._fd = os.open(output_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            atexit.register(self.close)
+        if self.profile:
+            os.makedirs(self.profile_dir, exist_ok=True)
+
+    def record(self, record):
+        self.records.append(record)
+        if self._fd is not None:
+            # A single write of a whole line, appends of concurrent processes do not interleave
+            os.write(self._fd, (json.dumps(record) + '\n').encode('utf8'))
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+_recorder = None
+
+
+def enable(output_path=None, profile=(), profile_dir=None):
+    """
+    Turns instrumentation on for this process and for processes started from it afterwards.
+    :param output_path: JSONL file of the stage records, None keeps them in memory only (see records()).
+    :param profile: Names of stages to run under cProfile, e.g. ('tfidf',).
+    :return:
+    The Recorder.
+    """
+    global _recorder
+    _recorder = Recorder(output_path, profile, profile_dir)
+    os.environ[ENVIRONMENT_VARIABLE] = json.dumps({'output_path': output_path and os.path.abspath(output_path),
+                                                   'profile': sorted(_recorder.profile),
+                                                   'profile_dir': _recorder.profile_dir})
+    return _recorder
+
+
+def disable():
+    global _recorder
+    if _recorder is not None:
+        _recorder.close()
+    _recorder = None
+    os.environ.pop(ENVIRONMENT_VARIABLE, None)
+
+
+def enabled():
+    return _recorder is not None
+
+
+def stage(name):
+    """
+    Measures wall time, CPU time, peak memory and the counts passed to add() of a block of code:
+
+        with Instrumentation.stage('parse_comments') as s:
+            ...
+            s.add(items=1)
+
+    While instrumentation is disabled this returns a shared object whose methods do nothing.
+    """
+    if _recorder is None:
+        return _NULL_STAGE
+    return Stage(_recorder, name)
+
+
+def records():
+    """
+    :return:
+    The records of the stages that finished in this process.
+    """
+    return list(_recorder.records) if _recorder is not None else []
+
+
+def read_records(path):
+    with open(path, 'r', encoding='utf8') as records_file:
+        return [json.loads(line) for line in records_file if line.strip()]
+
+
+def write_csv(stage_records, path):
+    with open(path, 'w', encoding='utf8', newline='') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(stage_records)
+
+
+def summary(stage_records):
+    """
+    :return:
+    One dictionary per stage name with the summed times and counts, the number of runs and the largest peak.
+    """
+    totals = {}
+    for record in stage_records:
+        total = totals.setdefault(record['stage'], {'stage': record['stage'], 'runs': 0, 'wall_seconds': 0.0,
+                                                    'cpu_seconds': 0.0, 'items': 0, 'bytes_read': 0,
+                                                    'bytes_written': 0, 'peak_rss_bytes': 0})
+        total['runs'] += 1
+        for field in ('wall_seconds', 'cpu_seconds', 'items', 'bytes_read', 'bytes_written'):
+            total[field] += record[field]
+        total['peak_rss_bytes'] = max(total['peak_rss_bytes'], record['peak_rss_bytes'] or 0)
+    return list(totals.values())
+
+
+# Processes started by an instrumented process record too
+if os.environ.get(ENVIRONMENT_VARIABLE):
+    _settings = json.loads(os.environ[ENVIRONMENT_VARIABLE])
+    _recorder = Recorder(_settings['output_path'], _settings['profile'], _settings['profile_dir'])
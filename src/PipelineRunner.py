@@ -0,0 +1,166 @@
+import os
+import json
+import hashlib
+import traceback
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+
+def file_digest(path):
+    """
+    :return:
+    The SHA-256 of the file content, read in blocks.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _describe(arg):
+    # Objects such as a CorpusCache are identified by their type only, their repr is not stable across runs
+    if isinstance(arg, (str, int, float, bool, type(None))):
+        return arg
+    if isinstance(arg, (list, tuple)):
+        return [_describe(item) for item in arg]
+    if isinstance(arg, dict):
+        return {str(key): _describe(value) for key, value in arg.items()}
+    return type(arg).__name__
+
+
+class Stage:
+    def __init__(self, name, func, args=(), inputs=(), outputs=(), deps=()):
+        """
+        One step of the pipeline.
+        :param name: Unique name of the stage.
+        :param func: Module level function, called as func(*args) in a worker process.
+        :param args: Picklable arguments of func.
+        :param inputs: Files the stage reads. A stage depends on every stage that writes one of its inputs.
+        :param outputs: Files the stage writes.
+        :param deps: Names of further stages that have to finish first.
+        """
+        self.name = name
+        self.func = func
+        self.args = tuple(args)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = set(deps)
+
+    def __call__(self):
+        return self.func(*self.args)
+
+
+def _run_stage(stage):
+    stage()
+    return stage.name
+
+
+class PipelineRunner:
+    def __init__(self, stages, workers=None, check='mtime', state_path=None, force=False):
+        """
+        Runs a graph of stages in a process pool, each stage as soon as all stages it depends on are done.
+        A stage is skipped when its outputs are up to date:
+        check='mtime': every output exists and is newer than every input.
+        check='hash': the SHA-256 of the inputs and the arguments match the last successful run,
+        recorded in state_path.
+        :param stages: List of Stage.
+        :param workers: Number of processes, None uses all CPUs.
+        :param check: 'mtime' or 'hash'.
+        :param state_path: JSON file of the stage digests, required for check='hash'.
+        :param force: Run every stage.
+        """
+        assert check in ('mtime', 'hash'), f'Unknown check: {check}'
+        assert check != 'hash' or state_path, 'check=hash needs a state_path'
+        self.stages = {stage.name: stage for stage in stages}
+        assert len(self.stages) == len(stages), 'Stage names are not unique'
+        self.workers = workers
+        self.check = check
+        self.state_path = state_path
+        self.force = force
+        self.state = {}
+        if state_path and os.path.exists(state_path):
+            with open(state_path, 'r', encoding='utf8') as state_file:
+                self.state = json.load(state_file)
+
+        # Derive the dependencies from the files the stages read and write
+        writers = {os.path.abspath(path): stage.name for stage in stages for path in stage.outputs}
+        self.deps = {stage.name: stage.deps | {writers[os.path.abspath(path)] for path in stage.inputs
+                                               if os.path.abspath(path) in writers} for stage in stages}
+        unknown = {dep for deps in self.deps.values() for dep in deps} - set(self.stages)
+        assert not unknown, f'Unknown stages: {unknown}'
+
+    def digest(self, stage):
+        """
+        :return:
+        A digest of the stage's arguments and the content of its inputs.
+        """
+        description = json.dumps({'func': f'{stage.func.__module__}.{stage.func.__qualname__}',
+                                  'args': _describe(stage.args),
+                                  'inputs': [file_digest(path) for path in stage.inputs]})
+        return hashlib.sha256(description.encode('utf8')).hexdigest()
+
+    def is_up_to_date(self, stage):
+        if self.force or not stage.outputs or not all(os.path.exists(path) for path in stage.outputs):
+            return False
+        if not all(os.path.exists(path) for path in stage.inputs):
+            return False
+        if self.check == 'hash':
+            return self.state.get(stage.name) == self.digest(stage)
+        newest_input = max((os.path.getmtime(path) for path in stage.inputs), default=0)
+        return min(os.path.getmtime(path) for path in stage.outputs) >= newest_input
+
+    def _save_state(self):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf8') as state_file:
+            json.dump(self.state, state_file, indent=4)
+        os.replace(tmp_path, self.state_path)
+
+    def _finished(self, stage):
+        if self.check == 'hash':
+            self.state[stage.name] = self.digest(stage)
+            self._save_state()
+
+    def run(self):
+        """
+        :return:
+        {stage name: 'ran', 'skipped', 'failed' or 'blocked'}, a stage is blocked when a stage it depends on failed.
+        """
+        status = {}
+        pending = dict(self.deps)
+        running = {}
+
+        with ProcessPoolExecutor(self.workers) as pool:
+            while pending or running:
+                # Start or skip every stage whose dependencies are done
+                for name in [name for name, deps in pending.items() if deps <= status.keys()]:
+                    deps = pending.pop(name)
+                    stage = self.stages[name]
+                    if any(status[dep] in ('failed', 'blocked') for dep in deps):
+                        status[name] = 'blocked'
+                        print(f"Blocked: {name}")
+                    elif self.is_up_to_date(stage):
+                        status[name] = 'skipped'
+                        print(f"Up to date, skipped: {name}")
+                    else:
+                        print(f"Started: {name}")
+                        running[pool.submit(_run_stage, stage)] = name
+
+                if not running:
+                    if pending and not any(deps <= status.keys() for deps in pending.values()):
+                        raise ValueError(f'Cyclic dependencies between: {sorted(pending)}')
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception:
+                        status[name] = 'failed'
+                        print(f"Failed: {name}")
+                        traceback.print_exc()
+                    else:
+                        status[name] = 'ran'
+                        self._finished(self.stages[name])
+                        print(f"Finished: {name}")
+        return status
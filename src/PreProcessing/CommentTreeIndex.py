@@ -0,0 +1,292 @@
+import os
+import json
+import mmap
+from array import array
+import numpy as np
+from tqdm import tqdm
+from src.PreProcessing.RecordDecoder import RecordDecoder
+
+TREE_DECODER = RecordDecoder(('name', 'parent_id', 'link_id'))
+BODY_DECODER = RecordDecoder(('body',))
+
+ARRAYS = ('comment_id', 'post', 'parent', 'first_child', 'next_sibling', 'depth',
+          'preorder', 'pre', 'end', 'roots', 'offset', 'length', 'sorted_ids', 'sorted_nodes')
+
+
+def reddit_id_to_int(reddit_id):
+    """
+    Converts a reddit ID or fullname (e.g. 't1_lvfsfv6' or 'lvfsfv6') to its base 36 integer value.
+    """
+    return int(reddit_id.rpartition('_')[2], 36)
+
+
+class CommentTreeIndex:
+    def __init__(self, comments_path, arrays):
+        """
+        Reply tree of the comments in a JSONL file, stored as flat integer arrays.
+        Nodes are the comments in file order (node i is line i). For every node the index stores its
+        parent, first child and next sibling (-1 if there is none), its depth (0 for top level comments)
+        and its post. Trees are laid out in preorder, with the trees of a post next to each other, so
+        the subtree of node i is preorder[pre[i]:end[i]] and all subtree queries are slices.
+        Use CommentTreeIndex.build to create an index and load to open a saved one.
+        :param comments_path: Path to the comments JSONL file, used to read the comment bodies.
+        :param arrays: Dictionary with the arrays listed in ARRAYS.
+        """
+        self.comments_path = comments_path
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self._source = None
+
+    def __len__(self):
+        return len(self.comment_id)
+
+    @classmethod
+    def build(cls, comments_path):
+        """
+        Builds the index in one streaming pass over the comments file.
+        A comment whose parent is a post, or whose parent comment is not in the file, is a top level comment.
+        :param comments_path: Path to the comments JSONL file.
+        :return:
+        A CommentTreeIndex.
+        """
+        assert os.path.exists(comments_path), f'Path to file is incorrect: {comments_path}'
+        comment_ids, posts, parent_ids = array('Q'), array('Q'), array('Q')
+        is_reply, offsets, lengths = array('b'), array('q'), array('q')
+
+        offset = 0
+        with open(comments_path, 'rb') as json_file:
+            for line in tqdm(json_file, desc="Indexing comments", unit="comment"):
+                obj = TREE_DECODER.decode(line)
+                comment_ids.append(reddit_id_to_int(obj['name']))
+                posts.append(reddit_id_to_int(obj['link_id']))
+                parent_ids.append(reddit_id_to_int(obj['parent_id']))
+                is_reply.append(obj['parent_id'].startswith('t1_'))
+                offsets.append(offset)
+                lengths.append(len(line))
+                offset += len(line)
+
+        comment_id = np.frombuffer(comment_ids, dtype=np.uint64).copy()
+        post = np.frombuffer(posts, dtype=np.uint64).copy()
+        n = len(comment_id)
+
+        # Resolve parent comment IDs to node numbers
+        sorted_nodes = np.argsort(comment_id, kind='stable').astype(np.int32)
+        sorted_ids = comment_id[sorted_nodes]
+        parent_id = np.frombuffer(parent_ids, dtype=np.uint64)
+        parent = np.full(n, -1, dtype=np.int32)
+        if n:
+            position = np.minimum(np.searchsorted(sorted_ids, parent_id), n - 1)
+            found = np.frombuffer(is_reply, dtype=np.int8).astype(bool) & (sorted_ids[position] == parent_id)
+            parent[found] = sorted_nodes[position[found]]
+
+        arrays = cls._layout(parent, post)
+        arrays.update(
+            comment_id=comment_id,
+            post=post,
+            offset=np.frombuffer(offsets, dtype=np.int64).copy(),
+            length=np.frombuffer(lengths, dtype=np.int64).astype(np.int32),  # Lines are far below 2 GB
+            sorted_ids=sorted_ids,
+            sorted_nodes=sorted_nodes,
+        )
+        return cls(comments_path, arrays)
+
+    @staticmethod
+    def _layout(parent, post):
+        n = len(parent)
+        nodes = np.arange(n, dtype=np.int32)
+
+        # Children of a node are its replies in file order, linked through first_child and next_sibling
+        first_child = np.full(n, -1, dtype=np.int32)
+        next_sibling = np.full(n, -1, dtype=np.int32)
+        replies = nodes[parent >= 0]
+        replies = replies[np.argsort(parent[replies], kind='stable')]
+        same_parent = parent[replies[:-1]] == parent[replies[1:]]
+        next_sibling[replies[:-1][same_parent]] = replies[1:][same_parent]
+        is_first = np.ones(len(replies), dtype=bool)
+        is_first[1:] = ~same_parent
+        first_child[parent[replies[is_first]]] = replies[is_first]
+
+        # Top level comments, grouped by post
+        top_level = nodes[parent < 0]
+        top_level = top_level[np.argsort(post[top_level], kind='stable')]
+
+        # Iterative depth first traversal, the only per node Python loop
+        first_child_list = first_child.tolist()
+        next_sibling_list = next_sibling.tolist()
+        preorder = []
+        depth = [0] * n
+        end = [0] * n
+        visited = bytearray(n)
+
+        def traverse(root):
+            stack = [root]
+            visited[root] = 1
+            while stack:
+                node = stack[-1]
+                if node >= 0:
+                    # First visit: emit the node, then descend into its children
+                    preorder.append(node)
+                    stack[-1] = ~node
+                    child = first_child_list[node]
+                    children = []
+                    while child >= 0:
+                        if not visited[child]:
+                            visited[child] = 1
+                            depth[child] = depth[node] + 1
+                            children.append(child)
+                        child = next_sibling_list[child]
+                    stack.extend(reversed(children))
+                else:
+                    # Second visit: the whole subtree was emitted
+                    stack.pop()
+                    end[~node] = len(preorder)
+
+        for root in top_level.tolist():
+            traverse(root)
+        # Nodes on reply cycles (corrupt data) are unreachable from the top level, they are appended
+        # to the preorder as extra trees, but are not part of any thread
+        for node in range(n):
+            if not visited[node]:
+                parent[node] = -1
+                traverse(node)
+
+        preorder = np.array(preorder, dtype=np.int32)
+        pre = np.empty(n, dtype=np.int32)
+        pre[preorder] = np.arange(n, dtype=np.int32)
+        return dict(
+            parent=parent,
+            first_child=first_child,
+            next_sibling=next_sibling,
+            depth=np.array(depth, dtype=np.int32),
+            preorder=preorder,
+            pre=pre,
+            end=np.array(end, dtype=np.int32),
+            roots=top_level,
+        )
+
+    def save(self, directory):
+        """
+        Saves the index as one .npy file per array, which load memory-maps.
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(directory, name + '.npy'), getattr(self, name))
+        with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf8') as meta_file:
+            json.dump({'comments_path': os.path.abspath(self.comments_path), 'nodes': len(self)}, meta_file, indent=4)
+
+    @classmethod
+    def load(cls, directory, comments_path=None):
+        """
+        Opens a saved index. The arrays are memory-mapped, not read into memory.
+        :param comments_path: Path to the comments file, if it moved since the index was saved.
+        """
+        with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf8') as meta_file:
+            meta = json.load(meta_file)
+        arrays = {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r') for name in ARRAYS}
+        return cls(comments_path or meta['comments_path'], arrays)
+
+    def node(self, comment_id):
+        """
+        :param comment_id: A comment ID or fullname, e.g. 'lvfsfv6' or 't1_lvfsfv6'.
+        :return:
+        The node number of the comment.
+        """
+        value = np.uint64(reddit_id_to_int(comment_id))
+        position = np.searchsorted(self.sorted_ids, value)
+        if position == len(self.sorted_ids) or self.sorted_ids[position] != value:
+            raise KeyError(comment_id)
+        return int(self.sorted_nodes[position])
+
+    def subtree(self, node, max_depth=None):
+        """
+        :param node: Node number.
+        :param max_depth: Only include replies up to this many levels below node.
+        :return:
+        The node numbers of the subtree of node (node included) in preorder.
+        """
+        nodes = self.preorder[self.pre[node]:self.end[node]]
+        if max_depth is not None:
+            nodes = nodes[self.depth[nodes] <= self.depth[node] + max_depth]
+        return nodes
+
+    def thread(self, post_id):
+        """
+        :param post_id: A post ID or fullname, e.g. '1gjquvd' or 't3_1gjquvd'.
+        :return:
+        The node numbers of the comment trees of the post (trees whose top level comment has the post as
+        link_id) in preorder.
+        """
+        value = np.uint64(reddit_id_to_int(post_id))
+        root_posts = self.post[self.roots]
+        first, last = np.searchsorted(root_posts, value, side='left'), np.searchsorted(root_posts, value, side='right')
+        if first == last:
+            return self.preorder[:0]
+        return self.preorder[self.pre[self.roots[first]]:self.end[self.roots[last - 1]]]
+
+    def children(self, node):
+        """
+        :return:
+        The node numbers of the direct replies to node, in file order.
+        """
+        children = []
+        child = self.first_child[node]
+        while child >= 0:
+            children.append(int(child))
+            child = self.next_sibling[child]
+        return children
+
+    def reply_counts(self):
+        """
+        :return:
+        The number of direct and indirect replies of every node.
+        """
+        return self.end - self.pre - 1
+
+    def direct_reply_counts(self):
+        """
+        :return:
+        The number of direct replies of every node.
+        """
+        parent = np.asarray(self.parent)
+        return np.bincount(parent[parent >= 0], minlength=len(self))
+
+    def subtree_sums(self, values):
+        """
+        Aggregates a per node value (e.g. score or text length) over every subtree at once.
+        :param values: Array with one value per node.
+        :return:
+        An array with the sum of values over the subtree of every node.
+        """
+        in_preorder = np.concatenate(([0], np.cumsum(np.asarray(values)[self.preorder])))
+        return in_preorder[self.end] - in_preorder[self.pre]
+
+    def bodies(self, nodes):
+        """
+        Reads the bodies of the given comments from the comments file.
+        """
+        if self._source is None:
+            with open(self.comments_path, 'rb') as json_file:
+                self._source = mmap.mmap(json_file.fileno(), 0, access=mmap.ACCESS_READ)
+        source = self._source
+        return [BODY_DECODER.decode(source[offset:offset + length])['body']
+                for offset, length in zip(self.offset[nodes].tolist(), self.length[nodes].tolist())]
+
+    def subtree_text(self, node, max_depth=None, separator=' '):
+        """
+        :return:
+        The bodies of the subtree of node (see subtree) joined in preorder.
+        """
+        return separator.join(self.bodies(self.subtree(node, max_depth)))
+
+
+if __name__ == '__main__':
+    comments_path = 'C:/Users/marti/documents/Text-Analytics-in-the-Digital-Humanities/data/reddit/MensRights/r_MensRights_comments(beforeElection).jsonl'
+    index_path = 'C:/Users/marti/documents/Text-Analytics-in-the-Digital-Humanities/data/reddit/MensRights/r_MensRights_comments(beforeElection).tree'
+
+    tree = CommentTreeIndex.build(comments_path)
+    tree.save(index_path)
+
+    replies = tree.reply_counts()
+    busiest = int(np.argmax(replies))
+    print(f'Most discussed comment has {replies[busiest]} replies:')
+    print(tree.subtree_text(busiest, max_depth=1)[:500])
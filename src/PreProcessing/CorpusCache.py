@@ -0,0 +1,209 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from collections import namedtuple
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+CACHE_VERSION = 1  # Bump when the parsing or normalization code changes its output
+
+# digest addresses the entry, slot names the stage and its inputs independently of their versions
+CacheKey = namedtuple('CacheKey', ['digest', 'slot'])
+
+
+class CorpusCache:
+    def __init__(self, cache_dir, max_bytes=20 << 30, hash_content=False):
+        """
+        On-disk cache for parsed records and normalized texts.
+        Entries are content addressed: the key combines the stage name, the identity of every input file
+        (size and modification time, or the SHA-256 of the content with hash_content=True) and the
+        parameters of the stage, e.g. the normalization flags. When an input file changes its key changes
+        too, and the entry stored for the previous version of the same input is deleted.
+        :param cache_dir: Directory of the cache, created if needed.
+        :param max_bytes: The least recently used entries are evicted when the cache grows beyond this size.
+        :param hash_content: Identify input files by their content instead of size and modification time.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hash_content = hash_content
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self.lock_path = os.path.join(cache_dir, 'index.lock')
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @contextmanager
+    def _lock(self):
+        """
+        Exclusive lock of the cache directory across processes, e.g. the stages of a PipelineRunner.
+        """
+        with open(self.lock_path, 'a+b') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            else:
+                while True:
+                    try:
+                        msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:  # LK_LOCK gives up after 10 seconds
+                        continue
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def fingerprint(self, path):
+        """
+        :return:
+        A string identifying the current version of the file at path.
+        """
+        assert os.path.exists(path), f'Path to file is incorrect: {path}'
+        stat = os.stat(path)
+        if not self.hash_content:
+            return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def key(self, stage, input_paths, **params):
+        """
+        Computes the cache key of a stage.
+        :param stage: Name of the stage, e.g. 'normalized_text'.
+        :param input_paths: The files the stage reads.
+        :param params: JSON serializable parameters that change the output of the stage.
+        :return:
+        A CacheKey.
+        """
+        slot = json.dumps({
+            'version': CACHE_VERSION,
+            'stage': stage,
+            'inputs': [os.path.abspath(path) for path in input_paths],
+            'params': params,
+        }, sort_keys=True)
+        fingerprints = [self.fingerprint(path) for path in input_paths]
+        digest = hashlib.sha256((slot + json.dumps(fingerprints)).encode('utf8')).hexdigest()
+        return CacheKey(digest, slot)
+
+    def _entry_path(self, key, suffix):
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def get_file(self, key, suffix='.txt'):
+        """
+        :return:
+        The path of the cached file for key, or None if it is not cached.
+        Another process may still evict the entry before it is read, callers treat a FileNotFoundError
+        when reading it as a cache miss.
+        """
+        path = self._entry_path(key.digest, suffix)
+        try:
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put_file(self, key, src_path, suffix='.txt'):
+        """
+        Copies src_path into the cache under key.
+        :return:
+        The path of the cached file.
+        """
+        path = self._entry_path(key.digest, suffix)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(fd)
+        shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, path)  # Atomic, readers never see a partial entry
+
+        with self._lock():
+            self._replace_slot(key.slot, key.digest, suffix)
+            self._evict()
+        return path
+
+    def get_json(self, key):
+        """
+        :return:
+        The cached JSON object for key, or None if it is not cached.
+        """
+        path = self.get_file(key, suffix='.json')
+        if path is None:
+            return None
+        try:
+            with open(path, 'r', encoding='utf8') as json_file:
+                return json.load(json_file)
+        except FileNotFoundError:  # Evicted by another process in the meantime
+            return None
+
+    def put_json(self, key, obj):
+        """
+        Stores a JSON serializable object (e.g. a dictionary of parsed records) under key.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf8') as json_file:
+            json.dump(obj, json_file, ensure_ascii=False)
+        try:
+            return self.put_file(key, tmp_path, suffix='.json')
+        finally:
+            os.remove(tmp_path)
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path, 'r', encoding='utf8') as index_file:
+            return json.load(index_file)
+
+    def _replace_slot(self, slot, digest, suffix):
+        # Invalidate the entry of the previous input version of this slot, called with the lock held
+        index = self._load_index()
+        previous = index.get(slot)
+        if previous is not None and previous != [digest, suffix]:
+            try:
+                os.remove(self._entry_path(*previous))
+            except FileNotFoundError:
+                pass  # Already evicted
+        index[slot] = [digest, suffix]
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf8') as index_file:
+            json.dump(index, index_file)
+        os.replace(tmp_path, self.index_path)
+
+    def evict(self):
+        """
+        Deletes the least recently used entries until the cache is smaller than max_bytes.
+        """
+        with self._lock():
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if path in (self.index_path, self.lock_path) or name.endswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:  # Replaced in the meantime
+                continue
+            if os.path.isfile(path):
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
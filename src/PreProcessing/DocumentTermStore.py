@@ -0,0 +1,232 @@
+import os
+import re
+import json
+from itertools import islice
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer, ENGLISH_STOP_WORDS
+from tqdm import tqdm
+from src.PreProcessing.RecordDecoder import RecordDecoder
+from src.PreProcessing.DumpReader import iter_dump_lines
+
+REMOVED_TEXTS = frozenset(('[removed]', '[deleted]', ''))
+NON_WORD_PATTERN = re.compile(r'\W+')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+ARRAYS = ('data', 'indices', 'indptr')
+
+
+def clean_text(text):
+    """
+    The text cleaning of the topic modelling notebook: lowercase, non-word characters and repeated
+    whitespace replaced by a single space.
+    """
+    text = text.lower()
+    text = NON_WORD_PATTERN.sub(' ', text)
+    text = WHITESPACE_PATTERN.sub(' ', text)
+    return text.strip()
+
+
+def is_valid_text(text):
+    """
+    :return:
+    False for missing, empty, removed and deleted texts, which the notebooks filter out.
+    """
+    return isinstance(text, str) and text.lower() not in REMOVED_TEXTS
+
+
+def read_documents(file_path, period, text_fields=('selftext',)):
+    """
+    Yields the valid documents of a Reddit JSONL file as (id, period, subreddit, text).
+    :param text_fields: Record fields joined with a space to form the text, e.g. ('title', 'selftext').
+    """
+    assert os.path.exists(file_path), f'Path to file is incorrect: {file_path}'
+    decoder = RecordDecoder(('id', 'subreddit') + tuple(text_fields))
+    for line in iter_dump_lines(file_path, binary=True):
+        if not line.strip():
+            continue
+        obj = decoder.decode(line)
+        parts = [obj.get(field) for field in text_fields]
+        parts = [part for part in parts if is_valid_text(part)]
+        if parts:
+            yield obj.get('id'), period, obj.get('subreddit'), ' '.join(parts)
+
+
+class DocumentTermStore:
+    def __init__(self, counts, vocabulary, metadata, texts=None):
+        """
+        Sparse document-term count matrix of a corpus, with its vocabulary and document metadata.
+        The matrix keeps every token, stop words and df limits are applied when weighting, so one store
+        serves TF-IDF, clustering and sentiment inputs with different settings without re-tokenizing.
+        Use DocumentTermStore.build to create a store and load to open a saved one.
+        :param counts: scipy CSR matrix, one row per document, one column per vocabulary term.
+        :param vocabulary: List of the terms, sorted like the features of sklearn's vectorizers.
+        :param metadata: Dictionary with the lists 'id', 'period' and 'subreddit', one entry per document.
+        :param texts: Optional list of the cleaned document texts.
+        """
+        self.counts = counts
+        self.vocabulary = vocabulary
+        self.metadata = metadata
+        self.texts = texts
+
+    def __len__(self):
+        return self.counts.shape[0]
+
+    @classmethod
+    def build(cls, sources, text_fields=('selftext',), clean=clean_text, keep_texts=True, chunk_size=10000):
+        """
+        Tokenizes the documents once, in chunks, and builds the count matrix.
+        :param sources: List of (file_path, period) of Reddit JSONL files, e.g.
+        [(before_path, 'before'), (after_path, 'after')].
+        :param text_fields: Record fields that form the document text.
+        :param clean: Function applied to each text before tokenizing, None to keep the raw text.
+        :param keep_texts: Keep the cleaned texts, e.g. for the clustered CSV outputs.
+        :param chunk_size: The number of documents tokenized at once.
+        :return:
+        A DocumentTermStore.
+        """
+        # Same tokenization as TfidfVectorizer with its default settings, stop words are applied later
+        counter = CountVectorizer(lowercase=True)
+        term_index = {}
+        metadata = {'id': [], 'period': [], 'subreddit': []}
+        texts = [] if keep_texts else None
+        blocks = []
+
+        documents = (document for file_path, period in sources
+                     for document in read_documents(file_path, period, text_fields))
+        progress = tqdm(desc="Building document-term matrix", unit="doc")
+        while True:
+            chunk = list(islice(documents, chunk_size))
+            if not chunk:
+                break
+            chunk_texts = [clean(text) if clean else text for _, _, _, text in chunk]
+            for doc_id, period, subreddit, _ in chunk:
+                metadata['id'].append(doc_id)
+                metadata['period'].append(period)
+                metadata['subreddit'].append(subreddit)
+            if keep_texts:
+                texts.extend(chunk_texts)
+
+            try:
+                block = counter.fit_transform(chunk_texts).tocsr()
+                chunk_terms = counter.get_feature_names_out()
+            except ValueError:  # No tokens in this chunk
+                block, chunk_terms = sp.csr_matrix((len(chunk), 0), dtype=np.int64), []
+            # Map the chunk's columns to global term numbers, in order of first appearance
+            columns = np.array([term_index.setdefault(term, len(term_index)) for term in chunk_terms], dtype=np.int64)
+            blocks.append((block, columns))
+            progress.update(len(chunk))
+        progress.close()
+
+        # Renumber the columns so that the vocabulary is sorted
+        vocabulary = sorted(term_index)
+        rank = np.empty(len(vocabulary), dtype=np.int64)
+        rank[[term_index[term] for term in vocabulary]] = np.arange(len(vocabulary))
+        rows = []
+        for block, columns in blocks:
+            block = sp.csr_matrix((block.data.astype(np.int32), rank[columns[block.indices]].astype(np.int32), block.indptr),
+                                  shape=(block.shape[0], len(vocabulary)))
+            block.sort_indices()
+            rows.append(block)
+        counts = sp.vstack(rows, format='csr') if rows else sp.csr_matrix((0, 0), dtype=np.int32)
+        return cls(counts, vocabulary, metadata, texts)
+
+    def save(self, directory):
+        """
+        Saves the CSR arrays as .npy files, which load memory-maps, and the vocabulary, metadata and texts as JSON.
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(directory, name + '.npy'), getattr(self.counts, name))
+        with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf8') as meta_file:
+            json.dump({'shape': list(self.counts.shape), 'vocabulary': self.vocabulary, 'metadata': self.metadata},
+                      meta_file, ensure_ascii=False)
+        if self.texts is not None:
+            with open(os.path.join(directory, 'texts.jsonl'), 'w', encoding='utf8') as texts_file:
+                for text in self.texts:
+                    texts_file.write(json.dumps(text, ensure_ascii=False) + '\n')
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Opens a saved store. The matrix arrays are memory-mapped, not read into memory.
+        """
+        with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf8') as meta_file:
+            meta = json.load(meta_file)
+        data, indices, indptr = (np.load(os.path.join(directory, name + '.npy'), mmap_mode='r') for name in ARRAYS)
+        counts = sp.csr_matrix((data, indices, indptr), shape=tuple(meta['shape']), copy=False)
+
+        texts = None
+        texts_path = os.path.join(directory, 'texts.jsonl')
+        if os.path.exists(texts_path):
+            with open(texts_path, 'r', encoding='utf8') as texts_file:
+                texts = [json.loads(line) for line in texts_file]
+        return cls(counts, meta['vocabulary'], meta['metadata'], texts)
+
+    def rows(self, period=None, subreddit=None):
+        """
+        :return:
+        The row numbers of the documents of the given period and/or subreddit, all rows if both are None.
+        """
+        selected = np.ones(len(self), dtype=bool)
+        if period is not None:
+            selected &= np.array(self.metadata['period'], dtype=object) == period
+        if subreddit is not None:
+            selected &= np.array(self.metadata['subreddit'], dtype=object) == subreddit
+        return np.flatnonzero(selected)
+
+    def subset(self, rows):
+        """
+        :return:
+        A DocumentTermStore with only the given rows, in the given order, sharing the vocabulary.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        metadata = {name: [values[row] for row in rows] for name, values in self.metadata.items()}
+        texts = [self.texts[row] for row in rows] if self.texts is not None else None
+        return DocumentTermStore(self.counts[rows], self.vocabulary, metadata, texts)
+
+    def terms(self, rows=None, min_df=1, max_df=1.0, stop_words=None):
+        """
+        Selects vocabulary columns like the fitting of sklearn's vectorizers on the given rows.
+        :param stop_words: 'english' for sklearn's list, or any list of stop words.
+        :return:
+        The sorted column numbers of the selected terms.
+        """
+        counts = self.counts if rows is None else self.counts[rows]
+        n_docs = counts.shape[0]
+        df = np.bincount(counts.indices, minlength=counts.shape[1])
+        min_count = min_df if isinstance(min_df, int) else min_df * n_docs
+        max_count = max_df if isinstance(max_df, int) else max_df * n_docs
+        selected = (df >= min_count) & (df <= max_count) & (df > 0)
+
+        if stop_words is not None:
+            stop_words = ENGLISH_STOP_WORDS if stop_words == 'english' else frozenset(stop_words)
+            selected &= np.array([term not in stop_words for term in self.vocabulary], dtype=bool)
+        return np.flatnonzero(selected)
+
+    def tfidf(self, rows=None, min_df=1, max_df=1.0, stop_words=None, norm='l2', sublinear_tf=False):
+        """
+        TF-IDF weighting of the stored counts, the same matrix TfidfVectorizer(min_df=min_df, max_df=max_df,
+        stop_words=stop_words).fit_transform returns for the stored texts of the given rows.
+        :param rows: Row numbers, e.g. from rows(period='before'), None for all documents.
+        :return:
+        (tfidf_matrix, feature_names)
+        """
+        columns = self.terms(rows, min_df, max_df, stop_words)
+        counts = self.counts if rows is None else self.counts[rows]
+        counts = counts[:, columns].astype(np.float64)
+        transformer = TfidfTransformer(norm=norm, sublinear_tf=sublinear_tf)
+        return transformer.fit_transform(counts), np.array(self.vocabulary, dtype=object)[columns]
+
+
+if __name__ == "__main__":
+    # Example usage
+    directory = 'C:/Users/marti/documents/Text-Analytics-in-the-Digital-Humanities/data/reddit/Feminism/'
+    store = DocumentTermStore.build([(directory + 'r_Feminism_posts(beforeElection).jsonl', 'before'),
+                                     (directory + 'r_Feminism_posts(afterElection).jsonl', 'after')])
+    store.save(directory + 'document_term_store')
+
+    store = DocumentTermStore.load(directory + 'document_term_store')
+    X, terms = store.tfidf(min_df=5, max_df=0.9, stop_words='english')
+    print(f"Shape of TF-IDF matrix: {X.shape}")
+    X_before, _ = store.tfidf(rows=store.rows(period='before'), min_df=5, max_df=0.9, stop_words='english')
+    print(f"Shape of TF-IDF matrix before the election: {X_before.shape}")
@@ -0,0 +1,186 @@
+import os
+import json
+from datetime import datetime
+import numpy as np
+from tqdm import tqdm
+from src.PreProcessing.RecordDecoder import RecordDecoder
+from src.PreProcessing.CommentTreeIndex import reddit_id_to_int
+from src.PreProcessing.DumpReader import is_compressed
+
+COMMENT_INDEX_DECODER = RecordDecoder(('created_utc', 'subreddit', 'link_id'))
+POST_INDEX_DECODER = RecordDecoder(('created_utc', 'subreddit', 'name'))
+
+# One entry per line of the dump, sorted by created_utc (and by offset within the same second)
+INDEX_DTYPE = np.dtype([
+    ('created_utc', '<i8'),
+    ('subreddit', '<u4'),    # Position in the subreddit list of the meta file
+    ('link', '<u8'),         # link_id of a comment, or the post's own ID, as base 36 integer
+    ('offset', '<u8'),       # Byte offset of the line in the dump
+    ('length', '<u4'),       # Byte length of the line, including the newline
+])
+
+
+def to_timestamp(value):
+    """
+    :param value: A UTC timestamp, a datetime (naive datetimes are taken as UTC) or None.
+    :return:
+    The timestamp as int, None stays None.
+    """
+    if value is None or isinstance(value, (int, np.integer)):
+        return value
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            return int((value - datetime(1970, 1, 1)).total_seconds())
+        return int(value.timestamp())
+    return int(float(value))
+
+
+class DumpIndex:
+    def __init__(self, dump_path, entries, subreddits):
+        """
+        Sorted index of a Reddit JSONL dump by creation time, with the subreddit, the thread (link_id) and the
+        byte offset and length of every line, so that time windows and subreddits are read from the dump
+        with a binary search and direct seeks instead of parsing the whole file.
+        Use DumpIndex.build to create an index, load to open a saved one, or for_file for either.
+        :param dump_path: Path to the JSONL dump.
+        :param entries: Structured array of INDEX_DTYPE.
+        :param subreddits: List of the subreddit names, entries refer to them by position.
+        """
+        self.dump_path = dump_path
+        self.entries = entries
+        self.subreddits = subreddits
+        self.subreddit_ids = {name.lower(): i for i, name in enumerate(subreddits)}
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def default_path(dump_path):
+        return dump_path + '.idx'
+
+    @classmethod
+    def build(cls, dump_path):
+        """
+        Builds the index in one streaming pass over the dump.
+        :return:
+        A DumpIndex.
+        """
+        assert os.path.exists(dump_path), f'Path to file is incorrect: {dump_path}'
+        assert not is_compressed(dump_path), f'Compressed dumps can not be seeked, decompress them to index: {dump_path}'
+        entries = []
+        subreddit_ids = {}
+        offset = 0
+        with open(dump_path, 'rb') as dump_file:
+            for line in tqdm(dump_file, desc="Indexing records", unit="record"):
+                if line.strip():
+                    try:
+                        obj = COMMENT_INDEX_DECODER.decode(line)
+                        link = obj['link_id']
+                    except KeyError:
+                        obj = POST_INDEX_DECODER.decode(line)
+                        link = obj['name']
+                    subreddit = subreddit_ids.setdefault(obj['subreddit'], len(subreddit_ids))
+                    entries.append((to_timestamp(obj['created_utc']), subreddit, reddit_id_to_int(link), offset, len(line)))
+                offset += len(line)
+
+        entries = np.array(entries, dtype=INDEX_DTYPE)
+        entries = entries[np.lexsort((entries['offset'], entries['created_utc']))]
+        return cls(dump_path, entries, list(subreddit_ids))
+
+    def save(self, index_path=None):
+        """
+        Saves the entries as .npy file, which load memory-maps, and the subreddits and dump state as JSON.
+        """
+        index_path = index_path or self.default_path(self.dump_path)
+        np.save(index_path + '.npy', self.entries)
+        stat = os.stat(self.dump_path)
+        with open(index_path + '.json', 'w', encoding='utf8') as meta_file:
+            json.dump({'dump_path': os.path.abspath(self.dump_path), 'size': stat.st_size,
+                       'mtime_ns': stat.st_mtime_ns, 'subreddits': self.subreddits}, meta_file, indent=4)
+
+    @classmethod
+    def load(cls, index_path, dump_path=None):
+        with open(index_path + '.json', 'r', encoding='utf8') as meta_file:
+            meta = json.load(meta_file)
+        entries = np.load(index_path + '.npy', mmap_mode='r')
+        return cls(dump_path or meta['dump_path'], entries, meta['subreddits'])
+
+    @classmethod
+    def for_file(cls, dump_path, index_path=None):
+        """
+        Opens the saved index of the dump, building and saving it first if it is missing or older than the dump.
+        """
+        index_path = index_path or cls.default_path(dump_path)
+        if os.path.exists(index_path + '.json') and os.path.exists(index_path + '.npy'):
+            with open(index_path + '.json', 'r', encoding='utf8') as meta_file:
+                meta = json.load(meta_file)
+            stat = os.stat(dump_path)
+            if meta['size'] == stat.st_size and meta['mtime_ns'] == stat.st_mtime_ns:
+                return cls.load(index_path, dump_path)
+        index = cls.build(dump_path)
+        index.save(index_path)
+        return index
+
+    def window(self, start=None, end=None, subreddit=None, links=None):
+        """
+        :param start: First second of the window (timestamp or datetime), None for the beginning of the dump.
+        :param end: End of the window, exclusive, None for the end of the dump.
+        :param subreddit: Only entries of this subreddit (case insensitive), None for all.
+        :param links: Only entries of these threads, as array of base 36 integers (e.g. the 'link' column
+        of a window of the posts index), None for all.
+        :return:
+        The matching entries, sorted by created_utc.
+        """
+        created = self.entries['created_utc']
+        lower = 0 if start is None else int(np.searchsorted(created, to_timestamp(start), side='left'))
+        upper = len(created) if end is None else int(np.searchsorted(created, to_timestamp(end), side='left'))
+        entries = self.entries[lower:upper]
+        if subreddit is not None:
+            subreddit_id = self.subreddit_ids.get(subreddit.lower())
+            if subreddit_id is None:
+                return entries[:0]
+            entries = entries[entries['subreddit'] == subreddit_id]
+        if links is not None:
+            entries = entries[np.isin(entries['link'], links)]
+        return entries
+
+    def count(self, start=None, end=None, subreddit=None):
+        return len(self.window(start, end, subreddit))
+
+    def iter_lines(self, start=None, end=None, subreddit=None, links=None, file_order=True):
+        """
+        Reads the lines of the matching records (see window) straight from their offsets.
+        :param file_order: Yield the lines in the order of the dump, like reading the whole file would,
+        instead of by creation time.
+        :return:
+        A generator of the raw JSON lines as str.
+        """
+        entries = self.window(start, end, subreddit, links)
+        if file_order:
+            entries = entries[np.argsort(entries['offset'], kind='stable')]
+        with open(self.dump_path, 'rb') as dump_file:
+            for offset, length in zip(entries['offset'].tolist(), entries['length'].tolist()):
+                dump_file.seek(offset)
+                yield dump_file.read(length).decode('utf8')
+
+    def windows(self, step, start=None, end=None, subreddit=None):
+        """
+        Splits a time range into consecutive windows, e.g. step=7 * 24 * 3600 for weeks.
+        :return:
+        List of (window start, window end, number of records).
+        """
+        created = self.entries['created_utc']
+        if not len(created):
+            return []
+        start = to_timestamp(start) if start is not None else int(created[0])
+        end = to_timestamp(end) if end is not None else int(created[-1]) + 1
+        return [(lower, min(lower + step, end), self.count(lower, min(lower + step, end), subreddit))
+                for lower in range(start, end, step)]
+
+
+if __name__ == "__main__":
+    # Example usage
+    path = 'C:/Users/marti/documents/Text-Analytics-in-the-Digital-Humanities/data/reddit/MensRights/r_MensRights_comments(afterElection).jsonl'
+    index = DumpIndex.for_file(path)
+    for window_start, window_end, count in index.windows(7 * 24 * 3600):
+        print(f"{datetime.utcfromtimestamp(window_start):%Y-%m-%d}: {count} comments")
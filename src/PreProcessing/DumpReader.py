@@ -0,0 +1,165 @@
+import io
+import os
+import gzip
+import queue
+import threading
+
+try:
+    import zstandard  # Only needed for .zst dumps
+except ImportError:
+    zstandard = None
+
+COMPRESSED_SUFFIXES = ('.zst', '.gz')
+ZSTD_MAX_WINDOW = 1 << 31  # Pushshift and Arctic Shift dumps are compressed with long distance matching (--long=31)
+
+
+def is_compressed(path):
+    """
+    :return:
+    True if the file is decompressed on reading, which is decided by its extension ('.zst' or '.gz').
+    """
+    return path.endswith(COMPRESSED_SUFFIXES)
+
+
+def iter_zstd_blocks(zstd_file, read_size):
+    """
+    Decompresses a zstd stream of one or more frames.
+    :param zstd_file: Binary file object of the compressed data.
+    :param read_size: Number of compressed bytes decompressed at once.
+    :return:
+    A generator of the decompressed data as bytes. Raises an EOFError if the last frame is incomplete,
+    which zstandard's stream_reader would silently accept.
+    """
+    assert zstandard is not None, 'zstandard is not installed, it is needed to read .zst files'
+    decompressor = zstandard.ZstdDecompressor(max_window_size=ZSTD_MAX_WINDOW)
+    frame = decompressor.decompressobj()
+    in_frame = False
+    for chunk in iter(lambda: zstd_file.read(read_size), b''):
+        while chunk:
+            in_frame = True
+            data = frame.decompress(chunk)
+            if data:
+                yield data
+            if not frame.eof:
+                break
+            # The chunk may hold the start of the next frame
+            chunk = frame.unused_data
+            frame = decompressor.decompressobj()
+            in_frame = False
+    if in_frame:
+        raise EOFError('Compressed file ended before the end of a zstd frame')
+
+
+class DumpReader:
+    def __init__(self, path, block_size=16 << 20, prefetch=4):
+        """
+        Reads a plain, gzip or zstd compressed JSONL dump line by line without decompressing it to disk.
+        A background thread reads and decompresses blocks of about block_size bytes, up to prefetch blocks ahead of
+        the caller. Both decompressors release the GIL, so decompression overlaps with the JSON decoding of
+        the lines instead of adding to it.
+        :param path: Path to the dump, the compression is chosen by the extension ('.zst', '.gz' or none).
+        :param block_size: Approximate number of decompressed bytes handed over at once, also the size of
+        the read buffer. zstd frames with windows of up to 2 GiB (long distance matching) are supported.
+        :param prefetch: Number of blocks buffered between the thread and the caller.
+        """
+        assert os.path.exists(path), f'Path to file is incorrect: {path}'
+        self.path = path
+        self.block_size = block_size
+        self.prefetch = prefetch
+
+    def __iter__(self):
+        return self.iter_lines()
+
+    @staticmethod
+    def _put(blocks, item, stop):
+        # Gives up when the caller stopped reading, so the thread never blocks on a full queue forever
+        while not stop.is_set():
+            try:
+                blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _decompressed_blocks(self):
+        if self.path.endswith('.zst'):
+            # Compressed input is fed in smaller pieces, so that one piece inflates to about a block
+            with open(self.path, 'rb', buffering=self.block_size) as zstd_file:
+                yield from iter_zstd_blocks(zstd_file, max(self.block_size >> 3, 1 << 16))
+            return
+        with gzip.GzipFile(filename=self.path, mode='rb') if self.path.endswith('.gz') \
+                else open(self.path, 'rb', buffering=self.block_size) as dump_file:
+            yield from iter(lambda: dump_file.read(self.block_size), b'')
+
+    def _produce(self, blocks, stop):
+        try:
+            for block in self._decompressed_blocks():
+                if stop.is_set():
+                    return
+                self._put(blocks, block, stop)
+        except Exception as error:  # Raised again in the reading thread
+            self._put(blocks, error, stop)
+            return
+        self._put(blocks, None, stop)
+
+    def blocks(self):
+        """
+        :return:
+        A generator of the decompressed blocks as bytes, in file order.
+        """
+        blocks = queue.Queue(self.prefetch)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._produce, args=(blocks, stop), daemon=True,
+                                  name=f'DumpReader({os.path.basename(self.path)})')
+        thread.start()
+        try:
+            while True:
+                block = blocks.get()
+                if block is None:
+                    return
+                if isinstance(block, Exception):
+                    raise block
+                yield block
+        finally:
+            stop.set()
+            thread.join()
+
+    def iter_lines(self, binary=False):
+        """
+        :param binary: Yield bytes instead of UTF-8 decoded str.
+        :return:
+        A generator of the lines including their newline, like iterating over the decompressed file.
+        """
+        rest = b''
+        for block in self.blocks():
+            end = block.rfind(b'\n') + 1
+            if not end:
+                rest += block
+                continue
+            data = rest + block[:end]
+            rest = block[end:]
+            # Lines are split on '\n' only, other line breaks can occur inside JSON strings
+            lines = io.BytesIO(data)
+            yield from lines if binary else io.TextIOWrapper(lines, encoding='utf8', newline='\n')
+        if rest:
+            yield rest if binary else rest.decode('utf8')
+
+
+def iter_dump_lines(path, binary=False):
+    """
+    Iterates over the lines of a dump: plain files are read directly, compressed ones through a DumpReader.
+    :param binary: Yield bytes instead of str.
+    :return:
+    A generator of the lines including their newline.
+    """
+    assert os.path.exists(path), f'Path to file is incorrect: {path}'
+    if is_compressed(path):
+        yield from DumpReader(path).iter_lines(binary)
+        return
+    with open(path, 'rb') if binary else open(path, 'r', encoding="utf8") as json_file:
+        yield from json_file
+
+
+if __name__ == "__main__":
+    # Example usage
+    path = 'C:/Users/marti/documents/Text-Analytics-in-the-Digital-Humanities/data/reddit/MensRights/RC_2024-11.zst'
+    print(sum(1 for _ in DumpReader(path)), "lines")
@@ -1,19 +1,70 @@
 import os
-import json
+from contextlib import nullcontext
+from functools import partial
 from tqdm import tqdm
-
+import src.Instrumentation as Instrumentation
+from src.PreProcessing.ParallelJsonReader import ParallelJsonReader
+from src.PreProcessing.RecordDecoder import parse_comment_line, parse_post_line
+from src.PreProcessing.DumpIndex import DumpIndex
+from src.PreProcessing.TokenCorpus import TokenCorpusWriter
+from src.PreProcessing.DumpReader import iter_dump_lines
 
 class JsonPreprocessor:
-    def __init__(self, file_path, time):
+    def __init__(self, file_path, time, workers=1, time_range=None, subreddit=None):
+        """
+        :param file_path: Path to the JSONL file, '.zst' and '.gz' files are decompressed while reading.
+        :param time: Time token appended to every record.
+        :param workers: Number of processes used to decode the file. With more than one worker the
+        file is read in newline aligned shards by a ParallelJsonReader and open_json_file is not needed.
+        None uses all CPUs.
+        :param time_range: Optional (start, end) of created_utc, as timestamps or datetimes, end exclusive and
+        either may be None. Only the records in the range are read, located through the DumpIndex of the file
+        (built and saved next to it on first use) instead of parsing the whole file.
+        :param subreddit: Optional subreddit name, only its records are read, also through the DumpIndex.
+        """
         self.file_path = file_path
         self.time = time
+        self.workers = workers
+        self.time_range = time_range
+        self.subreddit = subreddit
         self.json_list = None
         self.file_data = {}
 
+    def _selective(self):
+        return self.time_range is not None or self.subreddit is not None
+
+    def _parallel(self):
+        # Selected records are read by offset from the index, which is cheaper than decoding every shard
+        return (self.workers is None or self.workers > 1) and not self._selective()
+
+    def _selected_lines(self):
+        start, end = self.time_range or (None, None)
+        return DumpIndex.for_file(self.file_path).iter_lines(start, end, self.subreddit)
+
+    def _parse_records(self, json_lines, line_func, desc, unit):
+        if self._parallel():
+            reader = ParallelJsonReader(self.file_path, self.workers)
+            return reader.map_lines(partial(line_func, time=self.time), desc=desc)
+        return (line_func(json_str, self.time) for json_str in tqdm(json_lines, desc=desc, unit=unit))
+
     def open_json_file(self):
         assert os.path.exists(self.file_path), f'Path to file is incorrect: {self.file_path}'
-        with open(self.file_path, 'r', encoding="utf8") as json_file:
-            self.json_list = list(json_file)
+        if self._selective():
+            self.json_list = list(self._selected_lines())
+            return
+        self.json_list = list(iter_dump_lines(self.file_path))
+
+    def iter_json_lines(self):
+        """
+        Lazily yields the lines of the json file without loading the whole file into memory.
+        :return:
+        A generator over the raw json lines, only those in time_range and of subreddit if they are set.
+        """
+        assert os.path.exists(self.file_path), f'Path to file is incorrect: {self.file_path}'
+        if self._selective():
+            yield from self._selected_lines()
+            return
+        yield from iter_dump_lines(self.file_path)
 
     def parse_reddit_comments(self):
         """
@@ -22,9 +73,10 @@ class JsonPreprocessor:
         :return:
         A dictionary with comment IDs as keys and lists of comment bodies as values.
         """
-        for json_str in tqdm(self.json_list, desc="Parsing comments", unit="comment"):
-            obj = json.loads(json_str)
-            self.file_data[obj['id']] = obj['body'] + " " + self.time
+        with Instrumentation.stage('JsonPreprocessor.parse_reddit_comments') as stage:
+            for comment_id, text in self._parse_records(self.json_list, parse_comment_line, "Parsing comments", "comment"):
+                self.file_data[comment_id] = text
+            stage.add(items=len(self.file_data))
         return self.file_data
 
     def parse_reddit_posts(self):
@@ -34,19 +86,98 @@ class JsonPreprocessor:
         :return:
         A dictionary with post IDs as keys and lists of post bodies as values.
         """
-        for json_str in tqdm(self.json_list, desc="Parsing posts", unit="post"):
-            obj = json.loads(json_str)
-            self.file_data[obj['id']] = obj['title'] + " " + obj['selftext'] + " " + self.time
+        with Instrumentation.stage('JsonPreprocessor.parse_reddit_posts') as stage:
+            for post_id, text in self._parse_records(self.json_list, parse_post_line, "Parsing posts", "post"):
+                self.file_data[post_id] = text
+            stage.add(items=len(self.file_data))
 
         return self.file_data
 
+    def iter_reddit_comments(self):
+        """
+        Streaming counterpart of parse_reddit_comments. Records are read one line at a time and
+        nothing is kept in self.file_data.
+        :return:
+        A generator of (comment ID, comment body) tuples in file order.
+        """
+        yield from self._parse_records(self.iter_json_lines(), parse_comment_line, "Parsing comments", "comment")
+
+    def iter_reddit_posts(self):
+        """
+        Streaming counterpart of parse_reddit_posts. Records are read one line at a time and
+        nothing is kept in self.file_data.
+        :return:
+        A generator of (post ID, post body) tuples in file order.
+        """
+        yield from self._parse_records(self.iter_json_lines(), parse_post_line, "Parsing posts", "post")
+
+    def write_plain_text(self, output_path, posts, normalize=None, batch_chars=1 << 20, corpus_path=None):
+        """
+        Streams the records of the json file into a plain text file so that peak memory does not
+        depend on the size of the input file. Records are joined with spaces into batches of about
+        batch_chars characters, and every batch is normalized and written before the next is read.
+        Records whose ID was already read are skipped, like in the dictionary of parse_reddit_comments/posts.
+        Unlike there, the first of the duplicate records is kept, since it is already written when a later one
+        is read. Only the IDs are kept in memory.
+        :param output_path: Path to the TXT file to write.
+        :param posts: True if the file contains posts, False if it contains comments.
+        :param normalize: Optional callable applied to the text of every batch before it is written,
+        e.g. lambda text: NaturalLanguageProcessor(text).text. Whitespace separated normalizations
+        give the same output as normalizing return_plain_text(...) in one go.
+        :param batch_chars: Approximate number of characters normalized at once.
+        :param corpus_path: Optional path of a token corpus ('.tok') to write as well, with one document per
+        record (see TokenCorpusWriter). Records are then normalized one at a time, the text file is the same.
+        :return:
+        The number of distinct records read from the json file.
+        """
+        records = self.iter_reddit_posts() if posts else self.iter_reddit_comments()
+        seen = set()
+        count = 0
+        separator = ''
+        batch = []
+        batch_size = 0
+        with Instrumentation.stage('JsonPreprocessor.write_plain_text') as stage:
+            # The corpus writer removes its temporary ID stream if reading or normalizing fails
+            with open(output_path, 'w', encoding='utf-8') as txt_file, \
+                    TokenCorpusWriter(corpus_path) if corpus_path is not None else nullcontext() as corpus:
+                def flush():
+                    nonlocal separator
+                    if corpus is not None:
+                        texts = [normalize(text) for text in batch] if normalize is not None else batch
+                        for text in texts:
+                            corpus.add(text)
+                        text = ' '.join(text for text in texts if text) if normalize is not None else ' '.join(texts)
+                    else:
+                        text = ' '.join(batch)
+                        if normalize is not None:
+                            text = normalize(text)
+                    if text:
+                        txt_file.write(separator)
+                        txt_file.write(text)
+                        separator = ' '
+                    batch.clear()
+
+                for record_id, text in records:
+                    if record_id in seen:
+                        continue
+                    seen.add(record_id)
+                    count += 1
+                    batch.append(text)
+                    batch_size += len(text) + 1
+                    if batch_size >= batch_chars:
+                        flush()
+                        batch_size = 0
+                if batch:
+                    flush()
+                stage.add(items=count, bytes_read=Instrumentation.file_size(self.file_path), bytes_written=txt_file.tell())
+            if corpus_path is not None:
+                stage.add(bytes_written=Instrumentation.file_size(corpus_path))
+        return count
+
     @staticmethod
     def return_plain_text(dictionary):
-        txt = ''
-        for value in tqdm(dictionary.values(), desc="Converting to plain text", unit="value"):
-            txt += value + ' '
-
-        return txt
+        values = tqdm(dictionary.values(), desc="Converting to plain text", unit="value")
+        return ''.join(value + ' ' for value in values)
 
 
 if __name__ == "__main__":
@@ -55,4 +186,3 @@ if __name__ == "__main__":
     preprocessor = JsonPreprocessor(file_path, time='afterElection')
     preprocessor.open_json_file()
     comments = preprocessor.parse_reddit_comments()
-
@@ -1,6 +1,35 @@
+import os
+from functools import lru_cache
+from multiprocessing import Pool
 import regex as re
 from stop_words import get_stop_words
 from tqdm import tqdm
+from src.PreProcessing.TokenCorpus import TokenCorpusWriter
+
+STOPWORDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stopwords.txt')
+
+LINK_PATTERN = re.compile(r'http\S+')
+PUNCTUATION_PATTERN = re.compile(r'[^\w\s]')
+EMOJI_CHARACTERS = ("["
+                    u"\U0001F600-\U0001F64F"  # emoticons
+                    u"\U0001F300-\U0001F5FF"  # symbols & pictographs
+                    u"\U0001F680-\U0001F6FF"  # transport & map symbols
+                    u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
+                    u"\U00002500-\U00002BEF"  # chinese char
+                    u"\U00002702-\U000027B0"
+                    u"\U000024C2-\U0001F251"
+                    u"\U0001f926-\U0001f937"
+                    u"\U00010000-\U0010ffff"
+                    u"\u2640-\u2642"
+                    u"\u2600-\u2B55"
+                    u"\u200d"
+                    u"\u23cf"
+                    u"\u23e9"
+                    u"\u231a"
+                    u"\ufe0f"  # dingbats
+                    u"\u3030"
+                    "]")
+EMOJI_PATTERN = re.compile(EMOJI_CHARACTERS + "+", re.UNICODE)
 
 
 def create_stop_words_file():
@@ -10,70 +39,156 @@ def create_stop_words_file():
             file.write(word + '\n')
 
 
+@lru_cache(maxsize=None)
+def load_stopwords(path=STOPWORDS_PATH):
+    """
+    Loads the stopwords file once per process.
+    :param path: Path to a file with one stopword per line.
+    :return:
+    A frozenset of stopwords.
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        return frozenset(word.strip() for word in file)
+
+
+class NormalizationPipeline:
+    def __init__(self, lower=True, remove_links=True, remove_stopwords=True, remove_reddit_formatting=True, remove_stars=True, remove_punctuations=True, remove_emojis=True):
+        """
+        Compiled version of the NaturalLanguageProcessor steps for one combination of flags.
+        The character deleting steps (reddit formatting, stars, punctuation and emojis) only look at
+        single characters, so they are merged into one regular expression and run in a single pass.
+        Stopwords are filtered in the only tokenize-and-filter pass, against a hashed set.
+        The output is identical to running the steps one after the other.
+        """
+        self.lower = lower
+        self.remove_links = remove_links
+        self.stop_words = load_stopwords() if remove_stopwords else None
+        self.collapse_whitespace = remove_emojis
+
+        deleted = []
+        if remove_reddit_formatting or remove_stars:
+            deleted.append(r'\*')
+        if remove_punctuations:
+            deleted.append(r'[^\w\s]')
+        if remove_emojis:
+            deleted.append(EMOJI_CHARACTERS)
+        self.deletion_pattern = re.compile('(?:' + '|'.join(deleted) + ')+', re.UNICODE) if deleted else None
+
+    def __call__(self, text):
+        if self.lower:
+            text = text.lower()
+        if self.remove_links:
+            text = LINK_PATTERN.sub('', text)
+        if self.stop_words is not None:
+            stop_words = self.stop_words
+            text = ' '.join([word for word in text.split() if word not in stop_words])
+        if self.deletion_pattern is not None:
+            text = self.deletion_pattern.sub('', text)
+        if self.collapse_whitespace:
+            text = ' '.join(text.split())
+        return text
+
+
+@lru_cache(maxsize=None)
+def get_pipeline(*flags):
+    """
+    Returns the compiled NormalizationPipeline for a combination of flags, building it only once.
+    """
+    return NormalizationPipeline(*flags)
+
+
 class NaturalLanguageProcessor:
     def __init__(self, text, lower=True, remove_links=True, remove_stopwords=True, remove_reddit_formatting=True, remove_stars=True, remove_punctuations=True, remove_emojis=True):
-        self.text = text
         self.methods_bool = [lower, remove_links, remove_stopwords, remove_reddit_formatting, remove_stars, remove_punctuations, remove_emojis]
         self.methods = [self.lower, self.remove_links, self.remove_stopwords, self.remove_reddit_formatting, self.remove_stars, self.remove_punctuations, self.remove_emojis]
 
-        for i in range(len(self.methods)):
-            if self.methods_bool[i]:
-                self.methods[i]()
+        # All enabled methods are applied in one fused pass, see NormalizationPipeline
+        self.text = get_pipeline(*self.methods_bool)(text)
 
     def save_txt(self, file_path):
         with open(file_path, 'w', encoding='utf-8') as file:
             file.write(self.text)
 
+    def save_tokens(self, file_path):
+        """
+        Saves the text as a token corpus with a single document, see TokenCorpusWriter.
+        """
+        with TokenCorpusWriter(file_path) as writer:
+            writer.add(self.text)
+
     def lower(self):
         self.text = self.text.lower()
 
     def remove_links(self):
-        self.text = re.sub(r'http\S+', '', self.text)
+        self.text = LINK_PATTERN.sub('', self.text)
 
     def remove_stopwords(self):
-        stop_words = []
-        # PreProcessing/stopwords.txt
-        with open('PreProcessing/stopwords.txt', 'r', encoding='utf-8') as file:
-            for word in file.readlines():
-                stop_words.append(word.strip())
-
+        stop_words = load_stopwords()
         words = self.text.split()
         filtered_words = [word for word in words if word not in stop_words]
         self.text = ' '.join(filtered_words)
 
     def remove_reddit_formatting(self):
-        self.text = re.sub(r'\*', '', self.text)  # bold text
+        self.text = self.text.replace('*', '')  # bold text
 
     def remove_stars(self):  # often stars are used for bold formatting
         self.text = self.text.replace('*', '')
 
     def remove_punctuations(self):
-        self.text = re.sub(r'[^\w\s]', '', self.text)
+        self.text = PUNCTUATION_PATTERN.sub('', self.text)
 
     def remove_emojis(self):
-        emoj = re.compile("["
-                          u"\U0001F600-\U0001F64F"  # emoticons
-                          u"\U0001F300-\U0001F5FF"  # symbols & pictographs
-                          u"\U0001F680-\U0001F6FF"  # transport & map symbols
-                          u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
-                          u"\U00002500-\U00002BEF"  # chinese char
-                          u"\U00002702-\U000027B0"
-                          u"\U000024C2-\U0001F251"
-                          u"\U0001f926-\U0001f937"
-                          u"\U00010000-\U0010ffff"
-                          u"\u2640-\u2642"
-                          u"\u2600-\u2B55"
-                          u"\u200d"
-                          u"\u23cf"
-                          u"\u23e9"
-                          u"\u231a"
-                          u"\ufe0f"  # dingbats
-                          u"\u3030"
-                          "]+", re.UNICODE)
-        self.text = re.sub(emoj, '', str(self.text))
+        self.text = EMOJI_PATTERN.sub('', str(self.text))
         self.text = ' '.join(self.text.split())
 
 
+FLAG_NAMES = ('lower', 'remove_links', 'remove_stopwords', 'remove_reddit_formatting', 'remove_stars', 'remove_punctuations', 'remove_emojis')
+
+_worker_pipeline = None
+
+
+def _init_normalization_worker(flags):
+    global _worker_pipeline
+    _worker_pipeline = get_pipeline(*flags)
+
+
+def _normalize_in_worker(text):
+    return _worker_pipeline(text)
+
+
+def normalize_many(docs, workers=1, chunksize=64, **flags):
+    """
+    Normalizes many documents with the same flags as NaturalLanguageProcessor.
+    The pipeline is compiled (and the stopwords loaded) once per process instead of once per document.
+    :param docs: A dictionary {doc_id: text} or an iterable of texts.
+    :param workers: Number of worker processes, 1 normalizes in this process and None uses all CPUs.
+    :param chunksize: Number of documents sent to a worker at once.
+    :param flags: Any of the keyword flags of NaturalLanguageProcessor, e.g. remove_stopwords=False.
+    :return:
+    A dictionary {doc_id: normalized text} with the same key order if docs is a dictionary,
+    otherwise a list of normalized texts in input order.
+    """
+    unknown = set(flags) - set(FLAG_NAMES)
+    assert not unknown, f'Unknown normalization flags: {sorted(unknown)}'
+    flags = tuple(flags.get(name, True) for name in FLAG_NAMES)
+
+    is_dict = isinstance(docs, dict)
+    texts = docs.values() if is_dict else docs
+    total = len(docs) if hasattr(docs, '__len__') else None
+
+    if workers is not None and workers <= 1:
+        pipeline = get_pipeline(*flags)
+        normalized = [pipeline(text) for text in tqdm(texts, total=total, desc="Normalizing text", unit="doc")]
+    else:
+        with Pool(workers, initializer=_init_normalization_worker, initargs=(flags,)) as pool:
+            results = pool.imap(_normalize_in_worker, texts, chunksize=chunksize)
+            normalized = list(tqdm(results, total=total, desc="Normalizing text", unit="doc"))
+
+    if is_dict:
+        return dict(zip(docs.keys(), normalized))
+    return normalized
+
+
 if __name__ == "__main__":
     # Example usage
     text = "This is a **sample** text* * *with ;a ] link [removed] http://example.com and some \" $stop words ✍ 😉🌷 📌 👈🏻 🖥."
@@ -0,0 +1,131 @@
+import os
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+from tqdm import tqdm
+from src.PreProcessing.DumpReader import DumpReader, is_compressed
+
+
+def read_shard(args):
+    """
+    Reads the lines of one byte range of a json file and applies line_func to each of them.
+    Runs inside a worker process, so line_func must be a picklable top level function.
+    :param args: Tuple (file_path, start, end, line_func).
+    :return:
+    A list with the result of line_func for every line of the shard, in file order.
+    """
+    file_path, start, end, line_func = args
+    with open(file_path, 'rb') as json_file:
+        json_file.seek(start)
+        data = json_file.read(end - start).decode('utf8')
+
+    lines = data.split('\n')
+    if lines and lines[-1] == '':
+        lines.pop()  # The shard ends with a newline
+    return [line_func(line) for line in lines]
+
+
+def ordered_imap(pool, func, tasks, window):
+    """
+    Like pool.imap, but with at most window tasks submitted and not yet consumed. pool.imap keeps
+    decoding and stores every finished result until the caller reads it, so a slow caller accumulates
+    the whole decoded file in memory. Here the next task is only submitted when the oldest result is taken.
+    :return:
+    A generator over the results of func, in task order.
+    """
+    tasks = iter(tasks)
+    pending = deque(pool.apply_async(func, (task,)) for task in islice(tasks, window))
+    while pending:
+        result = pending.popleft().get()
+        for task in islice(tasks, 1):
+            pending.append(pool.apply_async(func, (task,)))
+        yield result
+
+
+def map_chunk(args):
+    """
+    Applies line_func to a list of lines inside a worker process.
+    :param args: Tuple (line_func, lines).
+    """
+    line_func, lines = args
+    return [line_func(line) for line in lines]
+
+
+class ParallelJsonReader:
+    def __init__(self, file_path, workers=None, shards_per_worker=4, max_shard_bytes=64 << 20, chunk_lines=10000,
+                 in_flight=None):
+        """
+        Splits a JSONL file into byte ranges aligned to newlines and processes them in a process pool.
+        Compressed files ('.zst', '.gz') can not be split, they are decompressed by a DumpReader and their
+        lines are sent to the pool in chunks of chunk_lines instead.
+        :param file_path: Path to the JSONL file.
+        :param workers: Number of worker processes, defaults to the number of CPUs.
+        :param shards_per_worker: Number of shards per worker, more shards balance the load better.
+        :param max_shard_bytes: Upper bound for the size of a shard, which bounds the memory of a worker.
+        :param chunk_lines: Number of lines of a compressed file sent to a worker at once.
+        :param in_flight: Maximum number of shards (or line chunks of compressed files) being decoded or waiting
+        to be read, 2 * workers by default.
+        This bounds the memory when the caller is slower than the workers.
+        """
+        self.file_path = file_path
+        self.workers = workers or os.cpu_count() or 1
+        self.shards_per_worker = shards_per_worker
+        self.max_shard_bytes = max_shard_bytes
+        self.chunk_lines = chunk_lines
+        self.in_flight = in_flight or 2 * self.workers
+
+    def shard_ranges(self):
+        """
+        Computes the byte ranges of the shards. Every range starts at the beginning of a line
+        and ends right after a newline (or at the end of the file).
+        :return:
+        A list of (start, end) tuples covering the whole file.
+        """
+        assert os.path.exists(self.file_path), f'Path to file is incorrect: {self.file_path}'
+        size = os.path.getsize(self.file_path)
+        if size == 0:
+            return []
+
+        shards = max(self.workers * self.shards_per_worker, -(-size // self.max_shard_bytes))
+        boundaries = [0]
+        with open(self.file_path, 'rb') as json_file:
+            for i in range(1, shards):
+                position = size * i // shards
+                if position <= boundaries[-1]:
+                    continue
+                # Move to the start of the next line (or stay if position already is one)
+                json_file.seek(position - 1)
+                json_file.readline()
+                position = json_file.tell()
+                if boundaries[-1] < position < size:
+                    boundaries.append(position)
+        boundaries.append(size)
+
+        return list(zip(boundaries[:-1], boundaries[1:]))
+
+    def map_lines(self, line_func, desc="Parsing", unit="shard"):
+        """
+        Applies line_func to every line of the file in a process pool.
+        The shards are merged in file order, so the results are the same as for the serial loop
+        [line_func(line) for line in open(file_path)].
+        :param line_func: Picklable function that is called with every line.
+        :return:
+        A generator over the results of line_func, in file order.
+        """
+        if is_compressed(self.file_path):
+            yield from self._map_stream(line_func, desc)
+            return
+        shards = [(self.file_path, start, end, line_func) for start, end in self.shard_ranges()]
+        with Pool(self.workers) as pool:
+            results_in_order = ordered_imap(pool, read_shard, shards, self.in_flight)
+            for results in tqdm(results_in_order, total=len(shards), desc=desc, unit=unit):
+                yield from results
+
+    def _map_stream(self, line_func, desc):
+        lines = (line.rstrip('\n') for line in DumpReader(self.file_path))
+        chunks = iter(lambda: list(islice(lines, self.chunk_lines)), [])
+        with Pool(self.workers) as pool:
+            # Chunks are only read when a slot frees up, so the DumpReader prefetch bounds the input
+            results_in_order = ordered_imap(pool, map_chunk, ((line_func, chunk) for chunk in chunks), self.in_flight)
+            for results in tqdm(results_in_order, desc=desc, unit="chunk"):
+                yield from results
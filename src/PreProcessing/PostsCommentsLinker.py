@@ -1,44 +1,181 @@
 import os
 import json
+import heapq
+import tempfile
+from operator import itemgetter
 from tqdm import tqdm
+import src.Instrumentation as Instrumentation
+from src.PreProcessing.ParallelJsonReader import ParallelJsonReader
+from src.PreProcessing.RecordDecoder import parse_post_line, parse_comment_link_line
+from src.PreProcessing.DumpIndex import DumpIndex
+from src.PreProcessing.DumpReader import iter_dump_lines
+
+def write_json_items(json_file, items):
+    """
+    Writes (key, value) pairs as a JSON object one item at a time.
+    The output is identical to json.dump(dict(items), json_file, ensure_ascii=False, indent=4).
+    """
+    separator = '{\n    '
+    for key, value in items:
+        json_file.write(separator)
+        json_file.write(json.dumps(key, ensure_ascii=False))
+        json_file.write(': ')
+        json_file.write(json.dumps(value, ensure_ascii=False))
+        separator = ',\n    '
+    json_file.write('{}' if separator == '{\n    ' else '\n}')
+
+
+def read_spill_run(path):
+    with open(path, 'r', encoding="utf8") as run_file:
+        for line in run_file:
+            yield json.loads(line)
 
 
 class PostsCommentsLinker:
-    def __init__(self, posts_path, comments_path):
+    def __init__(self, posts_path, comments_path, workers=1, time_range=None, subreddit=None):
+        """
+        :param posts_path: Path to the posts JSONL file.
+        :param comments_path: Path to the comments JSONL file.
+        '.zst' and '.gz' files are decompressed while reading.
+        :param workers: Number of processes used to decode the files, None uses all CPUs.
+        With more than one worker the files are read in newline aligned shards by a ParallelJsonReader.
+        :param time_range: Optional (start, end) of created_utc, as timestamps or datetimes, end exclusive and
+        either may be None. Only the posts created in the range are linked, with all their comments (also
+        those written after the end of the range). The records are located through the
+        DumpIndex of each file (built and saved next to it on first use) instead of parsing the whole files.
+        :param subreddit: Optional subreddit name, only its posts and comments are read.
+        """
         self.posts_path = posts_path
         self.comments_path = comments_path
+        self.workers = workers
+        self.time_range = time_range
+        self.subreddit = subreddit
         self.post_ids = {}  # Use a dictionary to store post IDs (without the 't3_' prefix)
         self.linked_data = {}
 
+    def _selective(self):
+        return self.time_range is not None or self.subreddit is not None
+
+    def _selected_lines(self, path):
+        start, end = self.time_range or (None, None)
+        if path == self.posts_path:
+            return DumpIndex.for_file(path).iter_lines(start, end, self.subreddit)
+        # Comments are selected by thread, whenever they were written
+        posts = DumpIndex.for_file(self.posts_path).window(start, end, self.subreddit)
+        return DumpIndex.for_file(path).iter_lines(subreddit=self.subreddit, links=posts['link'])
+
     def open_json_file(self, path):
         assert os.path.exists(path), f'Path to file is incorrect: {path}'
-        with open(path, 'r', encoding="utf8") as json_file:
-            return list(json_file)
+        if self._selective():
+            return list(self._selected_lines(path))
+        return list(iter_dump_lines(path))
+
+    def iter_json_file(self, path):
+        assert os.path.exists(path), f'Path to file is incorrect: {path}'
+        if self._selective():
+            yield from self._selected_lines(path)
+            return
+        yield from iter_dump_lines(path)
+
+    def parse_json_file(self, path, line_func, desc, unit):
+        if (self.workers is None or self.workers > 1) and not self._selective():
+            return ParallelJsonReader(path, self.workers).map_lines(line_func, desc=desc)
+        return (line_func(json_str) for json_str in tqdm(self.iter_json_file(path), desc=desc, unit=unit))
 
     def get_post_ids(self):
-        posts_list = self.open_json_file(self.posts_path)
-        for json_str in tqdm(posts_list, desc="Parsing posts", unit="post"):
-            obj = json.loads(json_str)
-            post_id = obj['name'].replace('t3_', '')  # Extract post ID without 't3_'
-            self.post_ids[post_id] = obj['title'] + " " + obj['selftext']
-            self.linked_data[post_id] = obj['title'] + " " + obj['selftext'] + " " # Initialize linked data with post content
+        for post_id, text in self.parse_json_file(self.posts_path, parse_post_line, "Parsing posts", "post"):
+            self.post_ids[post_id] = text
+            self.linked_data[post_id] = text + " "  # Initialize linked data with post content
 
     def link_comment_ids_to_post_ids(self):
-        comments_list = self.open_json_file(self.comments_path)
-        for json_str in tqdm(comments_list, desc="Parsing comments", unit="comment"):
-            obj = json.loads(json_str)
-            link_id_without_prefix = obj['link_id'].replace('t3_', '') # Remove 't3_' prefix from link_id
+        for link_id_without_prefix, body in self.parse_json_file(self.comments_path, parse_comment_link_line, "Parsing comments", "comment"):
             if link_id_without_prefix in self.post_ids:
-                # print(f'Found post id: {link_id_without_prefix} and comment id: {obj["name"]}')
-                self.linked_data[link_id_without_prefix] += obj['body'] + " "
+                # print(f'Found post id: {link_id_without_prefix}')
+                self.linked_data[link_id_without_prefix] += body + " "
 
     def save_linked_data(self, output_path):
-        with open(output_path, 'w', encoding="utf8") as json_file:
-            json.dump(self.linked_data, json_file, ensure_ascii=False, indent=4)
+        with Instrumentation.stage('PostsCommentsLinker.save_linked_data') as stage:
+            with open(output_path, 'w', encoding="utf8") as json_file:
+                write_json_items(json_file, self.linked_data.items())
+            stage.add(items=len(self.linked_data), bytes_written=Instrumentation.file_size(output_path))
 
     def link_comments_to_posts(self):
-        self.get_post_ids()
-        self.link_comment_ids_to_post_ids()
+        with Instrumentation.stage('PostsCommentsLinker.link_comments_to_posts') as stage:
+            self.get_post_ids()
+            self.link_comment_ids_to_post_ids()
+            stage.add(items=len(self.linked_data), bytes_read=Instrumentation.file_size(self.posts_path)
+                      + Instrumentation.file_size(self.comments_path))
+
+    def link_comments_to_posts_streaming(self, output_path, memory_budget=256 << 20, spill_dir=None):
+        """
+        Out-of-core version of link_comments_to_posts followed by save_linked_data, for dumps that do not
+        fit into memory. Only the post texts are kept in memory (once). Comment bodies are collected per
+        thread in lists, which are joined once instead of growing a string per comment. When the collected
+        bodies exceed memory_budget, they are spilled to a run file sorted by post, and the runs are
+        merge-joined by post at the end. The output file is written one post at a time and is identical to
+        the one of save_linked_data. self.post_ids and self.linked_data are not filled.
+        :param output_path: Path to the JSON file to write.
+        :param memory_budget: Approximate number of bytes of comment text held in memory before spilling.
+        :param spill_dir: Directory for the temporary run files, defaults to the system temp directory.
+        :return:
+        The number of posts written.
+        """
+        with Instrumentation.stage('PostsCommentsLinker.link_comments_to_posts_streaming') as stage:
+            post_index = {}  # post ID -> position in the output
+            post_texts = []
+            for post_id, text in self.parse_json_file(self.posts_path, parse_post_line, "Parsing posts", "post"):
+                if post_id in post_index:
+                    post_texts[post_index[post_id]] = text  # Later duplicates overwrite, like in get_post_ids
+                else:
+                    post_index[post_id] = len(post_texts)
+                    post_texts.append(text)
+
+            with tempfile.TemporaryDirectory(dir=spill_dir, prefix='linker_') as tmp_dir:
+                runs = []
+                threads = {}  # post position -> list of comment bodies
+                buffered = 0
+
+                def spill():
+                    run_path = os.path.join(tmp_dir, f'run_{len(runs)}.jsonl')
+                    with open(run_path, 'w', encoding="utf8") as run_file:
+                        for index in sorted(threads):
+                            chunk = ''.join(body + " " for body in threads[index])
+                            run_file.write(json.dumps([index, chunk], ensure_ascii=False) + '\n')
+                    runs.append(run_path)
+                    threads.clear()
+
+                comments = self.parse_json_file(self.comments_path, parse_comment_link_line, "Parsing comments", "comment")
+                for link_id_without_prefix, body in comments:
+                    index = post_index.get(link_id_without_prefix)
+                    if index is None:
+                        continue
+                    threads.setdefault(index, []).append(body)
+                    buffered += len(body) + 64  # Rough per comment overhead of the list entry and the str object
+                    if buffered >= memory_budget:
+                        spill()
+                        buffered = 0
+
+                # Runs and the in-memory remainder are all sorted by post, merge them in spill order
+                remainder = ((index, ''.join(body + " " for body in threads[index])) for index in sorted(threads))
+                chunks = heapq.merge(*[read_spill_run(path) for path in runs], remainder, key=itemgetter(0))
+                next_chunk = next(chunks, None)
+
+                def linked_items():
+                    nonlocal next_chunk
+                    for post_id, index in tqdm(post_index.items(), desc="Writing linked data", unit="post"):
+                        parts = [post_texts[index], " "]
+                        while next_chunk is not None and next_chunk[0] == index:
+                            parts.append(next_chunk[1])
+                            next_chunk = next(chunks, None)
+                        yield post_id, ''.join(parts)
+
+                with open(output_path, 'w', encoding="utf8") as json_file:
+                    write_json_items(json_file, linked_items())
+
+            stage.add(items=len(post_index), bytes_read=Instrumentation.file_size(self.posts_path)
+                      + Instrumentation.file_size(self.comments_path), bytes_written=Instrumentation.file_size(output_path))
+
+        return len(post_index)
 
 
 if __name__ == '__main__':
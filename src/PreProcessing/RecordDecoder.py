@@ -0,0 +1,122 @@
+import json
+
+try:
+    import simdjson  # pysimdjson, parses lazily so only the requested fields are materialized
+except ImportError:
+    simdjson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def default_backend():
+    """
+    :return:
+    The fastest installed JSON backend: 'simdjson', 'orjson' or 'json' (standard library).
+    """
+    if simdjson is not None:
+        return 'simdjson'
+    if orjson is not None:
+        return 'orjson'
+    return 'json'
+
+
+class RecordDecoder:
+    def __init__(self, fields, backend=None):
+        """
+        Decodes only the given top level fields of a JSON record.
+        Reddit records have about 90 fields, of which the preprocessors only use a handful. With the
+        simdjson backend the other fields are skipped without being converted to Python objects, with
+        orjson or the standard library the full record is decoded and the other fields are dropped
+        right away, so nothing but the projection is kept alive.
+        :param fields: The top level fields to decode, e.g. ('id', 'body').
+        :param backend: 'simdjson', 'orjson' or 'json', by default the fastest installed one.
+        """
+        self.fields = tuple(fields)
+        self.backend = backend or default_backend()
+        assert self.backend in ('simdjson', 'orjson', 'json'), f'Unknown JSON backend: {self.backend}'
+        assert self.backend != 'simdjson' or simdjson is not None, 'pysimdjson is not installed'
+        assert self.backend != 'orjson' or orjson is not None, 'orjson is not installed'
+        self._parser = None
+
+    def __getstate__(self):
+        # simdjson parsers can not be pickled, every process creates its own
+        state = self.__dict__.copy()
+        state['_parser'] = None
+        return state
+
+    def decode(self, json_str):
+        """
+        Decodes one JSON record.
+        :param json_str: The record as str or bytes.
+        :return:
+        A dictionary with the requested fields, in the order they were requested.
+        Raises a KeyError if one of the fields is missing, like indexing the fully decoded record would.
+        """
+        try:
+            if self.backend == 'simdjson':
+                return self._decode_simdjson(json_str)
+            if self.backend == 'orjson':
+                obj = orjson.loads(json_str)
+                return {field: obj[field] for field in self.fields}
+        except (ValueError, RuntimeError):
+            pass  # Records the fast backends reject (e.g. lone surrogates) are left to the standard library
+
+        obj = json.loads(json_str)
+        return {field: obj[field] for field in self.fields}
+
+    def _decode_simdjson(self, json_str):
+        if self._parser is None:
+            self._parser = simdjson.Parser()
+        obj = self._parser.parse(json_str)
+
+        projection = {}
+        for field in self.fields:
+            value = obj[field]
+            # Nested values are lazy proxies into the parser's buffer, which is reused by the next parse
+            if isinstance(value, simdjson.Object):
+                value = value.as_dict()
+            elif isinstance(value, simdjson.Array):
+                value = value.as_list()
+            projection[field] = value
+        return projection
+
+
+POST_DECODER = RecordDecoder(('id', 'title', 'selftext'))
+COMMENT_DECODER = RecordDecoder(('id', 'body'))
+COMMENT_LINK_DECODER = RecordDecoder(('link_id', 'body'))
+
+
+def parse_post_line(json_str, time=None):
+    """
+    Parses one line of a reddit posts json file.
+    :param time: Optional time token appended to the text.
+    :return:
+    A tuple (post ID, post title and body, followed by the time token if given).
+    The post ID has no 't3_' prefix, so it matches the link IDs of parse_comment_link_line.
+    """
+    obj = POST_DECODER.decode(json_str)
+    text = obj['title'] + " " + obj['selftext']
+    return obj['id'], text if time is None else text + " " + time
+
+
+def parse_comment_line(json_str, time):
+    """
+    Parses one line of a reddit comments json file.
+    :return:
+    A tuple (comment ID, comment body followed by the time token).
+    """
+    obj = COMMENT_DECODER.decode(json_str)
+    return obj['id'], obj['body'] + " " + time
+
+
+def parse_comment_link_line(json_str):
+    """
+    Parses one line of a reddit comments json file for linking it to its post.
+    :return:
+    A tuple (link ID without the 't3_' prefix, comment body).
+    """
+    obj = COMMENT_LINK_DECODER.decode(json_str)
+    return obj['link_id'].replace('t3_', ''), obj['body']  # Remove 't3_' prefix from link_id
@@ -0,0 +1,287 @@
+import os
+import json
+from array import array
+import numpy as np
+from tqdm import tqdm
+
+MAGIC = b'TOKCORP1'
+HEADER_SIZE = 32  # MAGIC, then n_tokens, n_docs and the byte length of the vocabulary as little endian uint64
+VIEW_SUFFIX = '.tok.json'
+
+
+def is_token_corpus(path):
+    """
+    :return:
+    True if path names a token corpus file ('.tok') or a view over several of them ('.tok.json').
+    """
+    return path.endswith('.tok') or path.endswith(VIEW_SUFFIX)
+
+
+def _aligned(position, alignment=8):
+    return -(-position // alignment) * alignment
+
+
+class TokenCorpusWriter:
+    def __init__(self, file_path, buffer_tokens=1 << 20):
+        """
+        Writes whitespace tokenized documents as a token corpus file: a flat uint32 stream of token IDs,
+        the token offset at which every document starts and the vocabulary, in one file that
+        TokenCorpus.load memory-maps. Token IDs are streamed to a temporary file while writing and remapped
+        to sorted vocabulary order on close, so comparing IDs gives the same order as comparing the tokens.
+        :param file_path: Path to the corpus file, by convention ending in '.tok'.
+        :param buffer_tokens: Number of token IDs buffered in memory before they are written out.
+        """
+        self.file_path = file_path
+        self.buffer_tokens = buffer_tokens
+        self.vocabulary = {}  # token -> ID in order of first occurrence
+        self.doc_offsets = array('q', [0])
+        self.n_tokens = 0
+        self._buffer = array('I')
+        self._ids_path = file_path + '.ids.tmp'
+        self._ids_file = open(self._ids_path, 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._ids_file.close()
+            os.remove(self._ids_path)
+
+    def add(self, text):
+        """
+        Adds one document, e.g. the text of a normalized record. Tokens are separated by whitespace.
+        """
+        vocabulary = self.vocabulary
+        tokens = text.split()
+        self._buffer.extend([vocabulary.setdefault(token, len(vocabulary)) for token in tokens])
+        self.n_tokens += len(tokens)
+        self.doc_offsets.append(self.n_tokens)
+        if len(self._buffer) >= self.buffer_tokens:
+            self._flush()
+
+    def _flush(self):
+        self._ids_file.write(np.frombuffer(self._buffer, dtype=np.uint32).astype('<u4').tobytes())
+        self._buffer = array('I')
+
+    def close(self, chunk_tokens=1 << 22):
+        """
+        Writes the corpus file and removes the temporary ID stream.
+        :return:
+        The number of documents written.
+        """
+        self._flush()
+        self._ids_file.close()
+
+        tokens = sorted(self.vocabulary)
+        remap = np.empty(len(tokens), dtype=np.uint32)
+        remap[[self.vocabulary[token] for token in tokens]] = np.arange(len(tokens), dtype=np.uint32)
+        vocabulary = '\n'.join(tokens).encode('utf8')
+        n_docs = len(self.doc_offsets) - 1
+
+        with open(self.file_path, 'wb') as corpus_file:
+            corpus_file.write(MAGIC)
+            corpus_file.write(np.array([self.n_tokens, n_docs, len(vocabulary)], dtype='<u8').tobytes())
+            ids = np.memmap(self._ids_path, dtype='<u4', mode='r') if self.n_tokens else np.zeros(0, dtype='<u4')
+            for start in tqdm(range(0, self.n_tokens, chunk_tokens), desc="Writing token IDs", unit="chunk"):
+                corpus_file.write(remap[ids[start:start + chunk_tokens]].astype('<u4').tobytes())
+            del ids
+            corpus_file.write(b'\0' * (_aligned(corpus_file.tell()) - corpus_file.tell()))
+            corpus_file.write(np.frombuffer(self.doc_offsets, dtype=np.int64).astype('<i8').tobytes())
+            corpus_file.write(vocabulary)
+        os.remove(self._ids_path)
+        return n_docs
+
+
+class TokenStream:
+    def __init__(self, segments, remaps=None):
+        """
+        A read-only token ID stream that chains the ID arrays of one or more corpora without copying them.
+        Slices and integer array indices are resolved per segment, so only the selected IDs are read into memory,
+        and a slice within one segment of a corpus with the same vocabulary is a view of its memory map.
+        :param segments: The uint32 ID arrays, e.g. memory-mapped from corpus files.
+        :param remaps: Per segment None, or an array that maps its IDs to the IDs of the shared vocabulary.
+        """
+        self.segments = list(segments)
+        self.remaps = list(remaps) if remaps is not None else [None] * len(self.segments)
+        self.starts = np.cumsum([0] + [len(segment) for segment in self.segments])
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def _segment_ids(self, segment, ids):
+        remap = self.remaps[segment]
+        return ids if remap is None else remap[ids]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            assert step == 1, 'Token streams only support contiguous slices'
+            parts = []
+            for segment in range(len(self.segments)):
+                lower, upper = max(start, self.starts[segment]), min(stop, self.starts[segment + 1])
+                if lower < upper:
+                    offset = self.starts[segment]
+                    parts.append(self._segment_ids(segment, self.segments[segment][lower - offset:upper - offset]))
+            if len(parts) == 1:
+                return parts[0]
+            return np.concatenate(parts) if parts else np.zeros(0, dtype=np.uint32)
+
+        positions = np.asarray(key)
+        if positions.ndim == 0:
+            segment = int(np.searchsorted(self.starts, positions, side='right')) - 1
+            return self._segment_ids(segment, self.segments[segment][positions - self.starts[segment]])
+        if len(self.segments) == 1:
+            return self._segment_ids(0, self.segments[0][positions])
+        result = np.empty(positions.shape, dtype=np.uint32)
+        segments = np.searchsorted(self.starts, positions, side='right') - 1
+        for segment in np.unique(segments):
+            selected = segments == segment
+            result[selected] = self._segment_ids(segment, self.segments[segment][positions[selected] - self.starts[segment]])
+        return result
+
+    def lookup(self, values):
+        """
+        :return:
+        values[ids] for the whole stream, written segment by segment without a copy of the IDs.
+        """
+        result = np.empty(len(self), dtype=values.dtype)
+        for segment, ids in enumerate(self.segments):
+            remap = self.remaps[segment]
+            np.take(values if remap is None else values[remap], ids, out=result[self.starts[segment]:self.starts[segment + 1]])
+        return result
+
+    def counts(self, size):
+        """
+        :param size: The size of the vocabulary.
+        :return:
+        The number of occurrences of every ID, like np.bincount.
+        """
+        counts = np.zeros(size, dtype=np.int64)
+        for segment, ids in enumerate(self.segments):
+            remap = self.remaps[segment]
+            if remap is None:
+                counts += np.bincount(ids, minlength=size)
+            else:
+                counts[remap] += np.bincount(ids, minlength=len(remap))
+        return counts
+
+
+class TokenCorpus:
+    def __init__(self, ids, doc_offsets, vocabulary):
+        """
+        Documents as one flat stream of token IDs. Document i is ids[doc_offsets[i]:doc_offsets[i + 1]] and
+        the vocabulary lists the token of every ID in sorted order, so the IDs can be passed to
+        CollocationEngine directly. Use load to open a corpus file or a view, combine to chain corpora.
+        :param ids: A TokenStream, or an array of token IDs (memory-mapped when loaded from a file) that is
+        wrapped in one.
+        :param doc_offsets: Token offset of every document, followed by the number of tokens.
+        :param vocabulary: List of the tokens, indexed by ID.
+        """
+        self.ids = ids if isinstance(ids, TokenStream) else TokenStream([ids])
+        self.doc_offsets = doc_offsets
+        self.vocabulary = vocabulary
+
+    def __len__(self):
+        return len(self.doc_offsets) - 1
+
+    @property
+    def n_tokens(self):
+        return len(self.ids)
+
+    def document(self, i):
+        """
+        :return:
+        The token IDs of document i, a view of the stream.
+        """
+        return self.ids[self.doc_offsets[i]:self.doc_offsets[i + 1]]
+
+    def words(self, start=0, stop=None):
+        """
+        :return:
+        The tokens of the stream between the token offsets start and stop, as list of str.
+        """
+        return [self.vocabulary[token_id] for token_id in self.ids[start:stop].tolist()]
+
+    def counts(self):
+        """
+        :return:
+        The number of occurrences of every token ID.
+        """
+        return self.ids.counts(len(self.vocabulary))
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Memory-maps a corpus file written by TokenCorpusWriter, or combines the corpora listed in a view
+        written by save_view.
+        """
+        assert os.path.exists(file_path), f'Path to file is incorrect: {file_path}'
+        if file_path.endswith(VIEW_SUFFIX):
+            with open(file_path, 'r', encoding='utf8') as view_file:
+                sources = json.load(view_file)['sources']
+            directory = os.path.dirname(file_path)
+            return cls.combine([cls.load(os.path.join(directory, source)) for source in sources])
+
+        with open(file_path, 'rb') as corpus_file:
+            header = corpus_file.read(HEADER_SIZE)
+            assert header[:len(MAGIC)] == MAGIC, f'Not a token corpus file: {file_path}'
+            n_tokens, n_docs, vocabulary_size = np.frombuffer(header, dtype='<u8', offset=len(MAGIC)).tolist()
+            offsets_start = _aligned(HEADER_SIZE + 4 * n_tokens)
+            corpus_file.seek(offsets_start + 8 * (n_docs + 1))
+            vocabulary = corpus_file.read(vocabulary_size).decode('utf8')
+
+        ids = np.memmap(file_path, dtype='<u4', mode='r', offset=HEADER_SIZE, shape=(n_tokens,)) if n_tokens \
+            else np.zeros(0, dtype='<u4')
+        doc_offsets = np.memmap(file_path, dtype='<i8', mode='r', offset=offsets_start, shape=(n_docs + 1,))
+        return cls(ids, doc_offsets, vocabulary.split('\n') if vocabulary else [])
+
+    @classmethod
+    def combine(cls, corpora):
+        """
+        Chains corpora in the given order, like combining their text files. The token IDs are not copied:
+        the result streams the segments of the corpora (their memory maps) one after the other. Corpora with
+        different vocabularies get a remap to the sorted union of them, which is applied to the IDs as they are read.
+        Only the document offsets, one int64 per document, are copied.
+        """
+        vocabulary = corpora[0].vocabulary
+        if any(corpus.vocabulary != vocabulary for corpus in corpora):
+            vocabulary = sorted(set().union(*(corpus.vocabulary for corpus in corpora)))
+            index = {token: token_id for token_id, token in enumerate(vocabulary)}
+
+        segments, remaps = [], []
+        for corpus in corpora:
+            shared = None if corpus.vocabulary == vocabulary else \
+                np.array([index[token] for token in corpus.vocabulary], dtype=np.uint32)
+            for segment, remap in zip(corpus.ids.segments, corpus.ids.remaps):
+                segments.append(segment)
+                remaps.append(remap if shared is None else shared if remap is None else shared[remap])
+
+        shifts = np.cumsum([0] + [corpus.n_tokens for corpus in corpora[:-1]])
+        doc_offsets = np.concatenate([corpora[0].doc_offsets[:1]] + [corpus.doc_offsets[1:] + shift
+                                                                    for corpus, shift in zip(corpora, shifts)])
+        return cls(TokenStream(segments, remaps), doc_offsets, vocabulary)
+
+    @staticmethod
+    def save_view(view_path, source_paths):
+        """
+        Writes a view that combines existing corpus files, instead of writing their tokens again.
+        :param view_path: Path to the view, ending in '.tok.json'.
+        :param source_paths: The corpus files, stored relative to the directory of the view.
+        """
+        assert view_path.endswith(VIEW_SUFFIX), f'Views must end in {VIEW_SUFFIX}: {view_path}'
+        directory = os.path.dirname(view_path)
+        for path in source_paths:
+            assert os.path.exists(path), f'Path to file is incorrect: {path}'
+        with open(view_path, 'w', encoding='utf8') as view_file:
+            json.dump({'sources': [os.path.relpath(path, directory or '.') for path in source_paths]}, view_file, indent=4)
+
+
+if __name__ == "__main__":
+    # Example usage
+    path = 'C:/Users/marti/documents/Text-Analytics-in-the-Digital-Humanities/data/reddit/MensRights/r_MensRights_comments(afterElection).tok'
+    corpus = TokenCorpus.load(path)
+    print(f"{len(corpus)} documents, {corpus.n_tokens} tokens, {len(corpus.vocabulary)} distinct tokens")
+    print(' '.join(corpus.words(0, 50)))
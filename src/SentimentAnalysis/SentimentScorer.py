@@ -0,0 +1,224 @@
+import os
+import json
+import sqlite3
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+LABELS = ("Negative", "Neutral", "Positive")
+
+
+def preprocess_text(text, max_chars=2000):
+    """
+    The text preparation of the notebook's classify_batch: missing and blank texts become "No content",
+    all others are cut to max_chars characters.
+    """
+    if text is None or (isinstance(text, float) and np.isnan(text)) or str(text).strip() == "":
+        return "No content"
+    return str(text)[:max_chars]
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf8')).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, path, model_id):
+        """
+        On-disk SQLite cache of class probabilities, keyed by model ID and text hash. Every batch is
+        committed as soon as it is scored, so an interrupted run resumes where it stopped.
+        :param path: Path to the SQLite file, created if missing.
+        :param model_id: Identifies the model, results of other models are never returned.
+        """
+        self.model_id = model_id
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS results ('
+                                'model TEXT NOT NULL, hash TEXT NOT NULL, scores TEXT NOT NULL, '
+                                'PRIMARY KEY (model, hash))')
+        self.connection.commit()
+
+    def get_many(self, hashes, chunk_size=500):
+        """
+        :return:
+        {hash: scores} for the hashes that are cached.
+        """
+        found = {}
+        hashes = list(hashes)
+        for start in range(0, len(hashes), chunk_size):
+            chunk = hashes[start:start + chunk_size]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.connection.execute(f'SELECT hash, scores FROM results WHERE model = ? AND hash IN ({placeholders})',
+                                           [self.model_id] + chunk)
+            found.update((digest, json.loads(scores)) for digest, scores in rows)
+        return found
+
+    def put_many(self, results):
+        """
+        :param results: Iterable of (hash, scores).
+        """
+        self.connection.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?)',
+                                    [(self.model_id, digest, json.dumps(scores)) for digest, scores in results])
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+class SentimentScorer:
+    def __init__(self, model_path, cache_path=None, model_id=None, labels=LABELS, threshold=0.6,
+                 token_budget=8192, max_length=512, chunk_size=4096, threads=None):
+        """
+        CPU-oriented replacement for the notebook's classify_batch. Duplicate texts are scored once, texts
+        already in the result cache are not scored again, and the rest is sorted by token length and cut
+        into batches of at most token_budget (padded) tokens, so short texts are not padded to long ones.
+        :param model_path: Name or local directory of any sequence classification model.
+        :param cache_path: SQLite file of the result cache, None to disable caching.
+        :param model_id: Cache key of the model, defaults to model_path.
+        :param labels: Label of each model output, in order.
+        :param threshold: Predictions with a lower confidence are reported as "Uncertain".
+        :param token_budget: Maximum of batch size times padded length.
+        :param max_length: Texts are truncated to this many tokens.
+        :param chunk_size: The number of texts tokenized and sorted at once.
+        :param threads: Number of torch CPU threads, None keeps the default.
+        """
+        import torch
+        from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+        self.torch = torch
+        if threads:
+            torch.set_num_threads(threads)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path, use_fast=True)
+        self.model = AutoModelForSequenceClassification.from_pretrained(model_path)
+        self.model.eval()
+        self.model_id = model_id or model_path
+        self.labels = list(labels)
+        assert self.model.config.num_labels == len(self.labels), \
+            f'The model has {self.model.config.num_labels} outputs, but {len(self.labels)} labels are given'
+        self.threshold = threshold
+        self.token_budget = token_budget
+        self.max_length = max_length
+        self.chunk_size = chunk_size
+        self.cache = ResultCache(cache_path, self.model_id) if cache_path else None
+
+    def _batches(self, encodings):
+        """
+        Yields lists of positions into encodings, longest texts first, each within the token budget.
+        """
+        lengths = np.array([len(ids) for ids in encodings['input_ids']])
+        batch = []
+        for position in np.argsort(-lengths, kind='stable'):
+            # Sorted by decreasing length, so the first text of the batch sets its padded length
+            if batch and (len(batch) + 1) * lengths[batch[0]] > self.token_budget:
+                yield batch
+                batch = []
+            batch.append(int(position))
+        if batch:
+            yield batch
+
+    def _score_unique(self, texts, progress):
+        """
+        :param texts: {hash: text} of texts that are not cached.
+        :return:
+        {hash: [probability per label]}
+        """
+        results = {}
+        items = list(texts.items())
+        for start in range(0, len(items), self.chunk_size):
+            chunk = items[start:start + self.chunk_size]
+            encodings = self.tokenizer([text for _, text in chunk], truncation=True, max_length=self.max_length)
+            for batch in self._batches(encodings):
+                padded = self.tokenizer.pad({name: [values[i] for i in batch] for name, values in encodings.items()},
+                                            return_tensors='pt')
+                with self.torch.inference_mode():
+                    scores = self.torch.nn.functional.softmax(self.model(**padded).logits, dim=1).tolist()
+                batch_results = [(chunk[i][0], score) for i, score in zip(batch, scores)]
+                results.update(batch_results)
+                if self.cache is not None:
+                    self.cache.put_many(batch_results)
+                progress.update(len(batch))
+        return results
+
+    def score(self, texts):
+        """
+        :param texts: List of texts, missing values allowed.
+        :return:
+        One list of label probabilities per text, in input order.
+        """
+        processed = [preprocess_text(text) for text in texts]
+        hashes = [text_hash(text) for text in processed]
+        unique = dict(zip(hashes, processed))
+
+        results = self.cache.get_many(unique) if self.cache is not None else {}
+        missing = {digest: text for digest, text in unique.items() if digest not in results}
+        print(f"Texts: {len(texts)}, unique: {len(unique)}, cached: {len(unique) - len(missing)}")
+
+        with tqdm(total=len(missing), desc="Scoring texts", unit="text") as progress:
+            results.update(self._score_unique(missing, progress))
+        return [results[digest] for digest in hashes]
+
+    def classify(self, texts):
+        """
+        Same return values as the notebook's classify_batch.
+        :return:
+        (sentiments, confidences, top_labels, scores), scores holds one {'<label>_score': p} dict per text.
+        """
+        sentiments, confidences, top_labels, all_scores = [], [], [], []
+        for score in self.score(texts):
+            idx = int(np.argmax(score))
+            label = self.labels[idx]
+            confidence = score[idx]
+            sentiments.append("Uncertain" if confidence < self.threshold else label)
+            confidences.append(confidence)
+            top_labels.append(label)
+            all_scores.append({f'{name.lower()}_score': value for name, value in zip(self.labels, score)})
+        return sentiments, confidences, top_labels, all_scores
+
+    def score_csv(self, input_path, output_path):
+        """
+        Adds the sentiment columns of the notebook's process_files to a CSV file.
+        """
+        assert os.path.exists(input_path), f'Path to file is incorrect: {input_path}'
+        df = pd.read_csv(input_path)
+        if 'text' not in df.columns:
+            text_col = next((col for col in df.columns if any(name in col.lower() for name in ('text', 'content', 'body'))), None)
+            assert text_col is not None, f'No text column found in {input_path}: {list(df.columns)}'
+            df = df.rename(columns={text_col: 'text'})
+
+        sentiments, confidences, top_labels, raw_scores = self.classify(df['text'].tolist())
+        df['sentiment'] = sentiments
+        df['confidence'] = confidences
+        df['raw_prediction'] = top_labels
+        df = pd.concat([df, pd.DataFrame(raw_scores, index=df.index)], axis=1)
+        df.to_csv(output_path, index=False)
+        print(f"Saved: {output_path}")
+        return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Add sentiment columns to clustered text CSV files.")
+    parser.add_argument('inputs', nargs='+', help="CSV files with a text column")
+    parser.add_argument('--model', default="cardiffnlp/twitter-roberta-base-sentiment",
+                        help="Name or local directory of a sequence classification model")
+    parser.add_argument('--output-dir', default=None, help="Defaults to the directory of each input")
+    parser.add_argument('--cache', default='sentiment_cache.sqlite', help="SQLite result cache, '' to disable")
+    parser.add_argument('--labels', default=','.join(LABELS), help="Comma separated labels of the model outputs")
+    parser.add_argument('--token-budget', type=int, default=8192)
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    scorer = SentimentScorer(args.model, cache_path=args.cache or None, labels=args.labels.split(','),
+                             token_budget=args.token_budget, threads=args.threads)
+    for input_path in args.inputs:
+        directory = args.output_dir or os.path.dirname(input_path)
+        os.makedirs(directory or '.', exist_ok=True)
+        filename = os.path.basename(input_path).replace(".csv", "_with_sentiment.csv")
+        scorer.score_csv(input_path, os.path.join(directory, filename))
+
+
+if __name__ == "__main__":
+    # Example usage:
+    # python -m src.SentimentAnalysis.SentimentScorer clustered_texts_before.csv clustered_texts_after.csv
+    main()
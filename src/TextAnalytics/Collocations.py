@@ -0,0 +1,284 @@
+import math
+import numpy as np
+
+_SMALL = 1e-20  # Same smoothing constant as nltk.metrics.association
+
+
+def intern_tokens(words):
+    """
+    Maps tokens to integer IDs. IDs are assigned in sorted token order, so comparing tuples of IDs gives
+    the same order as comparing the token tuples.
+
+    Args:
+        words (iterable): The tokens.
+
+    Returns:
+        tuple: (np.array of token IDs, list of tokens indexed by ID)
+    """
+    vocabulary = {}
+    ids = np.fromiter((vocabulary.setdefault(word, len(vocabulary)) for word in words), dtype=np.int64)
+    tokens = sorted(vocabulary)
+    remap = np.empty(len(tokens), dtype=np.int64)
+    remap[[vocabulary[token] for token in tokens]] = np.arange(len(tokens))
+    return remap[ids], tokens
+
+
+class CollocationEngine:
+    # Gap patterns counted by the NLTK collocation finders, as word offsets from the first word
+    PATTERNS = ((0, 1), (0, 2), (0, 3), (0, 1, 2), (0, 1, 3), (0, 2, 3), (0, 1, 2, 3))
+
+    def __init__(self, token_ids, vocabulary, unigram_counts=None):
+        """
+        Counts all bigrams, trigrams and quadgrams of a token sequence once, and ranks them by likelihood
+        ratio like nltk's (Bigram|Trigram|Quadgram)CollocationFinder.nbest(...likelihood_ratio, ...).
+        Frequency filters are applied to the precomputed counts and scores, so trying several thresholds
+        does not recount the corpus.
+
+        Args:
+            token_ids (np.array): Token IDs as returned by intern_tokens, or the TokenStream of a TokenCorpus.
+                They are only indexed, never copied as a whole; the n-gram keys derived from them are int64.
+            vocabulary (list): The token for every ID, in sorted order.
+            unigram_counts (np.array): The number of occurrences of every ID, counted from token_ids if None.
+        """
+        self.ids = token_ids
+        self.vocabulary = vocabulary
+        self.vocabulary_size = max(len(vocabulary), 1)
+        self.n_words = len(self.ids)
+        self.unigram_counts = unigram_counts if unigram_counts is not None else np.bincount(self.ids, minlength=len(vocabulary))
+        self._pattern_cache = {}
+        self._ranking_cache = {}
+
+    @classmethod
+    def from_words(cls, words):
+        """
+        Args:
+            words (iterable): The tokens of the corpus.
+        """
+        return cls(*intern_tokens(words))
+
+    @classmethod
+    def from_corpus(cls, corpus):
+        """
+        Uses the token ID stream of a TokenCorpus as it is (memory-mapped uint32, also for views over several
+        files), its vocabulary is already in sorted order. The rankings are the same as from_words of the
+        corresponding text file.
+
+        Args:
+            corpus (TokenCorpus): The corpus, e.g. TokenCorpus.load(path).
+        """
+        return cls(corpus.ids, corpus.vocabulary, corpus.counts())
+
+    def _pattern(self, offsets):
+        """
+        Counts the word tuples (w[i + offsets[0]], w[i + offsets[1]], ...) over all positions i.
+
+        Returns:
+            tuple: (rank of the tuple at every position, count of every distinct tuple,
+            first position of every distinct tuple)
+        """
+        if offsets in self._pattern_cache:
+            return self._pattern_cache[offsets]
+
+        positions = max(self.n_words - offsets[-1], 0)
+        if len(offsets) == 2:
+            keys = self._keys(self.ids, offsets[1], positions)
+        else:
+            # Extend the ranks of the shorter pattern by one word, keys stay below positions * vocabulary size
+            keys = self._keys(self._pattern(offsets[:-1])[0], offsets[-1], positions)
+
+        _, first, ranks, counts = np.unique(keys, return_index=True, return_inverse=True, return_counts=True)
+        rank_type = np.int32 if len(counts) < 2 ** 31 else np.int64  # Halves the memory of the cached ranks
+        self._pattern_cache[offsets] = (ranks.reshape(-1).astype(rank_type), counts, first)
+        return self._pattern_cache[offsets]
+
+    def _keys(self, high, offset, positions, chunk=1 << 22):
+        """
+        Mixed-radix keys high[i] * vocabulary size + ids[i + offset] of the first positions positions. Only the
+        keys are int64, the digits are widened one chunk at a time.
+        """
+        keys = np.empty(positions, dtype=np.int64)
+        for start in range(0, positions, chunk):
+            stop = min(start + chunk, positions)
+            part = keys[start:stop]
+            part[:] = high[start:stop]
+            part *= self.vocabulary_size
+            part += self.ids[offset + start:offset + stop]
+        return keys
+
+    def _count_at(self, offsets, positions, shift=0):
+        """
+        Returns the counts of the pattern tuples starting at positions + shift.
+        """
+        ranks, counts, _ = self._pattern(offsets)
+        return counts[ranks[positions + shift]]
+
+    def _contingency(self, n, positions):
+        """
+        Contingency tables of the n-grams starting at positions, in the cell order of
+        nltk.metrics.association.(Bigram|Trigram|Quadgram)AssocMeasures._contingency.
+        """
+        unigram = [self.unigram_counts[self.ids[positions + i]] for i in range(n)]
+        n_all = self.n_words
+
+        if n == 2:
+            n_ii = self._count_at((0, 1), positions) / 1.0  # nltk scales bigram counts by 1 / (window_size - 1)
+            n_oi = unigram[1] - n_ii
+            n_io = unigram[0] - n_ii
+            return [n_ii, n_oi, n_io, n_all - n_ii - n_oi - n_io]
+
+        if n == 3:
+            n_iii = self._count_at((0, 1, 2), positions)
+            n_iix = self._count_at((0, 1), positions)
+            n_ixi = self._count_at((0, 2), positions)
+            n_xii = self._count_at((0, 1), positions, 1)
+            n_ixx, n_xix, n_xxi = unigram
+            n_oii = n_xii - n_iii
+            n_ioi = n_ixi - n_iii
+            n_iio = n_iix - n_iii
+            n_ooi = n_xxi - n_iii - n_oii - n_ioi
+            n_oio = n_xix - n_iii - n_oii - n_iio
+            n_ioo = n_ixx - n_iii - n_ioi - n_iio
+            n_ooo = n_all - n_iii - n_oii - n_ioi - n_iio - n_ooi - n_oio - n_ioo
+            return [n_iii, n_oii, n_ioi, n_ooi, n_iio, n_oio, n_ioo, n_ooo]
+
+        n_iiii = self._count_at((0, 1, 2, 3), positions)
+        n_iiix = self._count_at((0, 1, 2), positions)
+        n_xiii = self._count_at((0, 1, 2), positions, 1)
+        n_iixi = self._count_at((0, 1, 3), positions)
+        n_ixii = self._count_at((0, 2, 3), positions)
+        n_iixx = self._count_at((0, 1), positions)
+        n_xxii = self._count_at((0, 1), positions, 2)
+        n_xiix = self._count_at((0, 1), positions, 1)
+        n_ixix = self._count_at((0, 2), positions)
+        n_ixxi = self._count_at((0, 3), positions)
+        n_xixi = self._count_at((0, 2), positions, 1)
+        n_ixxx, n_xixx, n_xxix, n_xxxi = unigram
+        n_oiii = n_xiii - n_iiii
+        n_ioii = n_ixii - n_iiii
+        n_iioi = n_iixi - n_iiii
+        n_ooii = n_xxii - n_iiii - n_oiii - n_ioii
+        n_oioi = n_xixi - n_iiii - n_oiii - n_iioi
+        n_iooi = n_ixxi - n_iiii - n_ioii - n_iioi
+        n_oooi = n_xxxi - n_iiii - n_oiii - n_ioii - n_iioi - n_ooii - n_iooi - n_oioi
+        n_iiio = n_iiix - n_iiii
+        n_oiio = n_xiix - n_iiii - n_oiii - n_iiio
+        n_ioio = n_ixix - n_iiii - n_ioii - n_iiio
+        n_ooio = n_xxix - n_iiii - n_oiii - n_ioii - n_iiio - n_ooii - n_ioio - n_oiio
+        n_iioo = n_iixx - n_iiii - n_iioi - n_iiio
+        n_oioo = n_xixx - n_iiii - n_oiii - n_iioi - n_iiio - n_oioi - n_oiio - n_iioo
+        n_iooo = n_ixxx - n_iiii - n_ioii - n_iioi - n_iiio - n_iooi - n_iioo - n_ioio
+        n_oooo = (n_all - n_iiii - n_oiii - n_ioii - n_iioi - n_ooii - n_oioi - n_iooi - n_oooi
+                  - n_iiio - n_oiio - n_ioio - n_ooio - n_iioo - n_oioo - n_iooo)
+        return [n_iiii, n_oiii, n_ioii, n_ooii, n_iioi, n_oioi, n_iooi, n_oooi,
+                n_iiio, n_oiio, n_ioio, n_ooio, n_iioo, n_oioo, n_iooo, n_oooo]
+
+    @staticmethod
+    def _expected_values(n, cont):
+        """
+        Vectorized nltk.metrics.association.NgramAssocMeasures._expected_values, in float64.
+        """
+        n_all = sum(cont)
+        if n == 2:
+            return [(cont[i] + cont[i ^ 1]) * (cont[i] + cont[i ^ 2]) / n_all for i in range(4)]
+
+        cont = [obs.astype(np.float64) for obs in cont]
+        n_all = n_all.astype(np.float64)
+        expected = []
+        for i in range(len(cont)):
+            product = None
+            for j in (1 << bit for bit in range(n)):
+                marginal = sum(cont[x] for x in range(2 ** n) if (x & j) == (i & j))
+                product = marginal if product is None else product * marginal
+            expected.append(product / (n_all ** (n - 1)))
+        return expected
+
+    @staticmethod
+    def _exact_likelihood_ratio(n, cont):
+        """
+        nltk's likelihood_ratio for one contingency table, with the same Python int and float operations,
+        so the score is bit for bit the one nltk computes.
+        """
+        n_all = sum(cont)
+        if n == 2:
+            expected = [(cont[i] + cont[i ^ 1]) * (cont[i] + cont[i ^ 2]) / n_all for i in range(4)]
+        else:
+            expected = []
+            for i in range(len(cont)):
+                product = 1
+                for j in (1 << bit for bit in range(n)):
+                    product *= sum(cont[x] for x in range(2 ** n) if (x & j) == (i & j))
+                expected.append(product / (n_all ** (n - 1)))
+        return 2 * sum(obs * math.log(obs / (exp + _SMALL) + _SMALL) for obs, exp in zip(cont, expected))
+
+    def likelihood_ratios(self, n, positions):
+        """
+        Likelihood ratio scores (nltk's likelihood_ratio) of the n-grams starting at positions.
+        The vectorized float64 computation can differ from nltk in the last bits, see nbest.
+        """
+        cont = self._contingency(n, positions)
+        expected = self._expected_values(n, cont)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return 2 * sum(obs * np.log(obs / (exp + _SMALL) + _SMALL) for obs, exp in zip(cont, expected))
+
+    def ranking(self, n):
+        """
+        All distinct n-grams ranked like nltk's score_ngrams: by descending likelihood ratio, then by the
+        n-gram itself.
+
+        Returns:
+            tuple: (n-grams as an array of token IDs with n columns, their counts, their scores,
+            their first positions in the corpus)
+        """
+        if n in self._ranking_cache:
+            return self._ranking_cache[n]
+        assert n in (2, 3, 4), 'Only bigrams, trigrams and quadgrams are supported'
+
+        _, counts, first = self._pattern(tuple(range(n)))
+        ngrams = np.stack([self.ids[first + i] for i in range(n)], axis=1)
+        scores = self.likelihood_ratios(n, first)
+
+        # np.unique returned the n-grams in lexicographic order, a stable sort keeps it among equal scores
+        order = np.argsort(-scores, kind='stable')
+        self._ranking_cache[n] = (ngrams[order], counts[order], scores[order], first[order])
+        return self._ranking_cache[n]
+
+    def nbest(self, n, limit, min_freq=1):
+        """
+        Equivalent of nltk's finder.apply_freq_filter(min_freq) followed by
+        finder.nbest(AssocMeasures.likelihood_ratio, limit).
+        The vectorized scores are only accurate to about 1e-12, so the n-grams that can end up in the
+        result (the first limit ones plus those scoring within a tolerance of the last one) are scored
+        again exactly like nltk and reordered, which gives the same result including ties.
+
+        Returns:
+            list: The best n-grams as tuples of tokens.
+        """
+        ngrams, counts, scores, first = self.ranking(n)
+        passing = np.flatnonzero(counts >= min_freq)
+        if len(passing) == 0 or limit <= 0:
+            return []
+
+        boundary = scores[passing[min(limit, len(passing)) - 1]]
+        tolerance = 1e-9 * max(abs(boundary), 1.0)
+        candidates = passing[:np.searchsorted(-scores[passing], -(boundary - tolerance), side='right')]
+
+        tables = np.stack(self._contingency(n, first[candidates]), axis=1).tolist()
+        exact = [self._exact_likelihood_ratio(n, table) for table in tables]
+        candidate_ngrams = [tuple(self.vocabulary[i] for i in ngram) for ngram in ngrams[candidates].tolist()]
+        ranked = sorted(zip(candidate_ngrams, exact), key=lambda t: (-t[1], t[0]))
+        return [ngram for ngram, _ in ranked[:limit]]
+
+    def search_threshold(self, n, start, step, min_results=10, limit=30):
+        """
+        Lowers the frequency filter from start by step until at least min_results n-grams pass it.
+
+        Returns:
+            tuple: (the best n-grams for the last filter tried, [(filter, number of results), ...])
+        """
+        results, tried = [], []
+        min_freq = start
+        while len(results) < min_results and min_freq > 1:
+            results = self.nbest(n, limit, min_freq)
+            tried.append((min_freq, len(results)))
+            min_freq -= step
+        return results, tried
@@ -0,0 +1,160 @@
+import os
+import numpy as np
+import xml.etree.ElementTree as ET
+
+GRAPHML_NS = 'http://graphml.graphdrawing.org/xmlns'
+XSI_NS = 'http://www.w3.org/2001/XMLSchema-instance'
+ET.register_namespace('', GRAPHML_NS)
+ET.register_namespace('xsi', XSI_NS)
+
+
+def _tag(name):
+    return f'{{{GRAPHML_NS}}}{name}'
+
+
+class GraphReweighting:
+    def __init__(self, file_path, weight_key='weight'):
+        """
+        Loads a GraphML graph once into a CSR adjacency with float edge weights, so that any number of
+        keyword reweightings can be computed and written without parsing the GraphML again.
+
+        Args:
+            file_path (str): Path to the GraphML file, e.g. written by KernelDensity.save_graph.
+            weight_key (str): The name of the edge weight attribute.
+        """
+        assert os.path.exists(file_path), f'Path to file is incorrect: {file_path}'
+        self.file_path = file_path
+        self.tree = ET.parse(file_path)
+        root = self.tree.getroot()
+        graph = root.find(_tag('graph'))
+
+        key_ids = [key.get('id') for key in root.iter(_tag('key'))
+                   if key.get('for') in ('edge', 'all') and key.get('attr.name') == weight_key]
+
+        self.nodes = [node.get('id') for node in graph.iter(_tag('node'))]
+        self.node_index = {node: i for i, node in enumerate(self.nodes)}
+
+        # Edges keep a reference to their weight element, new weights are written into it in place
+        sources, targets, weights, self.weight_elements = [], [], [], []
+        for edge in graph.iter(_tag('edge')):
+            sources.append(self.node_index[edge.get('source')])
+            targets.append(self.node_index[edge.get('target')])
+            element = next((data for data in edge.iter(_tag('data')) if data.get('key') in key_ids), None)
+            try:
+                weights.append(float(element.text))
+            except (AttributeError, TypeError, ValueError):
+                element = None  # Edges without a numeric weight are left as they are
+                weights.append(np.nan)
+            self.weight_elements.append(element)
+
+        self.sources = np.array(sources, dtype=np.int64)
+        self.targets = np.array(targets, dtype=np.int64)
+        self.weights = np.array(weights, dtype=np.float64)
+        self.directed = graph.get('edgedefault') == 'directed'
+        self.indptr, self.indices = self._csr()
+
+    def _csr(self):
+        """
+        Returns:
+            tuple: (indptr, indices) of the adjacency, undirected edges are stored in both directions.
+        """
+        rows, columns = self.sources, self.targets
+        if not self.directed:
+            rows, columns = np.concatenate((rows, columns)), np.concatenate((columns, rows))
+        order = np.argsort(rows, kind='stable')
+        indptr = np.zeros(len(self.nodes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(self.nodes)), out=indptr[1:])
+        return indptr, columns[order]
+
+    def depths(self, keywords, max_depth):
+        """
+        Multi-source breadth-first search from all keywords at once.
+
+        Args:
+            keywords (iterable): Keyword node ids, ids missing from the graph are ignored.
+            max_depth (int): Stop after this many layers.
+
+        Returns:
+            np.array: The distance of every node to its closest keyword, -1 if farther than max_depth.
+        """
+        depth = np.full(len(self.nodes), -1, dtype=np.int64)
+        frontier = np.array(sorted(self.node_index[k] for k in keywords if k in self.node_index), dtype=np.int64)
+        depth[frontier] = 0
+        for layer in range(1, max_depth + 1):
+            if not len(frontier):
+                break
+            starts = self.indptr[frontier]
+            lengths = self.indptr[frontier + 1] - starts
+            # Positions of all neighbours of the frontier in self.indices
+            offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            frontier = np.unique(self.indices[offsets])
+            frontier = frontier[depth[frontier] < 0]
+            depth[frontier] = layer
+        return depth
+
+    @staticmethod
+    def node_multipliers(depth, base_multiplier, layers, step):
+        """
+        Returns:
+            np.array: max(1, base_multiplier - depth * step) for nodes within layers of a keyword, else 1.
+        """
+        multipliers = np.maximum(1.0, base_multiplier - depth * step)
+        multipliers[(depth < 0) | (depth > layers)] = 1.0
+        return multipliers
+
+    def reweight(self, keywords, base_multiplier=7.0, layers=3, step=2.0, depth=None):
+        """
+        Multiplies every edge weight by the larger multiplier of its two nodes.
+        With layers=0 only the edges of the keywords are multiplied, by base_multiplier as it is, so that
+        values below 1 down-weight them like in the original IncreseWeightsKDE script.
+
+        Returns:
+            np.array: The new edge weights, NaN for edges without a numeric weight.
+        """
+        if depth is None:
+            depth = self.depths(keywords, layers)
+        if layers == 0:
+            keyword_edges = (depth[self.sources] == 0) | (depth[self.targets] == 0)
+            return self.weights * np.where(keyword_edges, base_multiplier, 1.0)
+        multipliers = self.node_multipliers(depth, base_multiplier, layers, step)
+        return self.weights * np.maximum(multipliers[self.sources], multipliers[self.targets])
+
+    def write_graph(self, weights, output_path):
+        for element, weight in zip(self.weight_elements, weights.tolist()):
+            if element is not None:
+                element.text = str(weight)
+        self.tree.write(output_path, encoding='utf-8', xml_declaration=True)
+
+    def sweep(self, keywords, settings, output_pattern=None):
+        """
+        Evaluates a grid of settings, the keyword depths are computed once for the largest layers.
+
+        Args:
+            keywords (iterable): Keyword node ids.
+            settings (iterable): (base_multiplier, layers, step) tuples.
+            output_pattern (str): Output path with {base}, {layers} and {step} fields, defaults to the
+                input path with the setting appended to the name.
+
+        Returns:
+            list: The paths of the written graphs, one per setting.
+        """
+        settings = list(settings)
+        if output_pattern is None:
+            output_pattern = os.path.splitext(self.file_path)[0] + '_x{base:g}_l{layers}_s{step:g}.graphml'
+        depth = self.depths(keywords, max(layers for _, layers, _ in settings))
+
+        output_paths = []
+        for base_multiplier, layers, step in settings:
+            output_path = output_pattern.format(base=base_multiplier, layers=layers, step=step)
+            self.write_graph(self.reweight(keywords, base_multiplier, layers, step, depth=depth), output_path)
+            output_paths.append(output_path)
+            print(f"Modified graph saved to {output_path}")
+        return output_paths
+
+
+if __name__ == "__main__":
+    # Example usage
+    path = 'C:/Users/marti/documents/Text-Analytics-in-the-Digital-Humanities/data/reddit/Feminism/r_Feminism_posts(afterElection)_r_Feminism_posts(beforeElection)_combined.txt.graphml'
+    graph = GraphReweighting(path)
+    grid = [(base, layers, 2.0) for base in (5.0, 10.0, 15.0) for layers in (1, 3, 5)]
+    graph.sweep({"beforeelection", "afterelection"}, grid)
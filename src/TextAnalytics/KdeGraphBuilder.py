@@ -0,0 +1,264 @@
+import os
+import re
+import pkgutil
+from collections import OrderedDict
+import numpy as np
+from multiprocessing import Pool
+from scipy.spatial.distance import cdist
+from nltk.stem import PorterStemmer
+from textplot.text import Text
+from textplot.graphs import Skimmer
+from tqdm import tqdm
+from src.PreProcessing.TokenCorpus import TokenCorpus, is_token_corpus
+
+_worker_densities = None
+
+
+def _init_worker(densities):
+    global _worker_densities
+    _worker_densities = densities
+
+
+def _skim_block(args):
+    """
+    Scores one block of anchor terms against all terms and keeps the skim_depth best pairs per anchor.
+    Runs in a worker process, the density matrix is sent once by _init_worker.
+    """
+    start, stop, skim_depth = args
+    return skim_rows(_worker_densities, start, stop, skim_depth)
+
+
+def skim_rows(densities, start, stop, skim_depth):
+    """
+    Args:
+        densities (np.array): The term density matrix, one row per term.
+        start (int): First anchor row.
+        stop (int): Row after the last anchor row.
+        skim_depth (int): The number of siblings for each term.
+
+    Returns:
+        list: For every anchor row, a list of (row, score) of its closest siblings, best first.
+    """
+    # 1 - Bray-Curtis distance, the score of textplot's Text.score_braycurtis
+    scores = 1 - cdist(densities[start:stop], densities, 'braycurtis')
+    skimmed = []
+    for anchor, row in enumerate(scores, start):
+        # Like Matrix.anchored_pairs, the anchor itself and pairs scoring 0 are not candidates
+        row[anchor] = 0
+        candidates = np.flatnonzero(row)
+        if len(candidates) > skim_depth:
+            candidates = candidates[np.argpartition(-row[candidates], skim_depth - 1)[:skim_depth]]
+        candidates = candidates[np.lexsort((candidates, -row[candidates]))]
+        skimmed.append([(int(term), float(row[term])) for term in candidates])
+    return skimmed
+
+
+class CorpusText:
+    def __init__(self, corpus):
+        """
+        The parts of textplot's Text that KdeGraphBuilder uses, computed from a TokenCorpus instead of a
+        text string. Every distinct token is split, filtered and stemmed like textplot's tokenizer once,
+        and the offsets of the terms are expanded from the token ID stream with array operations, so the
+        corpus is never turned back into strings. The terms, their offsets and the number of tokens are
+        the ones Text.from_file builds from the corresponding text file.
+
+        Args:
+            corpus (TokenCorpus): The corpus, e.g. TokenCorpus.load(path).
+        """
+        stopwords = set(pkgutil.get_data('textplot', 'data/stopwords.txt').decode('utf8').splitlines())
+        stem = PorterStemmer().stem
+
+        # textplot's tokens ([a-z]+ runs of the lowercased text) of every vocabulary entry
+        pieces = {}
+        split = [[pieces.setdefault(match.group(0), len(pieces)) for match in re.finditer('[a-z]+', token.lower())]
+                 for token in corpus.vocabulary]
+        widths = np.array([len(token_pieces) for token_pieces in split], dtype=np.int64)
+        table = np.full((len(split), int(widths.max(initial=0))), -1, dtype=np.int64)
+        for token_id, token_pieces in enumerate(split):
+            table[token_id, :len(token_pieces)] = token_pieces
+
+        # The ID stream is only indexed, so a memory-mapped corpus or view is not copied
+        counts = corpus.ids.lookup(widths)
+        starts = np.cumsum(counts) - counts
+        # Text.tokens has one entry per textplot token, only its length is used
+        self.tokens = range(int(counts.sum()))
+
+        offsets, piece_ids = [], []
+        for column in range(table.shape[1]):
+            rows = np.flatnonzero(counts > column)
+            offsets.append(starts[rows] + column)
+            piece_ids.append(table[corpus.ids[rows], column])
+        offsets = np.concatenate(offsets) if offsets else np.zeros(0, dtype=np.int64)
+        piece_ids = np.concatenate(piece_ids) if piece_ids else np.zeros(0, dtype=np.int64)
+
+        # Stopwords keep their offset but are no term
+        self.pieces = list(pieces)
+        keep = ~np.array([piece in stopwords for piece in self.pieces], dtype=bool)[piece_ids]
+        offsets, piece_ids = offsets[keep], piece_ids[keep]
+        order = np.argsort(offsets)
+        offsets, piece_ids = offsets[order], piece_ids[order]
+
+        stems = {}
+        piece_stems = np.array([stems.setdefault(stem(piece), len(stems)) for piece in self.pieces], dtype=np.int64)
+        stem_names = list(stems)
+        stem_ids = piece_stems[piece_ids]
+
+        # Terms in order of first occurrence, like the OrderedDict of Text.tokenize
+        occurring, first = np.unique(stem_ids, return_index=True)
+        by_stem = np.argsort(stem_ids, kind='stable')
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(stem_ids, minlength=len(stems))[occurring])))
+        grouped = offsets[by_stem]
+        self.terms = OrderedDict()
+        for i in np.argsort(first, kind='stable'):
+            self.terms[stem_names[occurring[i]]] = grouped[bounds[i]:bounds[i + 1]]
+
+        self.piece_counts = np.bincount(piece_ids, minlength=len(self.pieces))
+        self.piece_first = np.full(len(self.pieces), len(piece_ids), dtype=np.int64)
+        np.minimum.at(self.piece_first, piece_ids, np.arange(len(piece_ids)))
+        self.stem_pieces = {}
+        for piece_id in np.flatnonzero(self.piece_counts):
+            self.stem_pieces.setdefault(stem_names[piece_stems[piece_id]], []).append(piece_id)
+
+    def most_frequent_terms(self, depth):
+        """
+        Returns:
+            set: The depth most frequent terms and all other terms as frequent as the last of them,
+            like Text.most_frequent_terms.
+        """
+        counts = sorted((len(offsets) for offsets in self.terms.values()), reverse=True)
+        end_count = counts[:depth][-1]
+        return {term for term, offsets in self.terms.items() if len(offsets) >= end_count}
+
+    def unstem(self, term):
+        """
+        Returns:
+            str: The most common unstemmed variant of the term, the first one to occur on a tie, like Text.unstem.
+        """
+        piece_id = max(self.stem_pieces[term], key=lambda piece: (self.piece_counts[piece], -self.piece_first[piece]))
+        return self.pieces[piece_id]
+
+    def kde(self, term, bandwidth=2000, samples=1000, kernel='gaussian'):
+        return Text.kde.__wrapped__(self, term, bandwidth, samples, kernel)
+
+
+class KdeGraphBuilder:
+    def __init__(self, text, bandwidth=2000, samples=1000, kernel='gaussian', workers=None, cutoff=8.0):
+        """
+        Vectorized replacement for textplot's Matrix.index and Skimmer.build.
+        The kernel densities of all terms are computed as one matrix, the pairwise Bray-Curtis scores
+        in blocks of rows across a process pool, and the closest siblings of every term are picked
+        with partial sorts. The resulting graph is the one textplot builds, up to the order of ties.
+
+        Args:
+            text (Text): The tokenized textplot text, or a CorpusText.
+            bandwidth (int): The kernel bandwidth.
+            samples (int): The number of evenly-spaced sample points.
+            kernel (str): The kernel function. Gaussian densities are computed natively, other kernels
+                fall back to textplot's per term estimate.
+            workers (int): Number of worker processes, 1 computes in this process, None uses all CPUs.
+            cutoff (float): Gaussian contributions farther than cutoff bandwidths from a sample point are
+                below 1e-13 of the kernel peak and skipped.
+        """
+        self.text = text
+        self.bandwidth = bandwidth
+        self.samples = samples
+        self.kernel = kernel
+        self.workers = workers or os.cpu_count() or 1
+        self.cutoff = cutoff
+
+    def densities(self, terms):
+        """
+        Estimates the kernel density of every term, like textplot's Text.kde.
+
+        Args:
+            terms (list): Stemmed terms.
+
+        Returns:
+            np.array: One row of samples density values per term.
+        """
+        if self.kernel != 'gaussian':
+            return np.array([self.text.kde(term, self.bandwidth, self.samples, self.kernel) for term in terms])
+
+        n_tokens = len(self.text.tokens)
+        offsets = [np.asarray(self.text.terms[term], dtype=np.float64) for term in terms]
+        counts = np.array([len(term_offsets) for term_offsets in offsets], dtype=np.float64)
+
+        # All occurrences of all terms, sorted by position in the text
+        positions = np.concatenate(offsets)
+        rows = np.repeat(np.arange(len(terms)), counts.astype(np.int64))
+        order = np.argsort(positions, kind='stable')
+        positions, rows = positions[order], rows[order]
+
+        x_axis = np.linspace(0, n_tokens, self.samples)
+        window = self.cutoff * self.bandwidth
+        lower = np.searchsorted(positions, x_axis - window, side='left')
+        upper = np.searchsorted(positions, x_axis + window, side='right')
+
+        densities = np.empty((len(terms), self.samples))
+        for sample, x in enumerate(x_axis):
+            near = slice(lower[sample], upper[sample])
+            weights = np.exp(-0.5 * ((x - positions[near]) / self.bandwidth) ** 2)
+            densities[:, sample] = np.bincount(rows[near], weights=weights, minlength=len(terms))
+
+        # Normalize the Gaussian kernel sums, then scale like Text.kde so that the scores integrate to 1
+        densities /= (counts * self.bandwidth * np.sqrt(2 * np.pi))[:, np.newaxis]
+        return densities * (n_tokens / self.samples)
+
+    def skim(self, densities, skim_depth, block_rows=64):
+        """
+        Returns:
+            list: For every term row, a list of (row, score) of its skim_depth closest siblings.
+        """
+        blocks = [(start, min(start + block_rows, len(densities)), skim_depth)
+                  for start in range(0, len(densities), block_rows)]
+        skimmed = []
+        if self.workers == 1:
+            for start, stop, depth in tqdm(blocks, desc="Scoring term pairs", unit="block"):
+                skimmed.extend(skim_rows(densities, start, stop, depth))
+        else:
+            with Pool(self.workers, initializer=_init_worker, initargs=(densities,)) as pool:
+                for block in tqdm(pool.imap(_skim_block, blocks), total=len(blocks), desc="Scoring term pairs", unit="block"):
+                    skimmed.extend(block)
+        return skimmed
+
+    def build(self, term_depth=500, skim_depth=10, d_weights=False):
+        """
+        Args:
+            term_depth (int): Consider the N most frequent terms.
+            skim_depth (int): Connect each word to the N closest siblings.
+            d_weights (bool): If true, give "close" nodes low weights.
+
+        Returns:
+            Skimmer: The graph, as textplot would have built it.
+        """
+        terms = sorted(self.text.most_frequent_terms(term_depth))
+        skimmed = self.skim(self.densities(terms), skim_depth)
+
+        unstemmed = [self.text.unstem(term) for term in terms]
+        graph = Skimmer()
+        for anchor, siblings in enumerate(skimmed):
+            for term, weight in siblings:
+                # If edges represent distance, use the complement of the raw score
+                if d_weights:
+                    weight = 1 - weight
+                graph.graph.add_edge(unstemmed[anchor], unstemmed[term], weight=weight)
+        return graph
+
+
+def build_graph(path, term_depth=500, skim_depth=10, d_weights=False, workers=None, **kwargs):
+    """
+    Drop-in replacement for textplot.helpers.build_graph using KdeGraphBuilder.
+
+    Args:
+        path (str): The file path, a text file or a token corpus ('.tok' or '.tok.json').
+        term_depth (int): Consider the N most frequent terms.
+        skim_depth (int): Connect each word to the N closest siblings.
+        d_weights (bool): If true, give "close" nodes low weights.
+        workers (int): Number of worker processes, None uses all CPUs.
+        kwargs: bandwidth, samples and kernel of the density estimates.
+
+    Returns:
+        Skimmer: The indexed graph.
+    """
+    text = CorpusText(TokenCorpus.load(path)) if is_token_corpus(path) else Text.from_file(path)
+    return KdeGraphBuilder(text, workers=workers, **kwargs).build(term_depth, skim_depth, d_weights)
@@ -1,17 +1,34 @@
-from textplot.helpers import build_graph
 import os
 
 
 class KernelDensity:
-    def __init__(self, file_path, term_depth=500, skim_depth=7, d_weights=False):
+    def __init__(self, file_path, term_depth=500, skim_depth=7, d_weights=False, backend='textplot', workers=None):
+        """
+        :param backend: 'textplot' builds the graph with textplot.helpers.build_graph, 'native' with the
+        vectorized KdeGraphBuilder, which scales to a larger term_depth.
+        :param workers: Number of processes of the native backend, None uses all CPUs.
+        file_path may also be a token corpus ('.tok' or '.tok.json', see TokenCorpus), which only the native
+        backend reads.
+        """
+        assert backend in ('textplot', 'native'), f'Unknown backend: {backend}'
+        assert backend == 'native' or not file_path.endswith(('.tok', '.tok.json')), \
+            f'Token corpora need the native backend: {file_path}'
         self.file_path = file_path
         self.path = os.path.dirname(file_path)
         self.term_depth = term_depth
         self.skim_depth = skim_depth
         self.d_weights = d_weights
+        self.backend = backend
+        self.workers = workers
         self.graph = None
 
     def build_graph(self, **kwargs):
+        # textplot.helpers fails to import on current SciPy (scipy.misc), so it is only imported for the textplot backend
+        if self.backend == 'native':
+            from src.TextAnalytics.KdeGraphBuilder import build_graph
+            kwargs['workers'] = self.workers
+        else:
+            from textplot.helpers import build_graph
         self.graph = build_graph(self.file_path, term_depth=self.term_depth, skim_depth=self.skim_depth, d_weights=self.d_weights, **kwargs)
 
     def save_graph(self, name):
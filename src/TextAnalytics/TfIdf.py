@@ -1,15 +1,98 @@
 import os
 import json
-from tqdm import tqdm
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer
 import pandas as pd
 from collections import defaultdict
 import re
+import heapq
+import numpy as np
+from itertools import islice
 from stop_words import get_stop_words  # Assuming you have this installed
-from src.PreProcessing.NaturalLanguageProcessor import NaturalLanguageProcessor
+import src.Instrumentation as Instrumentation
+from src.PreProcessing.NaturalLanguageProcessor import normalize_many, FLAG_NAMES
+from src.PreProcessing.CorpusCache import CorpusCache
 from src.PreProcessing.PostsCommentsLinker import PostsCommentsLinker
 
 
+class TermStatistics:
+    def __init__(self):
+        """
+        Mergeable corpus statistics for count-normalized TF-IDF: the number of documents and, per term, its
+        document frequency, total count and the sum of its L2-normalized term frequencies. All of them are
+        sums over documents, so statistics of separate shards or dumps can be merged without refitting.
+        """
+        self.n_docs = 0
+        self.vocabulary = {}
+        self.df = np.zeros(0, dtype=np.int64)
+        self.tf = np.zeros(0, dtype=np.int64)
+        self.weight = np.zeros(0, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.vocabulary)
+
+    @property
+    def terms(self):
+        return list(self.vocabulary)
+
+    def _indices(self, terms):
+        """
+        Returns:
+            np.array: The index of every term, new terms are appended to the vocabulary.
+        """
+        indices = np.fromiter((self.vocabulary.setdefault(term, len(self.vocabulary)) for term in terms),
+                              dtype=np.int64, count=len(terms))
+        if len(self.vocabulary) > len(self.df):
+            capacity = max(len(self.vocabulary), 2 * len(self.df))
+            for name in ('df', 'tf', 'weight'):
+                array = getattr(self, name)
+                grown = np.zeros(capacity, dtype=array.dtype)
+                grown[:len(array)] = array
+                setattr(self, name, grown)
+        return indices
+
+    def add(self, terms, n_docs, df, tf, weight):
+        """
+        Adds the statistics of one chunk of documents.
+
+        Args:
+            terms (list): The terms of the chunk.
+            n_docs (int): The number of documents in the chunk.
+            df, tf, weight (np.array): Per term document frequency, total count and normalized frequency sum.
+        """
+        indices = self._indices(terms)
+        self.n_docs += n_docs
+        np.add.at(self.df, indices, df)
+        np.add.at(self.tf, indices, tf)
+        np.add.at(self.weight, indices, weight)
+
+    def merge(self, other):
+        """
+        Adds the statistics of another shard in place.
+
+        Returns:
+            TermStatistics: self, so that merges can be chained.
+        """
+        n = len(other)
+        self.add(other.terms, other.n_docs, other.df[:n], other.tf[:n], other.weight[:n])
+        return self
+
+    def __add__(self, other):
+        return TermStatistics().merge(self).merge(other)
+
+    def save(self, file_path):
+        n = len(self)
+        np.savez(file_path, n_docs=self.n_docs, terms=np.array(self.terms, dtype=str),
+                 df=self.df[:n], tf=self.tf[:n], weight=self.weight[:n])
+
+    @classmethod
+    def load(cls, file_path):
+        assert os.path.exists(file_path), f'Path to file is incorrect: {file_path}'
+        stats = cls()
+        with np.load(file_path) as data:
+            stats.add(data['terms'].tolist(), int(data['n_docs']), data['df'], data['tf'], data['weight'])
+        return stats
+
+
 class OverallTfidfComputer:
     def __init__(self, top_n=20, min_df=5, max_df=0.9, stop_words='english'):
         self.top_n = top_n
@@ -17,6 +100,8 @@ class OverallTfidfComputer:
         self.max_df = max_df
         self.stop_words = stop_words
         self.vectorizer = TfidfVectorizer(min_df=self.min_df, max_df=self.max_df, stop_words=self.stop_words)
+        # Same tokenization, lowercasing and stop word removal as the vectorizer, for the count-normalized scores
+        self.analyzer = self.vectorizer.build_analyzer()
 
     def compute_overall_tfidf(self, docs_dict):
         """
@@ -28,19 +113,148 @@ class OverallTfidfComputer:
         Returns:
             list: [(keyword, overall_tfidf_score), ...] for the top_n keywords overall.
         """
-        corpus = list(docs_dict.values())
-        tfidf_matrix = self.vectorizer.fit_transform(corpus)
-        feature_names = self.vectorizer.get_feature_names_out()
+        with Instrumentation.stage('OverallTfidfComputer.compute_overall_tfidf') as stage:
+            corpus = list(docs_dict.values())
+            tfidf_matrix = self.vectorizer.fit_transform(corpus)
+            feature_names = self.vectorizer.get_feature_names_out()
 
-        # Sum TF-IDF scores for each term across all documents
-        overall_tfidf_scores = tfidf_matrix.sum(axis=0).A1
-        term_scores = zip(feature_names, overall_tfidf_scores)
+            # Sum TF-IDF scores for each term across all documents
+            overall_tfidf_scores = tfidf_matrix.sum(axis=0).A1
+            term_scores = zip(feature_names, overall_tfidf_scores)
 
-        # Sort terms by their overall TF-IDF score in descending order
-        sorted_terms = sorted(term_scores, key=lambda x: x[1], reverse=True)
+            # Sort terms by their overall TF-IDF score in descending order
+            sorted_terms = sorted(term_scores, key=lambda x: x[1], reverse=True)
+            stage.add(items=len(corpus))
 
         return sorted_terms[:self.top_n]
 
+    def compute_store_tfidf(self, store, rows=None):
+        """
+        compute_overall_tfidf on the counts of a DocumentTermStore, without tokenizing the texts again.
+
+        Args:
+            store (DocumentTermStore): The corpus matrix store.
+            rows (np.array): Row numbers, e.g. store.rows(period='before'), None for all documents.
+
+        Returns:
+            list: [(keyword, overall_tfidf_score), ...] for the top_n keywords overall.
+        """
+        tfidf_matrix, feature_names = store.tfidf(rows, min_df=self.min_df, max_df=self.max_df, stop_words=self.stop_words)
+        term_scores = zip(feature_names, tfidf_matrix.sum(axis=0).A1)
+        return sorted(term_scores, key=lambda x: x[1], reverse=True)[:self.top_n]
+
+    def accumulate(self, docs, stats=None, chunk_size=10000):
+        """
+        Streams documents into term statistics, holding only one chunk of documents in memory.
+
+        Args:
+            docs (dict or iterable): Dictionary of {post_id: combined_text} or any iterable of texts.
+            stats (TermStatistics): Statistics to update incrementally, a new one if None.
+            chunk_size (int): The number of documents counted at once.
+
+        Returns:
+            TermStatistics: The updated statistics.
+        """
+        stats = stats if stats is not None else TermStatistics()
+        docs = iter(docs.values() if isinstance(docs, dict) else docs)
+        counter = CountVectorizer(analyzer=self.analyzer)
+        with Instrumentation.stage('OverallTfidfComputer.accumulate') as stage:
+            while True:
+                chunk = list(islice(docs, chunk_size))
+                if not chunk:
+                    return stats
+                stage.add(items=len(chunk))
+                try:
+                    counts = counter.fit_transform(chunk).tocsr()
+                except ValueError:  # Only stop words in this chunk
+                    stats.n_docs += len(chunk)
+                    continue
+                norms = np.sqrt(counts.multiply(counts).sum(axis=1)).A1
+                norms[norms == 0] = 1
+                normalized = counts.multiply(1 / norms[:, np.newaxis]).tocsr()
+                stats.add(counter.get_feature_names_out().tolist(), len(chunk), (counts > 0).sum(axis=0).A1,
+                          counts.sum(axis=0).A1, normalized.sum(axis=0).A1)
+
+    def _scores(self, stats, idf_stats=None):
+        """
+        Count-normalized TF-IDF: each term's summed L2-normalized term frequency times its smoothed idf.
+        Unlike the summed columns of the TfidfVectorizer matrix, every document is normalized by the norm of its
+        raw counts instead of its tf-idf row, which keeps the statistics mergeable. The scores and rankings differ
+        from those of compute_overall_tfidf. Terms outside min_df/max_df of idf_stats score NaN.
+
+        Args:
+            stats (TermStatistics): The statistics to score.
+            idf_stats (TermStatistics): The statistics that define idf and the df limits, defaults to stats.
+
+        Returns:
+            np.array: One score per term of stats.
+        """
+        idf_stats = idf_stats if idf_stats is not None else stats
+        n = len(stats)
+        if idf_stats is stats:
+            df = stats.df[:n]
+        else:
+            df = np.array([idf_stats.df[idf_stats.vocabulary[term]] for term in stats.terms], dtype=np.int64)
+
+        n_docs = idf_stats.n_docs
+        min_count = self.min_df if isinstance(self.min_df, int) else self.min_df * n_docs
+        max_count = self.max_df if isinstance(self.max_df, int) else self.max_df * n_docs
+        idf = np.log((1 + n_docs) / (1 + df)) + 1
+        scores = stats.weight[:n] * idf
+        scores[(df < min_count) | (df > max_count)] = np.nan
+        return scores
+
+    def _top_terms(self, terms, scores):
+        """
+        Picks the top_n scores with a partial selection, ties are ordered by term like the full sort.
+        """
+        valid = np.flatnonzero(~np.isnan(scores))
+        if len(valid) > self.top_n:
+            kth = -np.partition(-scores[valid], self.top_n - 1)[self.top_n - 1]
+            valid = valid[scores[valid] >= kth]
+        return heapq.nsmallest(self.top_n, ((terms[i], float(scores[i])) for i in valid), key=lambda x: (-x[1], x[0]))
+
+    def compute_count_normalized_tfidf(self, docs=None, stats=None, chunk_size=10000):
+        """
+        Streams documents into mergeable statistics and ranks the terms by count-normalized TF-IDF (see _scores).
+        This is not the metric of compute_overall_tfidf: documents are normalized by their raw counts, so the
+        scores and the order of the terms can not be compared with it.
+
+        Args:
+            docs (dict or iterable): Documents to add, may be None to only score existing statistics.
+            stats (TermStatistics): Previously accumulated statistics, e.g. of older dumps.
+            chunk_size (int): The number of documents counted at once.
+
+        Returns:
+            list: [(keyword, count_normalized_tfidf_score), ...] for the top_n keywords overall.
+        """
+        if docs is not None:
+            stats = self.accumulate(docs, stats, chunk_size)
+        return self._top_terms(stats.terms, self._scores(stats))
+
+    def compare_periods(self, period_docs, chunk_size=10000):
+        """
+        Reads every document once, accumulating one statistics shard per period. The merged shards define
+        a shared idf, so the per period top terms are comparable with each other. The scores are count-normalized
+        TF-IDF like those of compute_count_normalized_tfidf, not comparable with compute_overall_tfidf.
+
+        Args:
+            period_docs (dict): {period: docs}, docs as accepted by accumulate, or already accumulated
+                TermStatistics.
+
+        Returns:
+            dict: {period: [(keyword, count_normalized_tfidf_score), ...]} plus the key 'overall' for all periods combined.
+        """
+        shards = {period: docs if isinstance(docs, TermStatistics) else self.accumulate(docs, chunk_size=chunk_size)
+                  for period, docs in period_docs.items()}
+        overall = TermStatistics()
+        for shard in shards.values():
+            overall.merge(shard)
+
+        top_terms = {period: self._top_terms(shard.terms, self._scores(shard, overall)) for period, shard in shards.items()}
+        top_terms['overall'] = self._top_terms(overall.terms, self._scores(overall))
+        return top_terms
+
 
 if __name__ == '__main__':
     posts_path = 'C:/Users/marti/documents/Text-Analytics-in-the-Digital-Humanities/data/reddit/Feminism/r_Feminism_posts(afterElection).jsonl'
@@ -48,18 +262,23 @@ if __name__ == '__main__':
     output_path = 'C:/Users/marti/documents/Text-Analytics-in-the-Digital-Humanities/data/reddit/Feminism/Feminism()_linked_data.json'
     overall_tfidf_output_path = 'C:/Users/marti/documents/Text-Analytics-in-the-Digital-Humanities/data/reddit/Feminism/Feminism(after)_overall_tfidf_keywords.json'
 
-    linker = PostsCommentsLinker(posts_path, comments_path)
-    linker.link_comments_to_posts()
-    linker.save_linked_data(output_path)
+    cache = CorpusCache(os.path.join(os.path.dirname(output_path), '.corpus_cache'))
+    key = cache.key('normalized_linked_data', [posts_path, comments_path],
+                    flags=dict.fromkeys(FLAG_NAMES, True))
+    linked_data = cache.get_json(key)
+
+    if linked_data is None:
+        linker = PostsCommentsLinker(posts_path, comments_path)
+        linker.link_comments_to_posts()
+        linker.save_linked_data(output_path)
 
-    # Load the normalized linked data from the output file
-    with open(output_path, 'r', encoding="utf8") as f:
-        linked_data = json.load(f)
+        # Load the normalized linked data from the output file
+        with open(output_path, 'r', encoding="utf8") as f:
+            linked_data = json.load(f)
 
-    # Normalize the text in the linked data
-    for post_id, text in tqdm(linked_data.items(), desc="Normalizing text", unit="post"):
-        nlp = NaturalLanguageProcessor(text)
-        linked_data[post_id] = nlp.text
+        # Normalize the text in the linked data, one process per CPU
+        linked_data = normalize_many(linked_data, workers=None, chunksize=32)
+        cache.put_json(key, linked_data)
 
     # Compute overall TF-IDF
     tfidf_computer = OverallTfidfComputer(top_n=20)
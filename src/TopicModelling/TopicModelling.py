@@ -0,0 +1,268 @@
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+from multiprocessing import Pool
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+from tqdm import tqdm
+from src.PreProcessing.DocumentTermStore import DocumentTermStore
+
+_worker_matrix = None
+
+
+def english_stopwords():
+    """
+    NLTK's English stop words, as used in the notebook, downloaded on first use.
+    """
+    import nltk
+    from nltk.corpus import stopwords
+    try:
+        return stopwords.words('english')
+    except LookupError:
+        nltk.download('stopwords', quiet=True)
+        return stopwords.words('english')
+
+
+def _init_worker(matrix):
+    global _worker_matrix
+    _worker_matrix = matrix
+
+
+def _fit_inertia(args):
+    k, random_state, batch_size = args
+    return k, fit_kmeans(_worker_matrix, k, random_state, batch_size).inertia_
+
+
+def fit_kmeans(X, k, random_state=42, batch_size=4096, n_init=3):
+    """
+    Mini-batch k-means on the sparse TF-IDF matrix, each step only touches batch_size rows.
+
+    Args:
+        X (sparse matrix): The TF-IDF matrix.
+        k (int): The number of clusters.
+
+    Returns:
+        MiniBatchKMeans: The fitted model, inertia_ is computed on all rows.
+    """
+    model = MiniBatchKMeans(n_clusters=k, random_state=random_state, batch_size=batch_size, n_init=n_init)
+    return model.fit(X)
+
+
+def elbow(inertias):
+    """
+    Picks the K farthest below the straight line between the first and the last point of the
+    (normalized) elbow curve.
+
+    Args:
+        inertias (dict): {k: inertia}.
+
+    Returns:
+        int: The chosen K.
+    """
+    ks = np.array(sorted(inertias), dtype=np.float64)
+    values = np.array([inertias[k] for k in sorted(inertias)], dtype=np.float64)
+    if len(ks) < 3:
+        return int(ks[0])
+    x = (ks - ks[0]) / (ks[-1] - ks[0])
+    y = (values - values.min()) / max(np.ptp(values), 1e-12)
+    line = y[0] + (y[-1] - y[0]) * x
+    return int(ks[np.argmax(line - y)])
+
+
+class TopicModeller:
+    def __init__(self, store, min_df=5, max_df=0.9, stop_words=None, random_state=42, batch_size=4096):
+        """
+        Headless version of the Topicmodelling notebook on a DocumentTermStore: TF-IDF, a parallel
+        mini-batch k-means sweep over K, the final clustering and a TruncatedSVD projection, all on the
+        sparse matrix.
+
+        Args:
+            store (DocumentTermStore): The posts, with the periods 'before' and 'after'.
+            min_df (int): Minimum document frequency of the TF-IDF terms.
+            max_df (float): Maximum document frequency of the TF-IDF terms.
+            stop_words (list): Stop words or 'english', defaults to NLTK's English stop words like the notebook.
+            random_state (int): Seed of the clusterings.
+            batch_size (int): Rows per mini-batch.
+        """
+        self.store = store
+        self.random_state = random_state
+        self.batch_size = batch_size
+        stop_words = stop_words if stop_words is not None else english_stopwords()
+        self.X, self.terms = store.tfidf(min_df=min_df, max_df=max_df, stop_words=stop_words)
+        self.model = None
+        print(f"Shape of TF-IDF matrix: {self.X.shape}")
+
+    def sweep(self, k_values=range(2, 15), workers=None):
+        """
+        Fits one clustering per K, in parallel.
+
+        Returns:
+            dict: {k: inertia}.
+        """
+        tasks = [(k, self.random_state, self.batch_size) for k in k_values]
+        inertias = {}
+        with Pool(workers, initializer=_init_worker, initargs=(self.X,)) as pool:
+            for k, inertia in tqdm(pool.imap_unordered(_fit_inertia, tasks), total=len(tasks), desc="K sweep", unit="K"):
+                inertias[k] = inertia
+        return dict(sorted(inertias.items()))
+
+    def fit(self, k):
+        self.model = fit_kmeans(self.X, k, self.random_state, self.batch_size)
+        return self.model.labels_
+
+    def top_terms(self, n=10):
+        """
+        Returns:
+            list: The n highest weighted terms of every cluster centroid.
+        """
+        top_terms = []
+        for centroid in self.model.cluster_centers_:
+            top = np.argpartition(-centroid, min(n, len(centroid) - 1))[:n]
+            top = top[np.argsort(-centroid[top], kind='stable')]
+            top_terms.append([self.terms[i] for i in top])
+        return top_terms
+
+    def project(self, n_components=2):
+        """
+        Sparse replacement of PCA.fit_transform(X.toarray()) for the cluster scatter plot.
+        """
+        return TruncatedSVD(n_components=n_components, random_state=self.random_state).fit_transform(self.X)
+
+    def clustered_frame(self, cluster_names=None):
+        """
+        Args:
+            cluster_names (dict): {cluster: name}, defaults to the three top terms of each cluster.
+
+        Returns:
+            pd.DataFrame: The columns text, cluster, cluster_name and source of the notebook.
+        """
+        if cluster_names is None:
+            cluster_names = {i: ', '.join(terms[:3]) for i, terms in enumerate(self.top_terms(3))}
+        labels = self.model.labels_
+        return pd.DataFrame({
+            'text': self.store.texts,
+            'cluster': labels,
+            'cluster_name': [cluster_names[c] for c in labels],
+            'source': self.store.metadata['period'],
+        })
+
+    def save_csvs(self, df_clustered, directory, prefix='clustered_texts'):
+        """
+        Writes one CSV per period, e.g. clustered_texts_before.csv and clustered_texts_after.csv.
+
+        Returns:
+            list: The written paths.
+        """
+        paths = []
+        for source in df_clustered['source'].unique():
+            path = os.path.join(directory, f'{prefix}_{source}.csv')
+            df_clustered[df_clustered['source'] == source].to_csv(path, index=False)
+            paths.append(path)
+        return paths
+
+
+def save_plots(directory, prefix, inertias, reduced_data, df_clustered):
+    """
+    Writes the elbow curve, the cluster projection and the per period topic distribution as PNG files.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    if inertias:
+        plt.figure(figsize=(8, 5))
+        plt.plot(list(inertias), list(inertias.values()), marker='o')
+        plt.title("Elbow Method: Optimal K")
+        plt.xlabel("Number of clusters (K)")
+        plt.ylabel("Inertia")
+        plt.grid(True)
+        plt.savefig(os.path.join(directory, f'{prefix}_elbow.png'))
+        plt.close()
+
+    plt.figure(figsize=(10, 6))
+    scatter = plt.scatter(reduced_data[:, 0], reduced_data[:, 1], c=df_clustered['cluster'], cmap='tab10', alpha=0.6, s=4)
+    plt.title("K-Means Clusters Visualized with TruncatedSVD")
+    plt.xlabel("Component 1")
+    plt.ylabel("Component 2")
+    plt.colorbar(scatter, label='Cluster')
+    plt.grid(True)
+    plt.savefig(os.path.join(directory, f'{prefix}_clusters.png'))
+    plt.close()
+
+    counts = df_clustered.groupby(['cluster_name', 'source']).size().unstack(fill_value=0)
+    props = counts.div(counts.sum(axis=0), axis=1) * 100
+    ax = props.plot(kind='bar', figsize=(12, 6), edgecolor='black')
+    ax.set_title("Normalized Topic Distribution per Period")
+    ax.set_xlabel("Topic Cluster")
+    ax.set_ylabel("Percentage of Posts")
+    ax.set_ylim(0, 100)
+    ax.set_xticklabels(props.index, rotation=30, ha='right')
+    ax.legend(title="Period")
+    plt.tight_layout()
+    plt.savefig(os.path.join(directory, f'{prefix}_distribution.png'))
+    plt.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cluster Reddit posts before and after the election into topics.")
+    parser.add_argument('--before', required=True, help="Posts JSONL file from before the election")
+    parser.add_argument('--after', required=True, help="Posts JSONL file from after the election")
+    parser.add_argument('--output-dir', default='.', help="Directory of the CSV and plot outputs")
+    parser.add_argument('--prefix', default='clustered_texts', help="Name prefix of the outputs")
+    parser.add_argument('--store', help="Directory of a DocumentTermStore to reuse, built and saved there if missing")
+    parser.add_argument('--k', type=int, help="Number of clusters, chosen from the K sweep if omitted")
+    parser.add_argument('--k-min', type=int, default=2)
+    parser.add_argument('--k-max', type=int, default=14)
+    parser.add_argument('--names', help="JSON file mapping cluster numbers to names")
+    parser.add_argument('--min-df', type=int, default=5)
+    parser.add_argument('--max-df', type=float, default=0.9)
+    parser.add_argument('--stop-words', choices=('nltk', 'english'), default='nltk',
+                        help="NLTK's English stop words like the notebook, or sklearn's built-in 'english' list")
+    parser.add_argument('--batch-size', type=int, default=4096)
+    parser.add_argument('--workers', type=int, default=None, help="Processes of the K sweep, all CPUs by default")
+    parser.add_argument('--no-plots', action='store_true', help="Do not write the PNG plots")
+    args = parser.parse_args(argv)
+
+    if args.store and os.path.exists(os.path.join(args.store, 'meta.json')):
+        store = DocumentTermStore.load(args.store)
+    else:
+        store = DocumentTermStore.build([(args.before, 'before'), (args.after, 'after')])
+        if args.store:
+            store.save(args.store)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    stop_words = 'english' if args.stop_words == 'english' else None
+    modeller = TopicModeller(store, min_df=args.min_df, max_df=args.max_df, stop_words=stop_words, batch_size=args.batch_size)
+
+    inertias = {}
+    if args.k is None or not args.no_plots:
+        inertias = modeller.sweep(range(args.k_min, args.k_max + 1), workers=args.workers)
+        with open(os.path.join(args.output_dir, f'{args.prefix}_inertias.json'), 'w', encoding='utf8') as f:
+            json.dump(inertias, f, indent=4)
+    k = args.k if args.k is not None else elbow(inertias)
+    print(f"Number of clusters: {k}")
+
+    modeller.fit(k)
+    print("Top terms per cluster:")
+    for i, terms in enumerate(modeller.top_terms(10)):
+        print(f"\nCluster {i}: {', '.join(terms)}")
+
+    cluster_names = None
+    if args.names:
+        with open(args.names, 'r', encoding='utf8') as f:
+            cluster_names = {int(cluster): name for cluster, name in json.load(f).items()}
+    df_clustered = modeller.clustered_frame(cluster_names)
+    for path in modeller.save_csvs(df_clustered, args.output_dir, args.prefix):
+        print(f"Saved {path}")
+
+    if not args.no_plots:
+        save_plots(args.output_dir, args.prefix, inertias, modeller.project(), df_clustered)
+
+
+if __name__ == "__main__":
+    # Example usage:
+    # python -m src.TopicModelling.TopicModelling --before "r_Feminism_posts(beforeElection).jsonl"
+    #     --after "r_Feminism_posts(afterElection).jsonl" --k 5 --names feminism_cluster_names.json
+    main()
@@ -1,78 +1,150 @@
-from nltk import BigramAssocMeasures, TrigramAssocMeasures, QuadgramAssocMeasures
-
 import src.PreProcessing.JsonPreprocessor as JsonPreprocessor
 import src.PreProcessing.NaturalLanguageProcessor as NaturalLanguageProcessor
 import src.TextAnalytics.KernelDensity as KernelDensity
+import src.TextAnalytics.Collocations as Collocations
+from src.PreProcessing.CorpusCache import CorpusCache
+from src.PreProcessing.TokenCorpus import TokenCorpus
+
+from src.PipelineRunner import PipelineRunner, Stage
+import src.Instrumentation as Instrumentation
 
 import os
-from nltk.collocations import *
+import json
+import shutil
+import filecmp
+import argparse
+
+
+def copy_if_changed(src_path, dst_path):
+    """
+    Copies src_path to dst_path unless dst_path already has the same content, which is compared first
+    by size and then block by block.
+    """
+    if os.path.exists(dst_path) and filecmp.cmp(src_path, dst_path, shallow=False):
+        return
+    shutil.copyfile(src_path, dst_path)
 
 
-def preprocess_text(path, posts, time):
+def preprocess_text(path, posts, time, cache=None, tokens=False):
     """
     Preprocess the text by loading the posts or comments from a JSON file, normalizing the text, and saving it to a TXT file.
     :param path: Path to the JSON file.
     :param posts: True if the file contains posts, False if it contains comments.
+    :param cache: Optional CorpusCache. If the JSON file did not change since the last run, the normalized text is copied from the cache.
+    :param tokens: Also save the normalized records as token corpus ('.tok', see TokenCorpus) next to the TXT file.
     """
     directory = os.path.dirname(path)
     filename = os.path.basename(path).split('.')[0]
+    output_path = os.path.join(directory, f"{filename}.txt")
+    corpus_path = os.path.join(directory, f"{filename}.tok") if tokens else None
 
-    if posts:
-        # Load the posts
-        processor = JsonPreprocessor.JsonPreprocessor(path, time)
-        processor.open_json_file()
-        posts = processor.parse_reddit_posts()
-        txt = processor.return_plain_text(posts)
-        print(f"Number of posts: {len(posts)}")
-    else:
-        # Load the comments
-        processor = JsonPreprocessor.JsonPreprocessor(path, time)
-        processor.open_json_file()
-        posts = processor.parse_reddit_comments()
-        txt = processor.return_plain_text(posts)
-        print(f"Number of comments: {len(posts)}")
-
-    # Normalize the text
-    nlp = NaturalLanguageProcessor.NaturalLanguageProcessor(txt)
-    nlp.save_txt(os.path.join(directory, f"{filename}.txt"))
+    if cache is not None:
+        flags = dict.fromkeys(NaturalLanguageProcessor.FLAG_NAMES, True)
+        key = cache.key('normalized_text', [path], posts=posts, time=time, flags=flags)
+        corpus_key = cache.key('token_corpus', [path], posts=posts, time=time, flags=flags) if tokens else None
+        cached_path = cache.get_file(key)
+        cached_corpus_path = cache.get_file(corpus_key, suffix='.tok') if tokens else None
+        if cached_path is not None and (not tokens or cached_corpus_path is not None):
+            try:
+                copy_if_changed(cached_path, output_path)
+                if tokens:
+                    copy_if_changed(cached_corpus_path, corpus_path)
+                print(f"Normalized text loaded from cache: {output_path}")
+                return
+            except FileNotFoundError:
+                pass  # Evicted by another stage in the meantime, normalize again
+
+    # Stream the records, normalizing and writing them one at a time
+    processor = JsonPreprocessor.JsonPreprocessor(path, time)
+    count = processor.write_plain_text(
+        output_path,
+        posts,
+        normalize=lambda text: NaturalLanguageProcessor.NaturalLanguageProcessor(text).text,
+        corpus_path=corpus_path,
+    )
+    print(f"Number of {'posts' if posts else 'comments'}: {count}")
     print("Text normalized and saved")
 
-def combine_text_files(directory, filename1, filename2):
+    if cache is not None:
+        cache.put_file(key, output_path)
+        if tokens:
+            cache.put_file(corpus_key, corpus_path, suffix='.tok')
+
+
+def combine_text_files(directory, filename1, filename2, *filenames):
     """
-    Combine two text files into one.
+    Combine two or more text files into one, separated by newlines.
+    The files are copied in blocks, so none of them is read into memory as a whole.
     :param directory: Directory where the text files are located.
     :param filename1: Name of the first text file.
     :param filename2: Name of the second text file.
+    :param filenames: Names of further text files.
+    """
+    filenames = (filename1, filename2) + filenames
+    with Instrumentation.stage('combine_text_files') as stage, \
+            open(os.path.join(directory, combined_filename(*filenames) + ".txt"), 'w', encoding='utf-8') as outfile:
+        for i, filename in enumerate(filenames):
+            if i:
+                outfile.write("\n")
+            with open(os.path.join(directory, f"{filename}.txt"), 'r', encoding='utf-8') as infile:
+                shutil.copyfileobj(infile, outfile, 1 << 20)
+            stage.add(items=1, bytes_read=Instrumentation.file_size(os.path.join(directory, f"{filename}.txt")))
+        stage.add(bytes_written=outfile.tell())
+
+
+def combined_filename(*filenames):
+    """
+    :return:
+    The name combine_text_files gives to the combination of the files, without the final '.txt'.
+    """
+    return f"{'_'.join(filenames)}_combined.txt"
+
+
+def combine_token_corpora(directory, filename1, filename2, *filenames):
     """
-    with open(os.path.join(directory, f"{filename1}.txt"), 'r', encoding='utf-8') as f1, \
-         open(os.path.join(directory, f"{filename2}.txt"), 'r', encoding='utf-8') as f2, \
-         open(os.path.join(directory, f"{filename1}_{filename2}_combined.txt.txt"), 'w', encoding='utf-8') as outfile:
-        outfile.write(f1.read() + "\n" + f2.read())
+    Token corpus counterpart of combine_text_files. Writes a view over the '.tok' files of the periods
+    (see TokenCorpus.save_view) instead of copying their tokens.
+    """
+    filenames = (filename1, filename2) + filenames
+    TokenCorpus.save_view(os.path.join(directory, combined_filename(*filenames) + ".tok.json"),
+                          [os.path.join(directory, f"{filename}.tok") for filename in filenames])
 
 
-def kernelDensityEstimation(directory, filename):
+def kernelDensityEstimation(directory, filename, suffix='.txt'):
     """
     Generate Kernel Density Estimation for the given text file and save it to a new file.
     :param directory:
     :param filename:
+    :param suffix: '.txt', or '.tok' / '.tok.json' to read the token corpus with the native backend.
     :return:
     """
     # Create the kernel density graph
-    kernel_density = KernelDensity.KernelDensity(os.path.join(directory, f"{filename}.txt"))
-    kernel_density.build_graph()
-    kernel_density.save_graph(os.path.join(directory, filename))
+    with Instrumentation.stage('kernelDensityEstimation') as stage:
+        kernel_density = KernelDensity.KernelDensity(os.path.join(directory, f"{filename}{suffix}"),
+                                                     backend='textplot' if suffix == '.txt' else 'native')
+        kernel_density.build_graph()
+        kernel_density.save_graph(os.path.join(directory, filename))
+        stage.add(items=kernel_density.graph.graph.number_of_nodes(),
+                  bytes_read=Instrumentation.file_size(os.path.join(directory, f"{filename}{suffix}")))
 
 
-def wordCollolcations(directory, filename):
+def wordCollolcations(directory, filename, suffix='.txt'):
     """
     Generate word collocations for the given text file and save them to a new file.
     :param directory:
     :param filename:
+    :param suffix: '.txt', or '.tok' / '.tok.json' to count the token IDs of the token corpus.
     """
     coll = []
 
-    with open(os.path.join(directory, f"{filename}.txt"), 'r', encoding='utf-8') as f:
-        text_content = f.read()
+    if suffix != '.txt':
+        with Instrumentation.stage('wordCollocations.count') as stage:
+            engine = Collocations.CollocationEngine.from_corpus(TokenCorpus.load(os.path.join(directory, f"{filename}{suffix}")))
+            stage.add(items=engine.n_words)
+        n_words = engine.n_words
+    else:
+        with open(os.path.join(directory, f"{filename}.txt"), 'r', encoding='utf-8') as f:
+            text_content = f.read()
 
         # Split the text into words
         # This assumes words are separated by whitespace.
@@ -81,49 +153,47 @@ def wordCollolcations(directory, filename):
         words = text_content.split()
         # from nltk.tokenize import word_tokenize
         # words = word_tokenize(text_content.lower()) # Example with NLTK tokenizer and lowercasing
+        n_words = len(words)
+
+        # Count all n-grams once, the frequency filters below only select from the precomputed ranking
+        with Instrumentation.stage('wordCollocations.count') as stage:
+            engine = Collocations.CollocationEngine.from_words(words)
+            stage.add(items=len(words), bytes_read=len(text_content))
+        del words, text_content
+
+    if not n_words:
+        print(f"Warning: The file {filename}{suffix} seems to be empty or contains no words after splitting.")
+        # Still write the (empty) output, so the pipeline treats the stage as up to date
+        with open(os.path.join(directory, f"{filename}_collocations.txt"), 'w', encoding='utf-8') as outfile:
+            outfile.write("Bigrams:\n\nTrigrams:\n\nQuadgrams:\n")
+        return
+
+    # --- Bigram Collocations ---
+    print("\n--- Bigram Collocations ---")
+    bigram_filter = max(n_words // 1000, 2)  # Start with a reasonable initial filter
+    coll2, tried = engine.search_threshold(2, bigram_filter, max(n_words // 10000, 2))  # Decrease the filter
+    for bigram_filter, results in tried:
+        print(f"Bigram filter: {bigram_filter}, Results: {results}")
+    coll.append(coll2)
+    print(coll2)
+
+    # --- Trigram Collocations ---
+    print("\n--- Trigram Collocations ---")
+    trigram_filter = max(n_words // 2000, 2)  # Start with a reasonable initial filter
+    coll3, tried = engine.search_threshold(3, trigram_filter, max(n_words // 10000, 2))  # Decrease the filter
+    for trigram_filter, results in tried:
+        print(f"Trigram filter: {trigram_filter}, Results: {results}")
+    coll.append(coll3)
+    print(coll3)
 
-        if not words:
-            print(f"Warning: The file {filename}.txt seems to be empty or contains no words after splitting.")
-            return
-
-        # --- Bigram Collocations ---
-        print("\n--- Bigram Collocations ---")
-        bigram_filter = max(len(words) // 1000, 2)  # Start with a reasonable initial filter
-        coll2 = []
-        while len(coll2) < 10 and bigram_filter > 1:
-            bigram_finder = BigramCollocationFinder.from_words(words)
-            bigram_finder.apply_freq_filter(bigram_filter)
-            coll2 = bigram_finder.nbest(BigramAssocMeasures.likelihood_ratio, 30)  # Keep a limit
-            print(f"Bigram filter: {bigram_filter}, Results: {len(coll2)}")
-            bigram_filter -= max(len(words) // 10000, 2)  # Decrease the filter
-        coll.append(coll2)
-        print(coll2)
-
-        # --- Trigram Collocations ---
-        print("\n--- Trigram Collocations ---")
-        trigram_filter = max(len(words) // 2000, 2)  # Start with a reasonable initial filter
-        coll3 = []
-        while len(coll3) < 10 and trigram_filter > 1:
-            trigram_finder = TrigramCollocationFinder.from_words(words)
-            trigram_finder.apply_freq_filter(trigram_filter)
-            coll3 = trigram_finder.nbest(TrigramAssocMeasures.likelihood_ratio, 30)  # Keep a limit
-            print(f"Trigram filter: {trigram_filter}, Results: {len(coll3)}")
-            trigram_filter -= max(len(words) // 10000, 2)  # Decrease the filter
-        coll.append(coll3)
-        print(coll3)
-
-        # --- Quadgram Collocations ---
-        print("\n--- Quadgram Collocations ---")
-        fourgram_filter = max(len(words) // 3000, 2)  # Start with a reasonable initial filter
-        coll4 = []
-        while len(coll4) < 10 and fourgram_filter > 1:
-            fourgram_finder = QuadgramCollocationFinder.from_words(words)
-            fourgram_finder.apply_freq_filter(fourgram_filter)
-            coll4 = fourgram_finder.nbest(QuadgramAssocMeasures.likelihood_ratio, 30)  # Keep a limit
-            print(f"Quadgram filter: {fourgram_filter}, Results: {len(coll4)}")
-            fourgram_filter -= max(len(words) // 10000, 2)  # Decrease the filter
-        coll.append(coll4)
-        print(coll4)
+    # --- Quadgram Collocations ---
+    print("\n--- Quadgram Collocations ---")
+    fourgram_filter = max(n_words // 3000, 2)  # Start with a reasonable initial filter
+    coll4, tried = engine.search_threshold(4, fourgram_filter, max(n_words // 10000, 2))  # Decrease the filter
+    for fourgram_filter, results in tried:
+        print(f"Quadgram filter: {fourgram_filter}, Results: {results}")
+    coll.append(coll4)
+    print(coll4)
 
     # Save collocations to a file
     with open(os.path.join(directory, f"{filename}_collocations.txt"), 'w', encoding='utf-8') as outfile:
@@ -138,31 +208,82 @@ def wordCollolcations(directory, filename):
             outfile.write(f"{item}\n")
 
 
-if __name__ == "__main__":
-    directory = 'C:/Users/marti/documents/Text-Analytics-in-the-Digital-Humanities/data/reddit/MensRights'
-    posts_filename_after = 'r_MensRights_posts(afterElection).jsonl'
-    comments_filename_after = 'r_MensRights_comments(afterElection).jsonl'
+def build_stages(config, cache=True):
+    """
+    Builds the pipeline stages for every subreddit of the configuration: normalizing the posts and comments
+    of each period, combining the periods, and the kernel density estimation (and optionally the word
+    collocations) of the combined texts. With "corpus": "tokens" the records are also saved as token
+    corpora, which are combined by views and read by the analyses instead of the text files.
+    :param config: Dictionary, see pipeline_config.json.
+    :param cache: Use a CorpusCache in each subreddit directory for the normalized texts.
+    :return:
+    List of Stage.
+    """
+    tokens = config.get('corpus', 'text') == 'tokens'
+    input_suffix = config.get('input_suffix', '.jsonl')  # e.g. '.jsonl.zst' to read the compressed dumps
+    stages = []
+    for subreddit in config['subreddits']:
+        directory = os.path.join(config['data_directory'], subreddit)
+        corpus_cache = CorpusCache(os.path.join(directory, '.corpus_cache')) if cache else None
 
-    posts_filename_before = 'r_MensRights_posts(beforeElection).jsonl'
-    comments_filename_before = 'r_MensRights_comments(beforeElection).jsonl'
+        for kind in ('posts', 'comments'):
+            # Remove the input suffix from the filenames
+            filenames = [f"r_{subreddit}_{kind}({period['name']})" for period in config['periods']]
+            for period, filename in zip(config['periods'], filenames):
+                stages.append(Stage(f"{subreddit}: preprocess {filename}", preprocess_text,
+                                    (os.path.join(directory, f"{filename}{input_suffix}"), kind == 'posts', period['time'], corpus_cache, tokens),
+                                    inputs=[os.path.join(directory, f"{filename}{input_suffix}")],
+                                    outputs=[os.path.join(directory, f"{filename}.txt")]
+                                    + ([os.path.join(directory, f"{filename}.tok")] if tokens else [])))
 
-    combined_posts_filename = f"{posts_filename_after[:-6]}_{posts_filename_before[:-6]}_combined.txt"
-    combined_comments_filename = f"{comments_filename_after[:-6]}_{comments_filename_before[:-6]}_combined.txt"
+            # With a single period its text is analysed directly, token corpora of several periods through a view
+            combined = combined_filename(*filenames) if len(filenames) > 1 else filenames[0]
+            suffix = ('.tok.json' if len(filenames) > 1 else '.tok') if tokens else '.txt'
+            combined_path = os.path.join(directory, f"{combined}{suffix}")
+            sources = [os.path.join(directory, f"{filename}{'.tok' if tokens else '.txt'}") for filename in filenames]
+            if len(filenames) > 1:
+                stages.append(Stage(f"{subreddit}: combine {kind}", combine_token_corpora if tokens else combine_text_files,
+                                    [directory] + filenames, inputs=sources, outputs=[combined_path]))
+
+            # A view does not change when the corpora it combines do, so the analyses depend on those as well
+            inputs = [combined_path] + (sources if tokens and len(filenames) > 1 else [])
+            if 'kde' in config.get('stages', ('kde',)):
+                stages.append(Stage(f"{subreddit}: kernel density {kind}", kernelDensityEstimation, (directory, combined, suffix),
+                                    inputs=inputs, outputs=[os.path.join(directory, f"{combined}.graphml")]))
+            if 'collocations' in config.get('stages', ('kde',)):
+                stages.append(Stage(f"{subreddit}: collocations {kind}", wordCollolcations, (directory, combined, suffix),
+                                    inputs=inputs, outputs=[os.path.join(directory, f"{combined}_collocations.txt")]))
+    return stages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the preprocessing and text analytics pipeline.")
+    parser.add_argument('--config', default=os.path.join(os.path.dirname(__file__), 'pipeline_config.json'),
+                        help="JSON file with the data directory, subreddits and periods")
+    parser.add_argument('--workers', type=int, default=None, help="Number of processes, all CPUs by default")
+    parser.add_argument('--check', choices=('mtime', 'hash'), default='mtime',
+                        help="Skip stages whose outputs are newer than their inputs, or whose input content did not change")
+    parser.add_argument('--force', action='store_true', help="Run every stage, even if it is up to date")
+    parser.add_argument('--instrument', metavar='JSONL', help="Record time, items, bytes and peak memory of every stage to this file")
+    parser.add_argument('--profile-stage', action='append', default=[], metavar='NAME',
+                        help="Run the instrumented stage NAME under cProfile, e.g. JsonPreprocessor.write_plain_text")
+    args = parser.parse_args()
 
-    # Preprocess the text
-    preprocess_text(os.path.join(directory, posts_filename_before), True, "beforeTheElection")
-    preprocess_text(os.path.join(directory, comments_filename_before), False, "beforeTheElection")
-    preprocess_text(os.path.join(directory, posts_filename_after), True, "afterTheElection")
-    preprocess_text(os.path.join(directory, comments_filename_after), False, "afterTheElection")
+    if args.instrument:
+        Instrumentation.enable(args.instrument, profile=args.profile_stage)
 
-    # Append the posts and comments from the second set of files
-    combine_text_files(directory, posts_filename_after[:-6], posts_filename_before[:-6])  # Remove '.jsonl' from filename
-    combine_text_files(directory, comments_filename_after[:-6], comments_filename_before[:-6])  # Remove '.jsonl' from filename
+    with open(args.config, 'r', encoding='utf-8') as config_file:
+        config = json.load(config_file)
 
-    # Generate Kernel Density Estimation for posts and comments
-    kernelDensityEstimation(directory, combined_posts_filename)
-    kernelDensityEstimation(directory, combined_comments_filename)
+    runner = PipelineRunner(build_stages(config), workers=args.workers, check=args.check, force=args.force,
+                            state_path=os.path.join(config['data_directory'], '.pipeline_state.json'))
+    status = runner.run()
+    for name, result in status.items():
+        print(f"{result:>8}: {name}")
 
-    # Generate word collocations for posts and comments
-    # wordCollolcations(directory, posts_filename)
-    # wordCollolcations(directory, comments_filename)
+    if args.instrument:
+        records = Instrumentation.read_records(args.instrument)
+        Instrumentation.write_csv(records, os.path.splitext(args.instrument)[0] + '.csv')
+        for total in Instrumentation.summary(records):
+            print(f"{total['stage']}: {total['runs']} runs, {total['wall_seconds']:.2f} s, {total['items']} items, "
+                  f"peak {total['peak_rss_bytes'] / (1 << 20):.1f} MiB")